@@ -0,0 +1,155 @@
+"""Benchmarks the ngram balancing solvers, either on a workspace's candidate
+pairs (after the ngram scoring step), or on synthetic words, scores,
+categories and candidates (if no workspace is given).
+
+The balance objective (0 being a perfect balance) is reported against the
+runtime of the greedy solver and of the local search, for several time
+budgets, along with the deviation from 0.5 of the greedy solver's
+per-category scores statistics.
+
+Usage: python -m paraphone.benchmarks.balancer workspaces/my_workspace/ --budgets 1 10 60
+       python -m paraphone.benchmarks.balancer --num-words 100000 --num-categories 50
+"""
+import argparse
+import random
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ..ngrams_tools import FakeWordsBalancer, LocalSearchBalancer, WordCategory, WordId, abs_sum_score_fn
+from ..tasks.filters.ngrams import NgramBalanceScoresTask, BALANCING_SEED
+from ..utils import logger
+from ..workspace import Workspace
+
+
+def synthetic_balancing_data(num_words: int, num_candidates: int, num_categories: int,
+                             num_scores: int, seed: int) \
+        -> Tuple[np.ndarray, Dict[WordId, WordCategory], Dict[WordId, List[WordId]]]:
+    """Generates words' scores, categories and candidates, shaped like the
+    balancer's inputs. Each word has between 1 and `num_candidates` candidates,
+    whose scores are noisy versions of the word's scores (with ties and
+    zero-probability scores, as for real ngram scores)."""
+    rng = np.random.default_rng(seed)
+    candidates_counts = rng.integers(1, num_candidates + 1, size=num_words)
+    words_scores = rng.normal(-20, 5, size=(num_words, num_scores)).round(1)
+    candidates_scores = (np.repeat(words_scores, candidates_counts, axis=0)
+                         + rng.normal(0, 3, size=(candidates_counts.sum(), num_scores)).round(1))
+    candidates_scores[rng.random(candidates_scores.shape) < 0.01] = -np.inf
+    categories = rng.integers(num_categories, size=num_words).tolist()
+
+    # words have the first ids, followed by the candidates of each word
+    scores = np.concatenate([words_scores, candidates_scores])
+    word_categories = {word_id: (category,) for word_id, category in enumerate(categories)}
+    candidates_ends = (num_words + np.cumsum(candidates_counts)).tolist()
+    word_nonword_pairs = {word_id: list(range(candidates_end - candidates_count, candidates_end))
+                          for word_id, (candidates_end, candidates_count)
+                          in enumerate(zip(candidates_ends, candidates_counts.tolist()))}
+    return scores, word_categories, word_nonword_pairs
+
+
+def bench_balancer(balancer: FakeWordsBalancer) -> Tuple[float, int]:
+    start = time.perf_counter()
+    pairs_count = sum(1 for _ in balancer.iter_balanced_pairs())
+    return time.perf_counter() - start, pairs_count
+
+
+def scores_deviations(balancer: FakeWordsBalancer) -> Tuple[float, float]:
+    """Mean and max deviation from 0.5 of the current scores of the categories
+    that received words (the words counter of a category starts at 1)"""
+    deviations = np.abs(np.array([stats.current_scores for stats
+                                  in balancer.categories_stats.values()
+                                  if stats.current_words_counter > 1]) - 0.5)
+    if deviations.size == 0:
+        return float("nan"), float("nan")
+    return float(deviations.mean()), float(deviations.max())
+
+
+def bench_solver(task: NgramBalanceScoresTask, workspace: Workspace, corpus_id: int):
+    random.seed(BALANCING_SEED + corpus_id)
+    start = time.perf_counter()
+    balancer = task.build_balancer(workspace, corpus_id)
+    setup_time = time.perf_counter() - start
+    solve_time, pairs_count = bench_balancer(balancer)
+    return balancer, setup_time, solve_time, pairs_count
+
+
+def bench_synthetic(args: argparse.Namespace):
+    logger.info(f"Generating {args.num_words} words, with up to {args.num_candidates} "
+                f"candidates each, in {args.num_categories} categories")
+    words_scores, word_categories, word_nonword_pairs = synthetic_balancing_data(
+        args.num_words, args.num_candidates, args.num_categories, args.num_scores, args.seed)
+
+    random.seed(BALANCING_SEED)
+    start = time.perf_counter()
+    balancer = FakeWordsBalancer(words_scores, word_categories, word_nonword_pairs,
+                                 objective_fn=abs_sum_score_fn, num_to_keep=args.num_to_keep)
+    setup_time = time.perf_counter() - start
+    solve_time, pairs_count = bench_balancer(balancer)
+    mean_deviation, max_deviation = scores_deviations(balancer)
+    logger.info(f"[greedy] setup: {setup_time:.2f}s, runtime: {solve_time:.2f}s for {pairs_count} "
+                f"pairs ({args.num_words / solve_time:.0f} words/s)")
+    logger.info(f"[greedy] objective: {balancer.balance_objective():.5f}, categories scores "
+                f"deviation from 0.5: {mean_deviation:.5f} (mean), {max_deviation:.5f} (max)")
+
+    for budget in args.budgets:
+        random.seed(BALANCING_SEED)
+        balancer = LocalSearchBalancer(words_scores, word_categories, word_nonword_pairs,
+                                       objective_fn=abs_sum_score_fn, num_to_keep=args.num_to_keep,
+                                       time_budget=budget)
+        solve_time, _ = bench_balancer(balancer)
+        logger.info(f"[local-search, budget {budget:g}s] objective: {balancer.objective:.5f}, "
+                    f"runtime: {solve_time:.2f}s ({balancer.moves_count} moves "
+                    f"in {balancer.passes_count} passes)")
+
+
+def main():
+    argparser = argparse.ArgumentParser("paraphone.benchmarks.balancer")
+    argparser.add_argument("workspace_path", type=Path, nargs="?",
+                           help="Path to workspace (synthetic data is used if not given)")
+    argparser.add_argument("-c", "--corpus", type=int, action="append", dest="corpora",
+                           help="Only benchmark the given corpus (can be repeated)")
+    argparser.add_argument("--budgets", type=float, nargs="+", default=[1., 10., 60.],
+                           help="Time budgets (in seconds) of the local search")
+    argparser.add_argument("--num-to-keep", type=int, default=1)
+    synthetic_group = argparser.add_argument_group("synthetic data")
+    synthetic_group.add_argument("--num-words", type=int, default=100000)
+    synthetic_group.add_argument("--num-candidates", type=int, default=10,
+                                 help="Maximum number of candidates per word")
+    synthetic_group.add_argument("--num-categories", type=int, default=50)
+    synthetic_group.add_argument("--num-scores", type=int, default=4)
+    synthetic_group.add_argument("--seed", type=int, default=BALANCING_SEED)
+    args = argparser.parse_args()
+
+    if args.workspace_path is None:
+        bench_synthetic(args)
+        return
+
+    workspace = Workspace(args.workspace_path)
+    task = NgramBalanceScoresTask(num_to_keep=args.num_to_keep)
+    corpora = task.find_corpora(workspace.corpora / Path("tokenized/"))
+    for corpus_id, _ in corpora:
+        if args.corpora is not None and corpus_id not in args.corpora:
+            continue
+
+        task.solver = "greedy"
+        balancer, setup_time, solve_time, pairs_count = bench_solver(task, workspace, corpus_id)
+        logger.info(f"[corpus {corpus_id}] {len(balancer.word_nonword_pairs)} words, "
+                    f"{len(balancer.categories)} categories, setup: {setup_time:.2f}s")
+        mean_deviation, max_deviation = scores_deviations(balancer)
+        logger.info(f"[corpus {corpus_id}][greedy] objective: {balancer.balance_objective():.5f}, "
+                    f"runtime: {solve_time:.2f}s for {pairs_count} pairs, categories scores "
+                    f"deviation from 0.5: {mean_deviation:.5f} (mean), {max_deviation:.5f} (max)")
+
+        task.solver = "local-search"
+        for budget in args.budgets:
+            task.time_budget = budget
+            balancer, _, solve_time, _ = bench_solver(task, workspace, corpus_id)
+            logger.info(f"[corpus {corpus_id}][local-search, budget {budget:g}s] "
+                        f"objective: {balancer.objective:.5f}, runtime: {solve_time:.2f}s "
+                        f"({balancer.moves_count} moves in {balancer.passes_count} passes)")
+
+
+if __name__ == '__main__':
+    main()
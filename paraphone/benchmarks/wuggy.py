@@ -0,0 +1,67 @@
+"""Benchmarks the wuggy candidates generation on a workspace's lexicon,
+with a single generator loaded on the full lexicon ("full") and with one
+generator per syllables count bucket ("buckets").
+
+Usage: python -m paraphone.benchmarks.wuggy workspaces/my_workspace/ -n 500
+"""
+import argparse
+import random
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Optional, List
+
+from ..tasks.wuggy_gen import WuggyGenerator, WUGGY_SEED, word_seed
+from ..utils import logger
+from ..workspace import Workspace
+from ..wuggy_plugins import phonetic_fr_ipa, phonetic_en_ipa
+
+
+def bench_generator(words: List[str], lexicon_path: Path, wuggy_plugin: ModuleType,
+                    num_candidates: int, buckets_folder: Optional[Path]):
+    start = time.perf_counter()
+    generator = WuggyGenerator(lexicon_path, wuggy_plugin, num_candidates,
+                               buckets_folder=buckets_folder)
+    # for the bucketed generator, loading is lazy: the buckets are
+    # loaded once before timing the generation
+    for word in words:
+        generator.generator_for(generator.lookup(word))
+    load_time = time.perf_counter() - start
+
+    candidates_count = 0
+    start = time.perf_counter()
+    for word in words:
+        random.seed(word_seed(word))
+        candidates, _ = generator.generate_candidates(word)
+        candidates_count += len(candidates)
+    generation_time = time.perf_counter() - start
+    return load_time, generation_time, candidates_count
+
+
+def main():
+    argparser = argparse.ArgumentParser("paraphone.benchmarks.wuggy")
+    argparser.add_argument("workspace_path", type=Path, help="Path to workspace")
+    argparser.add_argument("-n", "--num-words", type=int, default=200,
+                           help="Number of (randomly sampled) words to generate candidates for")
+    argparser.add_argument("--num-candidates", type=int, default=10)
+    args = argparser.parse_args()
+
+    workspace = Workspace(args.workspace_path)
+    wuggy_plugin = phonetic_fr_ipa if workspace.config["lang"] == "fr" else phonetic_en_ipa
+    lexicon_path = workspace.wuggy / Path("lexicon.csv")
+    buckets_folder = workspace.wuggy / Path("buckets")
+    with open(workspace.wuggy / Path("words.txt")) as words_file:
+        words = sorted({word for word in words_file.read().split("\n") if word})
+    words = random.Random(WUGGY_SEED).sample(words, min(args.num_words, len(words)))
+
+    for mode, folder in [("full", None), ("buckets", buckets_folder)]:
+        logger.info(f"Benchmarking wuggy generation with lexicon mode '{mode}'")
+        load_time, generation_time, candidates_count = bench_generator(
+            words, lexicon_path, wuggy_plugin, args.num_candidates, folder)
+        logger.info(f"[{mode}] loading: {load_time:.2f}s, generation: {generation_time:.2f}s "
+                    f"for {len(words)} words, {candidates_count} candidates "
+                    f"({candidates_count / generation_time:.1f} candidates/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,8 @@ from builtins import hasattr
 from pathlib import Path
 
 from .commands import WorkspaceInitCommand, ImportCommand, SetupDictionnaryCommand, TokenizeCommand, PhonemizeCommand, \
-    SyllabifyCommand, WuggyCommand, CorporaCommand, StatsCommand, FilterCommand, CommandGroup, SynthCommand
+    SyllabifyCommand, WuggyCommand, CorporaCommand, StatsCommand, FilterCommand, CommandGroup, SynthCommand, \
+    TrainCommand
 from ..utils import stream_handler
 
 argparser = argparse.ArgumentParser("paraphone")
@@ -15,8 +16,8 @@ subparsers = argparser.add_subparsers()
 
 commands = [WorkspaceInitCommand, ImportCommand, SetupDictionnaryCommand,
             TokenizeCommand, PhonemizeCommand, SyllabifyCommand,
-            WuggyCommand, CorporaCommand, StatsCommand, FilterCommand,
-            SynthCommand]
+            WuggyCommand, TrainCommand, CorporaCommand, StatsCommand,
+            FilterCommand, SynthCommand]
 
 for command in commands:
     subparser = subparsers.add_parser(command.COMMAND)
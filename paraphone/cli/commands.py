@@ -4,11 +4,13 @@ from os import cpu_count
 from pathlib import Path
 from typing import List, Type, Union
 
+from ..ngrams_tools import NgramModelSpec
 from ..tasks.base import BaseTask
-from ..tasks.corpora import CorporaCreationTask, BuildZeroSpeechTestSetsTask
+from ..tasks.corpora import CorporaCreationTask, BuildZeroSpeechTestSetsTask, LINK_MODES
 from ..tasks.dictionaries import CMUFRSetupTask, LexiqueSetupTask, INSEESetupTask, CMUENSetupTask, CelexSetupTask, \
     PhonemizerSetupTask
-from ..tasks.filters.ngrams import NgramScoringTask, NgramBalanceScoresTask
+from ..tasks.filters.ngrams import NgramScoringTask, NgramBalanceScoresTask, BALANCING_SOLVERS
+from ..tasks.filters.pipeline import FusedFilteringTask
 from ..tasks.filters.simple import InitFilteringTask, RandomFilterTask, RandomPairFilterTask, EqualsFilterTask, \
     LevenshteinFilterTask, MostFrequentHomophoneFilterTask, WuggyHomophonesFilterTask
 from ..tasks.imports import DatasetImportTask, FamiliesImportTask, ImportGoogleSpeakCredentials
@@ -18,6 +20,7 @@ from ..tasks.syllabify import SyllabifyFrenchTask, SyllabifyEnglishTask
 from ..tasks.synth import CorporaPhoneticSynthesisTask, TestSynthesisTask, CorporaTextSynthesisTask, \
     BaseSpeechSynthesisTask
 from ..tasks.tokenize import TokenizeFrenchTask, TokenizeEnglishTask
+from ..tasks.training import NgramsTrainTask
 from ..tasks.workspace_init import WorkspaceInitTask
 from ..tasks.wuggy_gen import WuggyPrepareTask, WuggyGenerationFrTask, WuggyGenerationEnTask
 from ..utils import setup_file_handler, logger
@@ -209,9 +212,17 @@ class CorpusGenCommand(BaseCommand):
     COMMAND = "generate"
     DESCRIPTION = "Generate words list for corpora"
 
+    @classmethod
+    def init_parser(cls, parser: ArgumentParser):
+        parser.add_argument('--num-workers', '-w', default=cpu_count(), type=int,
+                            help="Number of processes loading the texts and intersecting the families")
+        parser.add_argument("--family", type=int,
+                            help="Only recompute the given family (reusing the other families' "
+                                 "cached intersections), and the corpora it affects")
+
     @classmethod
     def build_task(cls, args: Namespace, workspace: Workspace):
-        return CorporaCreationTask()
+        return CorporaCreationTask(num_workers=args.num_workers, family=args.family)
 
 
 class SynthTestCommand(BaseCommand):
@@ -280,15 +291,20 @@ class ZeroSpeechGenCommand(BaseCommand):
                             help="Select one corpus")
         parser.add_argument("--use_grapheme", action="store_true",
                             help="Use grapheme form os synthesis for real words")
-
-
+        parser.add_argument("--link-mode", choices=LINK_MODES, default="copy",
+                            help="How audio files are put in the testsets folders "
+                                 "(reflink falls back to copy if the filesystem doesn't support it)")
+        parser.add_argument("--num-threads", type=int, default=16,
+                            help="Number of threads copying or linking the audio files")
 
     @classmethod
     def build_task(cls, args: Namespace, workspace: Workspace) -> Union[BaseTask, List[BaseTask]]:
         real_word_synth = "text" if args.use_grapheme else "phonetic"
         return BuildZeroSpeechTestSetsTask(args.output_folder,
                                            real_word_synth, # noqa
-                                           args.for_corpus)
+                                           args.for_corpus,
+                                           link_mode=args.link_mode,
+                                           num_threads=args.num_threads)
 
 
 class CorporaCommand(CommandGroup):
@@ -336,8 +352,21 @@ class WuggyCommand(BaseCommand):
                                  '(for some words, the number of candidates '
                                  'can be less than NUM_CANDIDATES)')
         parser.add_argument('--high-overlap', action="store_true",
-                            help='if set, only allows overlap rate of the form (n-1)/n.'
-                                 ' Slows down dramatically computations if set.')
+                            help='if set, only allows overlap rate of the form (n-1)/n '
+                                 '(candidates differ from the word by a single sub-syllabic '
+                                 'segment).')
+        parser.add_argument('--cache-dir', type=Path,
+                            help='folder of a wuggy candidates cache, which can be shared '
+                                 'between workspaces. Words whose candidates are found in '
+                                 'the cache are not regenerated.')
+        parser.add_argument('--max-seconds-per-word', type=float,
+                            help='time budget for the generation of a single word\'s '
+                                 'candidates. Words exceeding it are recorded in the '
+                                 'wuggy stats.')
+        parser.add_argument('--stop-at-num-candidates', action="store_true",
+                            help='if set, a word\'s generation stops as soon as NUM_CANDIDATES '
+                                 'candidates are found (by default, each of the next frequency '
+                                 'filter rounds can still add a candidate).')
 
     @classmethod
     def build_task(cls, args: Namespace, workspace: Workspace) -> Union[BaseTask, List[BaseTask]]:
@@ -345,7 +374,10 @@ class WuggyCommand(BaseCommand):
         lang = workspace.config["lang"]
         kwargs = {'num_candidates': args.num_candidates,
                   'high_overlap': args.high_overlap,
-                  'num_workers': args.num_workers}
+                  'num_workers': args.num_workers,
+                  'cache_folder': args.cache_dir,
+                  'max_seconds_per_word': args.max_seconds_per_word,
+                  'stop_at_num_candidates': args.stop_at_num_candidates}
         if lang == "fr":
             tasks.append(WuggyGenerationFrTask(**kwargs))
         else:
@@ -354,6 +386,28 @@ class WuggyCommand(BaseCommand):
         return tasks
 
 
+class TrainNgramsCommand(BaseCommand):
+    COMMAND = "ngrams"
+    DESCRIPTION = "Train the phonotactic ngram models on the syllabified words"
+
+    @classmethod
+    def init_parser(cls, parser: ArgumentParser):
+        parser.add_argument("--ngram-model", action="append", type=NgramModelSpec.parse,
+                            dest="ngram_models", metavar="ORDER[:SMOOTHING[:PARAM]]",
+                            help="Additional smoothed ngram model, e.g. 3:kneser-ney or "
+                                 "4:add-k:0.5 (can be repeated)")
+
+    @classmethod
+    def build_task(cls, args: Namespace, workspace: Workspace) -> Union[BaseTask, List[BaseTask]]:
+        return NgramsTrainTask(models=args.ngram_models)
+
+
+class TrainCommand(CommandGroup):
+    COMMAND = "train"
+    DESCRIPTION = "Train models used by the pipeline"
+    SUBCOMMANDS = [TrainNgramsCommand]
+
+
 class FilterInitCommand(BaseCommand):
     COMMAND = "init"
     DESCRIPTION = "Initialize filtering"
@@ -393,10 +447,16 @@ class FilterLevenshteinCommand(BaseCommand):
     @classmethod
     def init_parser(cls, parser: ArgumentParser):
         parser.add_argument("-th", "--threshold", default=2, type=int)
+        parser.add_argument('--num-workers', '-w', default=cpu_count(), type=int,
+                            help="Number of threads computing the edit distances")
+        parser.add_argument("--sweep", action="store_true",
+                            help="Also compute the histogram of edit distances (written to "
+                                 "the stats folder), to help choosing the threshold")
 
     @classmethod
     def build_task(cls, args: Namespace, workspace: Workspace) -> Union[BaseTask, List[BaseTask]]:
-        return LevenshteinFilterTask(args.threshold)
+        return LevenshteinFilterTask(args.threshold, num_workers=args.num_workers,
+                                     sweep=args.sweep)
 
 
 class FilterEqualsCommand(BaseCommand):
@@ -433,11 +493,37 @@ class FilterNgramCommand(BaseCommand):
     @classmethod
     def init_parser(cls, parser: ArgumentParser):
         parser.add_argument("-c", "--corpus", type=int, help="Only run for a given corpus")
-        parser.add_argument("--num-to-keep", type=int, help="Number of non-words to keep")
+        parser.add_argument("--num-to-keep", type=int, default=1,
+                            help="Number of non-words to keep for each word")
+        parser.add_argument("--single-pass", action="store_true",
+                            help="Write the pairs of all corpora in a single pass over "
+                                 "the last filtering step")
+        parser.add_argument('--num-workers', '-w', default=cpu_count(), type=int,
+                            help="Number of corpora balanced in parallel")
+        parser.add_argument("--ngram-model", action="append", type=NgramModelSpec.parse,
+                            dest="ngram_models", metavar="ORDER[:SMOOTHING[:PARAM]]",
+                            help="Additional smoothed ngram model, e.g. 3:kneser-ney or "
+                                 "4:add-k:0.5 (can be repeated). Each model adds a score "
+                                 "column, named like 3gram_kneser-ney")
+        parser.add_argument("--criteria", nargs="+",
+                            help="Scores used to balance words and nonwords "
+                                 "(defaults to all scores)")
+        parser.add_argument("--solver", choices=BALANCING_SOLVERS, default="greedy",
+                            help="Balancing solver: a single greedy pass, or a local "
+                                 "search improving the greedy solution")
+        parser.add_argument("--time-budget", type=float, default=60.,
+                            help="Time budget (in seconds) of the local search, for each corpus")
 
     @classmethod
     def build_task(cls, args: Namespace, workspace: Workspace) -> Union[BaseTask, List[BaseTask]]:
-        return [NgramScoringTask(), NgramBalanceScoresTask(args.corpus, args.num_to_keep)]
+        return [NgramsTrainTask(models=args.ngram_models),
+                NgramScoringTask(models=args.ngram_models),
+                NgramBalanceScoresTask(args.corpus, args.num_to_keep,
+                                       single_pass=args.single_pass,
+                                       num_workers=args.num_workers,
+                                       criteria=args.criteria,
+                                       solver=args.solver,
+                                       time_budget=args.time_budget)]
 
 
 class FullDefaultFilteringPipelineCommand(BaseCommand):
@@ -445,15 +531,39 @@ class FullDefaultFilteringPipelineCommand(BaseCommand):
     DESCRIPTION = "Full default filtering pipeline (equals pairs, homophones, " \
                   "wuggy-homophones, levenshtein and ngrams)"
 
+    @classmethod
+    def init_parser(cls, parser: ArgumentParser):
+        parser.add_argument("--write-steps", action="store_true",
+                            help="Also write the output of the intermediate filtering steps")
+        parser.add_argument('--num-workers', '-w', default=cpu_count(), type=int,
+                            help="Number of threads computing the levenshtein distances, "
+                                 "and of processes balancing the corpora")
+        parser.add_argument("--ngram-model", action="append", type=NgramModelSpec.parse,
+                            dest="ngram_models", metavar="ORDER[:SMOOTHING[:PARAM]]",
+                            help="Additional smoothed ngram model, e.g. 3:kneser-ney or "
+                                 "4:add-k:0.5 (can be repeated). Each model adds a score "
+                                 "column, named like 3gram_kneser-ney")
+        parser.add_argument("--criteria", nargs="+",
+                            help="Scores used to balance words and nonwords "
+                                 "(defaults to all scores)")
+        parser.add_argument("--solver", choices=BALANCING_SOLVERS, default="greedy",
+                            help="Balancing solver: a single greedy pass, or a local "
+                                 "search improving the greedy solution")
+        parser.add_argument("--time-budget", type=float, default=60.,
+                            help="Time budget (in seconds) of the local search, for each corpus")
+
     @classmethod
     def build_task(cls, args: Namespace, workspace: Workspace) -> Union[BaseTask, List[BaseTask]]:
-        return [InitFilteringTask(),
-                EqualsFilterTask(),
-                MostFrequentHomophoneFilterTask(),
-                WuggyHomophonesFilterTask(),
-                LevenshteinFilterTask(max_distance=3),
-                NgramScoringTask(),
-                NgramBalanceScoresTask()]
+        filters = [EqualsFilterTask(),
+                   MostFrequentHomophoneFilterTask(),
+                   WuggyHomophonesFilterTask(),
+                   LevenshteinFilterTask(max_distance=3, num_workers=args.num_workers)]
+        return [FusedFilteringTask(filters, write_steps=args.write_steps),
+                NgramsTrainTask(models=args.ngram_models),
+                NgramScoringTask(models=args.ngram_models),
+                NgramBalanceScoresTask(single_pass=True, num_workers=args.num_workers,
+                                       criteria=args.criteria, solver=args.solver,
+                                       time_budget=args.time_budget)]
 
 
 class FilterCommand(CommandGroup):
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import struct
+from pathlib import Path
+from typing import Dict, List, Iterable, Tuple, Sequence
+
+import numpy as np
+
+from .ngrams_tools import BincountNGramComputer, BatchNgramScorer, NgramModelSpec, SmoothedNgramModel
+from .phonetic import PhoneticForm, PhonemeInventory, BOUNDARY_CODE
+from .utils import logger, Phoneme
+
+
+class BinaryArraysFile:
+    """Base class of the versioned binary files made of named arrays, which
+    are memory-mapped when the file is loaded.
+
+    The file starts with a magic string, the format's version and the size of
+    a JSON header, holding the file's metadata and the dtype, shape and
+    offset of each array. The arrays follow, each aligned on 64 bytes."""
+    magic: bytes
+    version: int
+    alignment = 64
+
+    @classmethod
+    def preamble(cls) -> struct.Struct:
+        # magic string, version and header size
+        return struct.Struct(f"<{len(cls.magic)}sII")
+
+    @classmethod
+    def aligned(cls, size: int) -> int:
+        return -(-size // cls.alignment) * cls.alignment
+
+    @classmethod
+    def write_arrays(cls, file_path: Path, metadata: Dict, arrays: Dict[str, np.ndarray]):
+        arrays_info = {}
+        offset = 0
+        for name, array in arrays.items():
+            arrays_info[name] = {"dtype": np.lib.format.dtype_to_descr(array.dtype),
+                                 "shape": list(array.shape),
+                                 "offset": offset}
+            offset += cls.aligned(array.nbytes)
+        header = json.dumps({**metadata, "arrays": arrays_info}).encode("utf-8")
+        # arrays offsets are relative to the (aligned) end of the header
+        data_start = cls.aligned(cls.preamble().size + len(header))
+
+        with open(file_path, "wb") as arrays_file:
+            arrays_file.write(cls.preamble().pack(cls.magic, cls.version, len(header)))
+            arrays_file.write(header)
+            for name, array in arrays.items():
+                arrays_file.seek(data_start + arrays_info[name]["offset"])
+                arrays_file.write(np.ascontiguousarray(array).tobytes())
+            arrays_file.truncate(data_start + offset)
+
+    @classmethod
+    def read_arrays(cls, file_path: Path) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        """Reads a file's metadata, and memory-maps its arrays (read-only)"""
+        preamble = cls.preamble()
+        with open(file_path, "rb") as arrays_file:
+            preamble_bytes = arrays_file.read(preamble.size)
+            if len(preamble_bytes) < preamble.size:
+                raise ValueError(f"{file_path} is not a {cls.__name__} file")
+            magic, version, header_size = preamble.unpack(preamble_bytes)
+            if magic != cls.magic:
+                raise ValueError(f"{file_path} is not a {cls.__name__} file")
+            if version != cls.version:
+                raise ValueError(f"Unsupported version {version} for {cls.__name__} file {file_path} "
+                                 f"(supported version is {cls.version})")
+            metadata = json.loads(arrays_file.read(header_size).decode("utf-8"))
+
+        data_start = cls.aligned(preamble.size + header_size)
+        arrays = {}
+        for name, array_info in metadata.pop("arrays").items():
+            dtype = np.lib.format.descr_to_dtype(array_info["dtype"])
+            shape = tuple(array_info["shape"])
+            if 0 in shape:
+                # empty arrays can't be memory-mapped
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(file_path, dtype=dtype, mode="r", shape=shape,
+                                     offset=data_start + array_info["offset"])
+        return metadata, arrays
+
+
+class PhonotacticModel(BinaryArraysFile):
+    """Phonotactic ngram models, trained on the frequencies of encoded phonetic
+    forms (`PhoneticForm`), and serialized to a single binary arrays file.
+
+    The file's header holds the vocabulary (the phoneme inventory, in the order
+    of the phoneme codes), a hash of the training data and the specs of the
+    smoothed models. Its arrays are:
+
+    - `forms/*`: the training forms (concatenated codes, offsets and frequencies)
+    - `counts/*`: the unigram and bigram count arrays (see `BincountNGramComputer`)
+    - `logprobs/*`: the unigram and bigram log-probability lookup tables
+      (see `BatchNgramScorer`)
+    - `<model name>/*`: the arrays of each smoothed model (see `SmoothedNgramModel`)
+    """
+    magic = b"PHNGRAM\x00"
+    version = 1
+
+    def __init__(self, vocabulary: List[Phoneme],
+                 arrays: Dict[str, np.ndarray],
+                 models: Dict[str, Dict],
+                 training_hash: str):
+        self.vocabulary = vocabulary
+        self.arrays = arrays
+        # model name -> model spec, with the model's vocabulary size
+        self.models = models
+        self.training_hash = training_hash
+
+    @staticmethod
+    def hash_training_data(phonemes_freqs: Dict[PhoneticForm, int],
+                           vocabulary: List[Phoneme]) -> str:
+        training_hash = hashlib.sha256()
+        training_hash.update(json.dumps(vocabulary).encode("utf-8"))
+        # phoneme codes start at 1, so forms can be separated by a 0 byte
+        training_hash.update(b"\x00".join(phonemes_freqs))
+        training_hash.update(np.fromiter(phonemes_freqs.values(), dtype=np.int64,
+                                         count=len(phonemes_freqs)).tobytes())
+        return training_hash.hexdigest()
+
+    @classmethod
+    def train(cls, phonemes_freqs: Dict[PhoneticForm, int], inventory: PhonemeInventory,
+              models_specs: Iterable[NgramModelSpec] = ()) -> 'PhonotacticModel':
+        symbols_count = PhonemeInventory.max_size
+        forms = list(phonemes_freqs)
+        forms_lengths = np.fromiter(map(len, forms), dtype=np.int64, count=len(forms))
+        arrays = {
+            "forms/codes": np.frombuffer(b"".join(forms), dtype=np.uint8),
+            "forms/offsets": np.concatenate([[0], np.cumsum(forms_lengths)]).astype(np.int64),
+            "forms/frequencies": np.fromiter(phonemes_freqs.values(), dtype=np.int64,
+                                             count=len(forms)),
+        }
+
+        ngram_computer = BincountNGramComputer(phonemes_freqs, boundary=BOUNDARY_CODE)
+        _, counts = ngram_computer.compute_counts()
+        for name, array in counts.items():
+            arrays[f"counts/{name}"] = array
+        scorer = BatchNgramScorer.from_computer(ngram_computer, symbols_count=symbols_count)
+        for name, array in scorer.logprobs.items():
+            arrays[f"logprobs/{name}"] = array
+
+        models = {}
+        for model_spec in models_specs:
+            logger.info(f"Training {model_spec.order}-gram model with {model_spec.smoothing} "
+                        f"smoothing ({model_spec.param})")
+            model = SmoothedNgramModel(phonemes_freqs, model_spec, symbols_count=symbols_count)
+            for name, array in model.arrays().items():
+                arrays[f"{model_spec.name}/{name}"] = array
+            models[model_spec.name] = {"order": model_spec.order,
+                                       "smoothing": model_spec.smoothing,
+                                       "param": model_spec.param,
+                                       "vocab_size": int(model.vocab_size)}
+
+        return cls(list(inventory.phonemes), arrays, models,
+                   cls.hash_training_data(phonemes_freqs, inventory.phonemes))
+
+    def save(self, file_path: Path):
+        self.write_arrays(file_path, {"vocabulary": self.vocabulary,
+                                      "training_hash": self.training_hash,
+                                      "models": self.models}, self.arrays)
+
+    @classmethod
+    def load(cls, file_path: Path) -> 'PhonotacticModel':
+        """Loads a model file, with its arrays memory-mapped (read-only)"""
+        metadata, arrays = cls.read_arrays(file_path)
+        return cls(metadata["vocabulary"], arrays, metadata["models"], metadata["training_hash"])
+
+    @classmethod
+    def load_or_train(cls, file_path: Path, phonemes_freqs: Dict[PhoneticForm, int],
+                      inventory: PhonemeInventory,
+                      models_specs: Iterable[NgramModelSpec] = ()) -> 'PhonotacticModel':
+        """Loads the model file if it's been trained on the same data and has
+        all the required smoothed models, else trains and saves the model"""
+        models_specs = list(models_specs)
+        if file_path.exists():
+            try:
+                model = cls.load(file_path)
+            except ValueError as err:
+                logger.warning(f"Retraining ngram model: {err}")
+            else:
+                if (model.training_hash == cls.hash_training_data(phonemes_freqs, inventory.phonemes)
+                        and all(model.has_model(spec) for spec in models_specs)):
+                    logger.info(f"Reusing ngram model {file_path}")
+                    return model
+        model = cls.train(phonemes_freqs, inventory, models_specs)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        model.save(file_path)
+        return model
+
+    @property
+    def inventory(self) -> PhonemeInventory:
+        return PhonemeInventory(self.vocabulary[1:])
+
+    def forms_frequencies(self) -> Dict[PhoneticForm, int]:
+        """The training forms and their frequencies"""
+        codes = bytes(self.arrays["forms/codes"])
+        offsets = self.arrays["forms/offsets"].tolist()
+        return {PhoneticForm(codes[start:end]): freq
+                for start, end, freq in zip(offsets[:-1], offsets[1:],
+                                            self.arrays["forms/frequencies"].tolist())}
+
+    def ngram_computer(self) -> BincountNGramComputer:
+        """Unigram and bigram computer, with ngrams made of phonemes (not codes)"""
+        counts = {name.split("/")[1]: array for name, array in self.arrays.items()
+                  if name.startswith("counts/")}
+        return BincountNGramComputer.from_counts(self.vocabulary, counts,
+                                                 boundary=self.vocabulary[BOUNDARY_CODE])
+
+    def scorer(self) -> BatchNgramScorer:
+        logprobs = {name.split("/")[1]: array for name, array in self.arrays.items()
+                    if name.startswith("logprobs/")}
+        return BatchNgramScorer(logprobs, symbols_count=PhonemeInventory.max_size)
+
+    def has_model(self, spec: NgramModelSpec) -> bool:
+        model_info = self.models.get(spec.name)
+        return (model_info is not None
+                and (model_info["order"], model_info["smoothing"], model_info["param"])
+                == (spec.order, spec.smoothing, spec.param))
+
+    def smoothed_model(self, spec: NgramModelSpec) -> SmoothedNgramModel:
+        if not self.has_model(spec):
+            raise ValueError(f"No {spec.name} model with parameter {spec.param} "
+                             f"in the ngram model file")
+        prefix = f"{spec.name}/"
+        arrays = {name[len(prefix):]: array for name, array in self.arrays.items()
+                  if name.startswith(prefix)}
+        return SmoothedNgramModel.from_arrays(spec, arrays, self.models[spec.name]["vocab_size"],
+                                              symbols_count=PhonemeInventory.max_size)
+
+
+class NgramScoresTable(BinaryArraysFile):
+    """Ngram scores of phonetic forms, as a binary arrays file written along
+    the scores CSV, to be memory-mapped by the ngram balancing.
+
+    The encoded phonetic forms (`PhoneticForm`) are sorted, as a fixed-width
+    bytes array, and a form's id is its row in the table. The scores are
+    stored as a structured array, with one field per score, so that any
+    subset of the scores can be selected without copying the table."""
+    magic = b"PHSCORES"
+    version = 1
+
+    def __init__(self, vocabulary: List[Phoneme], forms: np.ndarray, scores: np.ndarray):
+        self.vocabulary = vocabulary
+        self.forms = forms
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.forms)
+
+    @classmethod
+    def build(cls, forms: List[PhoneticForm], scores: Dict[str, np.ndarray],
+              inventory: PhonemeInventory) -> 'NgramScoresTable':
+        # phoneme codes are never 0, so forms aren't truncated by the bytes dtype
+        forms_array = np.array(forms, dtype=f"S{max(map(len, forms), default=1)}")
+        order = np.argsort(forms_array)
+        scores_array = np.empty(len(forms), dtype=[(name, np.float64) for name in scores])
+        for name, score in scores.items():
+            scores_array[name] = score[order]
+        return cls(list(inventory.phonemes), forms_array[order], scores_array)
+
+    def save(self, file_path: Path):
+        self.write_arrays(file_path, {"vocabulary": self.vocabulary},
+                          {"forms": self.forms, "scores": self.scores})
+
+    @classmethod
+    def load(cls, file_path: Path) -> 'NgramScoresTable':
+        """Loads a scores file, with its arrays memory-mapped (read-only)"""
+        metadata, arrays = cls.read_arrays(file_path)
+        return cls(metadata["vocabulary"], arrays["forms"], arrays["scores"])
+
+    @property
+    def score_names(self) -> List[str]:
+        return list(self.scores.dtype.names)
+
+    @property
+    def inventory(self) -> PhonemeInventory:
+        return PhonemeInventory(self.vocabulary[1:])
+
+    def ids(self, forms: Sequence[bytes]) -> np.ndarray:
+        """Ids of the given phonetic forms (-1 for forms that aren't in the table)"""
+        if len(self.forms) == 0:
+            return np.full(len(forms), -1, dtype=np.int64)
+        forms_lengths = np.fromiter(map(len, forms), dtype=np.int64, count=len(forms))
+        queries = np.array(forms, dtype=self.forms.dtype)
+        ids = np.minimum(np.searchsorted(self.forms, queries), len(self.forms) - 1)
+        # forms longer than the table's forms would be truncated in the queries
+        found = (self.forms[ids] == queries) & (forms_lengths <= self.forms.dtype.itemsize)
+        return np.where(found, ids, -1)
+
+    def form(self, form_id: int) -> PhoneticForm:
+        return PhoneticForm(self.forms[form_id])
@@ -1,24 +1,32 @@
 import random
-from collections import Counter, defaultdict
-from typing import Dict, Tuple, List, Union, Iterable, Callable, Optional, Any
+import time
+from collections import Counter
+from dataclasses import dataclass
+from itertools import chain
+from typing import Dict, Tuple, List, Union, Iterable, Callable, Optional, Any, Sequence, Hashable
 from typing_extensions import Literal
 
 import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
 
-from .utils import consecutive_pairs, Phoneme
+from .utils import consecutive_pairs
 
 Ngram = Union[str, Tuple[str, str]]
 
 
 class NGramComputer:
 
-    def __init__(self, phonemic_freq: Dict[Tuple[Phoneme], int]):
+    def __init__(self, phonemic_freq: Dict[Sequence[Hashable], int],
+                 boundary: Hashable = "_"):
+        # phonetic forms can either be tuples of phonemes or encoded
+        # `PhoneticForm`, in which case the boundary should be its code
         self.phonemic_freq = phonemic_freq
+        self.boundary = boundary
 
     def phonemes_freq_iter(self, bounded: bool, ngram_type: Literal["unigram", "bigram"]) -> Iterable[Dict]:
         for phonemes, freq in self.phonemic_freq.items():
             if bounded:
-                phonemes = ["_"] + list(phonemes) + ["_"]
+                phonemes = [self.boundary] + list(phonemes) + [self.boundary]
 
             if ngram_type == "unigram":
                 ngrams = phonemes
@@ -60,83 +68,466 @@ class NGramComputer:
     def to_ngram_logprob(cls, ngrams: List[Ngram],
                          ngrams_probabilities: Dict[Ngram, int]):
         """Computes the log of the product of ngram probabilities, via a sum of logs"""
-        # nonexistent values are 0.0, via the default dict
-        ngrams_probabilities = defaultdict(float, ngrams_probabilities)
-        ngram_values = np.array([ngrams_probabilities[ngram] for ngram in ngrams])
+        # nonexistent values are 0.0
+        ngram_values = np.array([ngrams_probabilities.get(ngram, 0.0) for ngram in ngrams])
         return np.sum(np.log(ngram_values))
 
 
+class BincountNGramComputer(NGramComputer):
+    """Same as `NGramComputer`, but all phonetic forms are integer-encoded
+    (with their boundaries) into a single ragged array, from which the
+    unigram and bigram count tables are computed in one vectorized pass
+    with `np.bincount`. Unbounded tables are the bounded ones without the
+    boundary's ngrams. The probability dicts are the same (including
+    their order) as those of `NGramComputer`."""
+
+    def __init__(self, phonemic_freq: Dict[Sequence[Hashable], int],
+                 boundary: Hashable = "_"):
+        super().__init__(phonemic_freq, boundary)
+        self._counts: Optional[Tuple[List[Hashable], Dict[str, np.ndarray]]] = None
+        self._tables: Optional[Dict[str, Dict]] = None
+
+    def encode_forms(self) -> Tuple[np.ndarray, np.ndarray, List[Hashable]]:
+        """Returns the concatenated bounded forms' symbol ids, each form's
+        length and the symbols (the boundary's id being 0)"""
+        forms = list(self.phonemic_freq)
+        if not forms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), [self.boundary]
+        lengths = np.fromiter((len(form) + 2 for form in forms), dtype=np.int64, count=len(forms))
+        if self.boundary == 0 and all(isinstance(form, bytes) for form in forms):
+            # phonetic forms are already encoded, with 0 as the boundary code
+            ids = np.frombuffer(b"\x00" + b"\x00\x00".join(forms) + b"\x00", dtype=np.uint8)
+            ids = ids.astype(np.int64)
+            return ids, lengths, list(range(int(ids.max(initial=0)) + 1))
+
+        symbols: List[Hashable] = [self.boundary]
+        symbols_ids: Dict[Hashable, int] = {self.boundary: 0}
+        ids = []
+        for form in forms:
+            ids.append(0)
+            for symbol in form:
+                symbol_id = symbols_ids.get(symbol)
+                if symbol_id is None:
+                    symbol_id = symbols_ids[symbol] = len(symbols)
+                    symbols.append(symbol)
+                ids.append(symbol_id)
+            ids.append(0)
+        return np.array(ids, dtype=np.int64), lengths, symbols
+
+    @staticmethod
+    def ordered_counts(ids: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Distinct ids (in order of first occurrence) and their weighted counts"""
+        if len(ids) == 0:
+            return ids, weights
+        unique_ids, first_index = np.unique(ids, return_index=True)
+        unique_ids = unique_ids[np.argsort(first_index)]
+        counts = np.bincount(ids, weights=weights)
+        return unique_ids, counts[unique_ids]
+
+    def compute_counts(self) -> Tuple[List[Hashable], Dict[str, np.ndarray]]:
+        """Returns the symbols, and the bounded unigram and bigram count arrays:
+        the distinct unigram ids and bigram (first, second) ids, in order of
+        first occurrence, and their weighted counts"""
+        if self._counts is not None:
+            return self._counts
+
+        ids, lengths, symbols = self.encode_forms()
+        symbols_count = len(symbols)
+        freqs = np.fromiter(self.phonemic_freq.values(), dtype=np.float64,
+                            count=len(self.phonemic_freq))
+        weights = np.repeat(freqs, lengths)
+        unigram_ids, unigram_counts = self.ordered_counts(ids, weights)
+
+        # bigrams, without the pairs spanning two consecutive forms
+        form_ends = np.cumsum(lengths) - 1
+        pairs_mask = np.ones(max(len(ids) - 1, 0), dtype=bool)
+        pairs_mask[form_ends[:-1]] = False
+        bigram_ids = (ids[:-1] * symbols_count + ids[1:])[pairs_mask]
+        bigram_ids, bigram_counts = self.ordered_counts(bigram_ids, weights[:-1][pairs_mask])
+        bigram_firsts, bigram_seconds = np.divmod(bigram_ids, symbols_count)
+
+        self._counts = symbols, {
+            "unigram_ids": unigram_ids,
+            "unigram_counts": unigram_counts,
+            "bigram_firsts": bigram_firsts,
+            "bigram_seconds": bigram_seconds,
+            "bigram_counts": bigram_counts,
+        }
+        return self._counts
+
+    @classmethod
+    def from_counts(cls, symbols: List[Hashable], counts: Dict[str, np.ndarray],
+                    boundary: Hashable = "_") -> 'BincountNGramComputer':
+        """Builds an ngram computer from precomputed count arrays
+        (as returned by `compute_counts`)"""
+        ngram_computer = cls({}, boundary)
+        ngram_computer._counts = symbols, counts
+        return ngram_computer
+
+    def compute_tables(self) -> Dict[str, Dict]:
+        if self._tables is not None:
+            return self._tables
+
+        symbols, counts = self.compute_counts()
+        unigram_ids, unigram_counts = counts["unigram_ids"], counts["unigram_counts"]
+
+        # unigrams
+        unigram_counts_dict = dict(zip(unigram_ids.tolist(), unigram_counts.tolist()))
+        bounded_total = unigram_counts.sum()
+        unigram_bounded = {symbols[unigram_id]: count / bounded_total
+                           for unigram_id, count in zip(unigram_ids.tolist(),
+                                                        unigram_counts.tolist())}
+        unbounded_mask = unigram_ids != 0
+        unbounded_total = unigram_counts[unbounded_mask].sum()
+        unigram_unbounded = {symbols[unigram_id]: count / unbounded_total
+                             for unigram_id, count in zip(unigram_ids[unbounded_mask].tolist(),
+                                                          unigram_counts[unbounded_mask].tolist())}
+
+        # bigrams, normalized by the unigram count of their first symbol
+        bigram_bounded, bigram_unbounded = {}, {}
+        for first, second, count in zip(counts["bigram_firsts"].tolist(),
+                                        counts["bigram_seconds"].tolist(),
+                                        counts["bigram_counts"].tolist()):
+            bigram = (symbols[first], symbols[second])
+            bigram_bounded[bigram] = count / unigram_counts_dict[first]
+            if first != 0 and second != 0:
+                bigram_unbounded[bigram] = bigram_bounded[bigram]
+
+        self._tables = {
+            "unigram_bounded": unigram_bounded,
+            "unigram_unbounded": unigram_unbounded,
+            "bigram_bounded": bigram_bounded,
+            "bigram_unbounded": bigram_unbounded,
+        }
+        return self._tables
+
+    def bigrams(self, bounded: bool):
+        return self.compute_tables()["bigram_bounded" if bounded else "bigram_unbounded"]
+
+    def unigrams(self, bounded: bool):
+        return self.compute_tables()["unigram_bounded" if bounded else "unigram_unbounded"]
+
+
+class BatchNgramScorer:
+    """Scores batches of encoded phonetic forms (`PhoneticForm`) with the unigram
+    and bigram models of an ngram computer (built on encoded forms).
+
+    The log-probabilities of all the ngrams are precomputed once into lookup
+    arrays, indexed by ngram id (the phoneme code for unigrams, and
+    `first * symbols_count + second` for bigrams). Unseen ngrams have a
+    probability of 0, i.e., a log-probability of -inf."""
+    scores_names = ["unigram_bounded", "unigram_unbounded", "bigram_bounded", "bigram_unbounded"]
+
+    def __init__(self, logprobs: Dict[str, np.ndarray], symbols_count: int = 256):
+        self.symbols_count = symbols_count
+        # score name -> lookup array of the ngrams' log-probabilities
+        self.logprobs = logprobs
+        # number of scored forms with a zero probability, for each score
+        self.zero_prob_counts: Dict[str, int] = {name: 0 for name in self.scores_names}
+
+    @classmethod
+    def from_computer(cls, ngram_computer: NGramComputer,
+                      symbols_count: int = 256) -> 'BatchNgramScorer':
+        return cls({
+            "unigram_bounded": cls.lookup_array(ngram_computer.unigrams(bounded=True), symbols_count),
+            "unigram_unbounded": cls.lookup_array(ngram_computer.unigrams(bounded=False), symbols_count),
+            "bigram_bounded": cls.lookup_array(ngram_computer.bigrams(bounded=True), symbols_count,
+                                               is_bigram=True),
+            "bigram_unbounded": cls.lookup_array(ngram_computer.bigrams(bounded=False), symbols_count,
+                                                 is_bigram=True),
+        }, symbols_count)
+
+    @staticmethod
+    def lookup_array(ngrams_probabilities: Dict[Ngram, float], symbols_count: int,
+                     is_bigram: bool = False) -> np.ndarray:
+        logprobs = np.full(symbols_count ** 2 if is_bigram else symbols_count, -np.inf)
+        for ngram, probability in ngrams_probabilities.items():
+            if probability > 0:
+                ngram_id = ngram[0] * symbols_count + ngram[1] if is_bigram else ngram
+                logprobs[ngram_id] = np.log(probability)
+        return logprobs
+
+    def score_forms(self, forms: List[bytes]) -> Dict[str, np.ndarray]:
+        """Returns the log-probability of each form, for each score"""
+        scores = {name: np.zeros(len(forms)) for name in self.scores_names}
+        forms_lengths = np.fromiter(map(len, forms), dtype=np.int64, count=len(forms))
+        # forms of the same length are scored together, as a 2D array of ngram
+        # ids, so each row is summed the same way as a single form would be
+        for length in np.unique(forms_lengths).tolist():
+            forms_idx = np.flatnonzero(forms_lengths == length)
+            codes = np.frombuffer(b"".join(forms[i] for i in forms_idx), dtype=np.uint8)
+            codes = codes.reshape(len(forms_idx), length).astype(np.int64)
+            bounded_codes = np.pad(codes, ((0, 0), (1, 1)))  # boundary code is 0
+            ngram_ids = {
+                "unigram_bounded": bounded_codes,
+                "unigram_unbounded": codes,
+                "bigram_bounded": bounded_codes[:, :-1] * self.symbols_count + bounded_codes[:, 1:],
+                "bigram_unbounded": codes[:, :-1] * self.symbols_count + codes[:, 1:],
+            }
+            for name, ids in ngram_ids.items():
+                scores[name][forms_idx] = self.logprobs[name][ids].sum(axis=1)
+
+        for name, name_scores in scores.items():
+            self.zero_prob_counts[name] += int(np.isneginf(name_scores).sum())
+        return scores
+
+
+SMOOTHING_METHODS = ("add-k", "kneser-ney")
+
+
+@dataclass
+class NgramModelSpec:
+    order: int
+    smoothing: str = "kneser-ney"
+    # k for add-k smoothing (defaults to 1), discount for Kneser-Ney (defaults to 0.75)
+    param: Optional[float] = None
+
+    def __post_init__(self):
+        if self.order < 1:
+            raise ValueError(f"Invalid ngram order {self.order}")
+        if self.smoothing not in SMOOTHING_METHODS:
+            raise ValueError(f"Invalid smoothing method {self.smoothing}, "
+                             f"should be one of {', '.join(SMOOTHING_METHODS)}")
+        if self.param is None:
+            self.param = 1.0 if self.smoothing == "add-k" else 0.75
+
+    @property
+    def name(self) -> str:
+        """Name of the model's score column"""
+        return f"{self.order}gram_{self.smoothing}"
+
+    @classmethod
+    def parse(cls, spec: str) -> 'NgramModelSpec':
+        """Parses a model spec formatted as ORDER[:SMOOTHING[:PARAM]], e.g. 3:kneser-ney"""
+        order, *rest = spec.split(":")
+        smoothing = rest[0] if rest else "kneser-ney"
+        param = float(rest[1]) if len(rest) > 1 else None
+        return cls(int(order), smoothing, param)
+
+
+def lookup_counts(keys: np.ndarray, values: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """Values of the queried keys in a sorted keys array (0 for absent keys)"""
+    if len(keys) == 0:
+        return np.zeros(queries.shape)
+    idx = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+    return np.where(keys[idx] == queries, values[idx], 0)
+
+
+class SmoothedNgramModel:
+    """Smoothed n-gram model over encoded phonetic forms (`PhoneticForm`), with
+    either add-k or interpolated Kneser-Ney smoothing.
+
+    Forms are padded with `order - 1` boundaries at their start and one at
+    their end. An n-gram is identified by its symbols' codes as a base-`symbols_count`
+    number, and counts are stored as sorted arrays of ngram ids and their counts
+    (one per order for Kneser-Ney, the lower orders using continuation counts),
+    along with the counts and number of distinct continuations of each context,
+    from which the backoff weights are precomputed."""
+
+    def __init__(self, phonemic_freq: Dict[bytes, int], spec: NgramModelSpec,
+                 symbols_count: int = 256):
+        if symbols_count ** spec.order >= 2 ** 63:
+            raise ValueError(f"Ngram order {spec.order} is too high for {symbols_count} symbols")
+        self.spec = spec
+        self.order = spec.order
+        self.symbols_count = symbols_count
+
+        ngram_ids, counts = self.count_ngrams(phonemic_freq)
+        # number of distinct symbols that can be predicted (phonemes and final boundary)
+        self.vocab_size = len(np.unique(ngram_ids % symbols_count))
+        # per order: sorted ngram ids and their (continuation) counts
+        self.ngram_ids: Dict[int, np.ndarray] = {self.order: ngram_ids}
+        self.ngram_counts: Dict[int, np.ndarray] = {self.order: counts}
+        if spec.smoothing == "kneser-ney":
+            for order in range(self.order - 1, 0, -1):
+                # continuation count: number of distinct left extensions
+                suffixes = self.ngram_ids[order + 1] % (symbols_count ** order)
+                self.ngram_ids[order], self.ngram_counts[order] = np.unique(suffixes,
+                                                                            return_counts=True)
+        # per order: sorted context ids, their total counts and backoff weights
+        self.context_ids: Dict[int, np.ndarray] = {}
+        self.context_totals: Dict[int, np.ndarray] = {}
+        self.backoff_weights: Dict[int, np.ndarray] = {}
+        for order, ids in self.ngram_ids.items():
+            contexts, inverse, types = np.unique(ids // symbols_count,
+                                                 return_inverse=True, return_counts=True)
+            totals = np.bincount(inverse, weights=self.ngram_counts[order])
+            self.context_ids[order] = contexts
+            self.context_totals[order] = totals
+            self.backoff_weights[order] = spec.param * types / totals
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The model's count, context and backoff arrays, named like
+        `ngram_ids/3` (3 being the arrays' order)"""
+        arrays = {}
+        for order in self.ngram_ids:
+            arrays[f"ngram_ids/{order}"] = self.ngram_ids[order]
+            arrays[f"ngram_counts/{order}"] = self.ngram_counts[order]
+            arrays[f"context_ids/{order}"] = self.context_ids[order]
+            arrays[f"context_totals/{order}"] = self.context_totals[order]
+            arrays[f"backoff_weights/{order}"] = self.backoff_weights[order]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, spec: NgramModelSpec, arrays: Dict[str, np.ndarray],
+                    vocab_size: int, symbols_count: int = 256) -> 'SmoothedNgramModel':
+        """Rebuilds a trained model from its arrays (as returned by `arrays`)"""
+        model = cls.__new__(cls)
+        model.spec = spec
+        model.order = spec.order
+        model.symbols_count = symbols_count
+        model.vocab_size = vocab_size
+        orders = sorted({int(name.split("/")[1]) for name in arrays})
+        model.ngram_ids = {order: arrays[f"ngram_ids/{order}"] for order in orders}
+        model.ngram_counts = {order: arrays[f"ngram_counts/{order}"] for order in orders}
+        model.context_ids = {order: arrays[f"context_ids/{order}"] for order in orders}
+        model.context_totals = {order: arrays[f"context_totals/{order}"] for order in orders}
+        model.backoff_weights = {order: arrays[f"backoff_weights/{order}"] for order in orders}
+        return model
+
+    def padded_ngram_ids(self, forms: List[bytes]) -> np.ndarray:
+        """Ngram ids of forms of the same length (one row per form)"""
+        length = len(forms[0])
+        codes = np.frombuffer(b"".join(forms), dtype=np.uint8).reshape(len(forms), length)
+        padded = np.pad(codes.astype(np.int64), ((0, 0), (self.order - 1, 1)))
+        ngram_ids = np.zeros((len(forms), length + 1), dtype=np.int64)
+        for i in range(self.order):
+            ngram_ids = ngram_ids * self.symbols_count + padded[:, i:i + length + 1]
+        return ngram_ids
+
+    def iter_length_groups(self, forms: List[bytes]) -> Iterable[Tuple[np.ndarray, np.ndarray]]:
+        """Iterates over the groups of forms of the same length, yielding the
+        indices of the forms in the group and their ngram ids"""
+        forms_lengths = np.fromiter(map(len, forms), dtype=np.int64, count=len(forms))
+        for length in np.unique(forms_lengths).tolist():
+            forms_idx = np.flatnonzero(forms_lengths == length)
+            yield forms_idx, self.padded_ngram_ids([forms[i] for i in forms_idx])
+
+    def count_ngrams(self, phonemic_freq: Dict[bytes, int]) -> Tuple[np.ndarray, np.ndarray]:
+        forms = list(phonemic_freq)
+        freqs = np.fromiter(phonemic_freq.values(), dtype=np.float64, count=len(forms))
+        all_ids, all_weights = [], []
+        for forms_idx, ngram_ids in self.iter_length_groups(forms):
+            all_ids.append(ngram_ids.ravel())
+            all_weights.append(np.repeat(freqs[forms_idx], ngram_ids.shape[1]))
+        ngram_ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate(all_weights))
+        # ngrams only found in zero-frequency forms are unseen
+        return ngram_ids[counts > 0], counts[counts > 0]
+
+    def probabilities(self, ngram_ids: np.ndarray, order: int) -> np.ndarray:
+        counts = lookup_counts(self.ngram_ids[order], self.ngram_counts[order], ngram_ids)
+        contexts = ngram_ids // self.symbols_count
+        totals = lookup_counts(self.context_ids[order], self.context_totals[order], contexts)
+        seen_context = totals > 0
+        safe_totals = np.where(seen_context, totals, 1)
+
+        if self.spec.smoothing == "add-k":
+            k = self.spec.param
+            return (counts + k) / (np.where(seen_context, totals, 0) + k * self.vocab_size)
+
+        # interpolated Kneser-Ney
+        discounted = np.maximum(counts - self.spec.param, 0) / safe_totals
+        backoff = lookup_counts(self.context_ids[order], self.backoff_weights[order], contexts)
+        if order == 1:
+            lower_probs = np.full(ngram_ids.shape, 1 / self.vocab_size)
+        else:
+            lower_probs = self.probabilities(ngram_ids % (self.symbols_count ** (order - 1)),
+                                             order - 1)
+        return np.where(seen_context, discounted + backoff * lower_probs, lower_probs)
+
+    def score_forms(self, forms: List[bytes]) -> np.ndarray:
+        """Log-probability of each form"""
+        scores = np.zeros(len(forms))
+        for forms_idx, ngram_ids in self.iter_length_groups(forms):
+            probs = self.probabilities(ngram_ids, self.order)
+            scores[forms_idx] = np.log(probs).sum(axis=1)
+        return scores
+
+
 Score = float
 
 
-def abs_sum_score_fn(scores: Iterable[Score]) -> float:
-    return np.abs(np.array(list(scores)) - 0.5).sum()
+def abs_sum_score_fn(scores: np.ndarray) -> Union[float, np.ndarray]:
+    """Sum of the distances of the balancing scores to 0.5. For a matrix of
+    candidates' balancing scores (one row per candidate), returns each
+    candidate's objective"""
+    return np.abs(np.asarray(scores) - 0.5).sum(axis=-1)
 
 
 FREQS_RANKS = [0, 10, 20, 50, 100]  # TODO: ask about that
 
 
-def rank(frequency: int):
+def rank(frequency: int) -> str:
     if frequency == 0:
         return "FREQRANK[0]"
-    min_freq, max_freq = FREQS_RANKS[0], FREQS_RANKS[-1]
+    max_freq = FREQS_RANKS[-1]
     for low, high in consecutive_pairs(FREQS_RANKS):
         if low <= frequency <= high:
-            yield f"FREQRANK[{low} - {high}]"
-    else:
-        if frequency > max_freq:
-            f"FREQRANK[{max_freq} - inf]"
+            return f"FREQRANK[{low} - {high}]"
+    return f"FREQRANK[{max_freq} - inf]"
 
 
 class ScoringStatistics:
+    """Balancing statistics of a category of words, with scores stored
+    as vectors (in the balancer's score names order)"""
 
-    def __init__(self, scores_names: List[str]):
+    def __init__(self, scores_count: int):
         # number of words that have been chosen
         self.current_words_counter = 1
         # for each score, the sum of balancing scores
-        self.aggregate_scores = {score: 0.0 for score in scores_names}
+        self.aggregate_scores = np.zeros(scores_count)
 
     @property
-    def current_scores(self):
-        return {score_name: aggregate_score / self.current_words_counter
-                for score_name, aggregate_score in self.aggregate_scores.items()}
-
-    def compare_scores(self, real_word_score: float, fake_word_score: float):
-        if real_word_score > fake_word_score:
-            return 1.
-        elif real_word_score == fake_word_score:
-            return 0.5
-        else:
-            return 0.
-
-    def compute_candidate_scores(self,
-                                 real_word_scores: Dict[str, float],
-                                 fake_word_scores: Dict[str, float]):
-        scores: Dict[str, float] = dict()
-        for score_name in self.aggregate_scores:
-            score_comparison = self.compare_scores(real_word_scores[score_name],
-                                                   fake_word_scores[score_name])
-            updated_aggregated_score = self.aggregate_scores[score_name] + score_comparison
-            candidate_score = (updated_aggregated_score / (self.current_words_counter + 1))
-            scores[score_name] = candidate_score
-        return scores
-
-    def update_scores_stats(self, candidate_scores: Dict[str, float]):
-        for score_name, score in candidate_scores.items():
-            self.aggregate_scores[score_name] += score
+    def current_scores(self) -> np.ndarray:
+        return self.aggregate_scores / self.current_words_counter
+
+    @staticmethod
+    def compare_scores(real_word_scores: np.ndarray, fake_words_scores: np.ndarray) -> np.ndarray:
+        """1 where the real word's score is higher than the fake word's,
+        0.5 where they're equal, and 0 otherwise"""
+        return np.where(real_word_scores > fake_words_scores, 1.,
+                        np.where(real_word_scores == fake_words_scores, 0.5, 0.))
+
+    def compute_candidate_scores(self, scores_comparisons: np.ndarray) -> np.ndarray:
+        """Balancing scores of each candidate (one row per candidate),
+        from the comparisons of its scores with the real word's scores"""
+        return (self.aggregate_scores + scores_comparisons) / (self.current_words_counter + 1)
+
+    def update_scores_stats(self, candidate_scores: np.ndarray):
+        self.aggregate_scores += candidate_scores
         self.current_words_counter += 1
 
 
 WordCategory = Tuple[Any, ...]
+# row of a word in the balancer's scores table
+WordId = int
+
+
+def word_category(form: Sequence[Any], frequency: int) -> WordCategory:
+    """Balancing category of a real word: its length (in phonemes) and its
+    frequency rank"""
+    return len(form), rank(frequency)
 
 
 class FakeWordsBalancer:
+    """Chooses a fake word for each real word, so that for each category of
+    real words, the real words' scores are as often higher as lower
+    than their fake words' scores.
+
+    Words are identified by their row in the scores table (a 2D array, or a
+    structured array with one field per score, possibly memory-mapped), and
+    only the rows of the pairs' words are read from it. The comparisons of
+    each real word's scores with its candidates' are computed upfront, in one
+    vectorized pass over all the pairs, and all the candidates of a real word
+    are then evaluated at once. The first candidate (in the candidates' order)
+    that improves the category's objective is chosen, or else a random one."""
 
     def __init__(self,
-                 words_scores: Dict[str, Dict[str, Score]],  # {word_pho : {score_name : score}}
-                 word_categories: Dict[str, WordCategory],  # { word_pho : (cat_1, cat_2,...)}
-                 word_nonword_pairs: Dict[str, List[str]],  # {real_word : list(fake_word) }
-                 objective_fn: Optional[Callable[[Iterable[Score]], float]] = None,
+                 words_scores: np.ndarray,  # word_id -> scores (one column or field per score)
+                 word_categories: Dict[WordId, WordCategory],  # { word_id : (cat_1, cat_2,...)}
+                 word_nonword_pairs: Dict[WordId, List[WordId]],  # {real_word_id : list(fake_word_id) }
+                 objective_fn: Optional[Callable[[np.ndarray], Union[float, np.ndarray]]] = None,
                  num_to_keep: int = 1):
         self.objective_fn = objective_fn if objective_fn is not None else abs_sum_score_fn
         self.words_scores = words_scores
@@ -146,44 +537,198 @@ class FakeWordsBalancer:
 
         # all categories
         self.categories = set(word_categories.values())
-        # all score names
-        self.score_names = list(words_scores[list(words_scores)[0]].keys())
+        # all score names (or indices, for an unstructured scores array)
+        if words_scores.dtype.names is not None:
+            self.score_names = list(words_scores.dtype.names)
+        else:
+            self.score_names = list(range(words_scores.shape[1]))
         # 1 scoring statistic per category
         self.categories_stats: Dict[WordCategory, ScoringStatistics] = {
-            cat: ScoringStatistics(self.score_names) for cat in self.categories
+            cat: ScoringStatistics(len(self.score_names)) for cat in self.categories
         }
-
-    def choose_non_word(self, real_word: str) -> str:
+        # objective of each category, only recomputed when its statistics change
+        self.categories_objectives: Dict[WordCategory, float] = {
+            cat: self.objective_fn(stats.current_scores)
+            for cat, stats in self.categories_stats.items()
+        }
+        # real word -> comparisons of its scores with its candidates' scores
+        self.scores_comparisons = self.compare_pairs_scores()
+        # real word -> indices of its chosen fake words
+        self.chosen_idx: Dict[WordId, List[int]] = {}
+
+    def words_scores_rows(self, words_ids: np.ndarray) -> np.ndarray:
+        rows = self.words_scores[words_ids]
+        if rows.dtype.names is not None:
+            rows = structured_to_unstructured(rows, dtype=np.float64)
+        return np.asarray(rows, dtype=np.float64).reshape(len(words_ids), len(self.score_names))
+
+    def compare_pairs_scores(self) -> Dict[WordId, np.ndarray]:
+        real_words = np.fromiter(self.word_nonword_pairs, dtype=np.int64,
+                                 count=len(self.word_nonword_pairs))
+        candidates_counts = np.fromiter(map(len, self.word_nonword_pairs.values()),
+                                        dtype=np.int64, count=len(self.word_nonword_pairs))
+        fake_words = np.fromiter(chain.from_iterable(self.word_nonword_pairs.values()),
+                                 dtype=np.int64, count=candidates_counts.sum())
+
+        # scores of the pairs' words, one row per (distinct) word
+        words_ids, pairs_idx = np.unique(np.concatenate([real_words, fake_words]), return_inverse=True)
+        scores = self.words_scores_rows(words_ids)
+        comparisons = ScoringStatistics.compare_scores(
+            scores[np.repeat(pairs_idx[:len(real_words)], candidates_counts)],
+            scores[pairs_idx[len(real_words):]])
+        return dict(zip(self.word_nonword_pairs,
+                        np.split(comparisons, np.cumsum(candidates_counts)[:-1])))
+
+    def choose_non_words(self, real_word: WordId, num_to_keep: int = 1) -> List[WordId]:
+        """Chooses `num_to_keep` distinct fake words (or all of them if there
+        are fewer candidates) one after the other, each choice updating the
+        category's statistics before the next one is made. Only the remaining
+        candidates' scores are recomputed after each choice."""
         # retrieving the scores statistics for the current word's category
-        scores_stats = self.categories_stats[self.word_categories[real_word]]
-        current_objective = self.objective_fn(scores_stats.current_scores.values())
-
-        fake_word_candidate_scores = dict()
-        # for each fake word, computing its scores compared to the current
-        # statistics
-        for fake_word in self.word_nonword_pairs[real_word]:
-            candidate_scores = scores_stats.compute_candidate_scores(
-                self.words_scores[real_word],
-                self.words_scores[fake_word]
-            )
-            fake_word_candidate_scores[fake_word] = candidate_scores
-
-            candidate_obj = self.objective_fn(candidate_scores.values())
-            if candidate_obj < current_objective:
-                chosen_fake_word = fake_word
-                break
-        else:
-            chosen_fake_word = random.choice(self.word_nonword_pairs[real_word])
-
-        if chosen_fake_word is None:
-            raise RuntimeError()
-        else:
-            scores_stats.update_scores_stats(
-                fake_word_candidate_scores[chosen_fake_word])
-            return chosen_fake_word
-
-    def iter_balanced_pairs(self) -> Iterable[Tuple[str, str]]:
+        category = self.word_categories[real_word]
+        scores_stats = self.categories_stats[category]
+        fake_words = self.word_nonword_pairs[real_word]
+        scores_comparisons = self.scores_comparisons[real_word]
+        # indices of the fake words that haven't been chosen yet
+        remaining_idx = np.arange(len(fake_words))
+
+        chosen_fake_words = []
+        chosen_idx_list = self.chosen_idx.setdefault(real_word, [])
+        while len(chosen_fake_words) < num_to_keep and len(remaining_idx):
+            # computing the scores of all remaining fake words compared to the current
+            # statistics, and choosing the first one that improves the objective
+            candidates_scores = scores_stats.compute_candidate_scores(scores_comparisons[remaining_idx])
+            improving = self.objective_fn(candidates_scores) < self.categories_objectives[category]
+            chosen_idx = improving.argmax()
+            if not improving[chosen_idx]:
+                # same random draw as a random.choice among the remaining fake words
+                chosen_idx = random.choice(range(len(remaining_idx)))
+
+            scores_stats.update_scores_stats(candidates_scores[chosen_idx])
+            self.categories_objectives[category] = self.objective_fn(scores_stats.current_scores)
+            chosen_fake_word = fake_words[remaining_idx[chosen_idx]]
+            chosen_fake_words.append(chosen_fake_word)
+            chosen_idx_list.append(int(remaining_idx[chosen_idx]))
+            # homophone real words share their candidates, which can thus be repeated
+            remaining_idx = remaining_idx[[fake_words[idx] != chosen_fake_word
+                                           for idx in remaining_idx.tolist()]]
+        return chosen_fake_words
+
+    def choose_non_word(self, real_word: WordId) -> WordId:
+        return self.choose_non_words(real_word)[0]
+
+    def categories_comparisons(self) -> Tuple[Dict[WordCategory, int], np.ndarray, np.ndarray]:
+        """Indexes the categories, and sums, for each category, the score
+        comparisons of its chosen pairs (one row per category), along with
+        the number of chosen pairs"""
+        categories_index = {cat: i for i, cat in enumerate(self.categories)}
+        comparisons_sums = np.zeros((len(categories_index), len(self.score_names)))
+        pairs_counts = np.zeros(len(categories_index))
+        for real_word, chosen_idx in self.chosen_idx.items():
+            category_id = categories_index[self.word_categories[real_word]]
+            comparisons_sums[category_id] += self.scores_comparisons[real_word][chosen_idx].sum(axis=0)
+            pairs_counts[category_id] += len(chosen_idx)
+        return categories_index, comparisons_sums, pairs_counts
+
+    def categories_balance_objectives(self, comparisons_sums: np.ndarray,
+                                      pairs_counts: np.ndarray) -> np.ndarray:
+        """Objective of each category's balance (i.e., of the proportion of
+        its chosen pairs for which the real word's score is higher than the
+        fake word's), weighted by its number of pairs"""
+        safe_counts = np.maximum(pairs_counts, 1)
+        return pairs_counts * self.objective_fn(comparisons_sums / safe_counts[..., None])
+
+    def balance_objective(self) -> float:
+        """Overall balance objective of the chosen pairs (0 for a perfect balance):
+        the categories' balance objectives, averaged over all chosen pairs"""
+        _, comparisons_sums, pairs_counts = self.categories_comparisons()
+        objectives = self.categories_balance_objectives(comparisons_sums, pairs_counts)
+        return float(objectives.sum() / max(pairs_counts.sum(), 1))
+
+    def iter_balanced_pairs(self) -> Iterable[Tuple[WordId, WordId]]:
         real_words = list(self.word_nonword_pairs.keys())
         random.shuffle(real_words)
         for real_word in real_words:
-            yield real_word, self.choose_non_word(real_word)
+            for fake_word in self.choose_non_words(real_word, self.num_to_keep):
+                yield real_word, fake_word
+
+
+class LocalSearchBalancer(FakeWordsBalancer):
+    """Improves the greedy balancer's choices with a local search, which only
+    stops once no move improves the overall balance objective, or when its
+    time budget (in seconds) is spent.
+
+    A move swaps one of a real word's chosen fake words for one of its other
+    candidates. The score comparisons of the chosen pairs are summed for each
+    (indexed) category, so that a move's effect on the objective only
+    depends on its category's sums, and all the moves of a real word are
+    evaluated at once. For each real word (in a random order), the best
+    improving move is applied, until a whole pass over the words doesn't
+    improve anything."""
+
+    def __init__(self, *args, time_budget: float = 60., **kwargs):
+        super().__init__(*args, **kwargs)
+        self.time_budget = time_budget
+        # overall objectives of the greedy solution and after the local search
+        self.greedy_objective: Optional[float] = None
+        self.objective: Optional[float] = None
+        self.moves_count = 0
+        self.passes_count = 0
+
+    def local_search(self):
+        deadline = time.perf_counter() + self.time_budget
+        categories_index, comparisons_sums, pairs_counts = self.categories_comparisons()
+        objectives = self.categories_balance_objectives(comparisons_sums, pairs_counts)
+        self.greedy_objective = float(objectives.sum() / max(pairs_counts.sum(), 1))
+
+        # real word -> indices of its candidates, without duplicates (chosen
+        # fake words are mapped to the index of their first occurrence)
+        candidates_idx: Dict[WordId, np.ndarray] = {}
+        for real_word, chosen_idx in self.chosen_idx.items():
+            fake_words = self.word_nonword_pairs[real_word]
+            first_occurrences: Dict[WordId, int] = {}
+            for i, fake_word in enumerate(fake_words):
+                first_occurrences.setdefault(fake_word, i)
+            candidates_idx[real_word] = np.array(list(first_occurrences.values()))
+            self.chosen_idx[real_word] = [first_occurrences[fake_words[i]] for i in chosen_idx]
+        real_words = [real_word for real_word, candidates in candidates_idx.items()
+                      if len(candidates) > len(self.chosen_idx[real_word])]
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            self.passes_count += 1
+            random.shuffle(real_words)
+            for real_word in real_words:
+                if time.perf_counter() >= deadline:
+                    break
+                category_id = categories_index[self.word_categories[real_word]]
+                comparisons = self.scores_comparisons[real_word]
+                chosen_idx = np.array(self.chosen_idx[real_word])
+                other_idx = np.setdiff1d(candidates_idx[real_word], chosen_idx)
+                # comparisons sums after each (chosen, other) swap
+                swapped_sums = (comparisons_sums[category_id]
+                                + comparisons[other_idx][None, :, :]
+                                - comparisons[chosen_idx][:, None, :])
+                swapped_objectives = self.categories_balance_objectives(
+                    swapped_sums, pairs_counts[category_id])
+                best_swap = np.unravel_index(swapped_objectives.argmin(), swapped_objectives.shape)
+                # strict improvement, with a tolerance that prevents swapping back and
+                # forth between (numerically) equivalent solutions
+                if swapped_objectives[best_swap] < objectives[category_id] - 1e-9:
+                    chosen_pos, other_pos = best_swap
+                    comparisons_sums[category_id] = swapped_sums[best_swap]
+                    objectives[category_id] = swapped_objectives[best_swap]
+                    self.chosen_idx[real_word][chosen_pos] = int(other_idx[other_pos])
+                    self.moves_count += 1
+                    improved = True
+
+        self.objective = float(objectives.sum() / max(pairs_counts.sum(), 1))
+
+    def iter_balanced_pairs(self) -> Iterable[Tuple[WordId, WordId]]:
+        greedy_pairs = list(super().iter_balanced_pairs())
+        self.local_search()
+        # real words are yielded in the greedy's (shuffled) order
+        for real_word in dict.fromkeys(real_word for real_word, _ in greedy_pairs):
+            fake_words = self.word_nonword_pairs[real_word]
+            for idx in self.chosen_idx[real_word]:
+                yield real_word, fake_words[idx]
@@ -0,0 +1,64 @@
+from typing import Dict, List, Iterable
+
+from .utils import Phoneme
+
+# pseudo-phoneme used to mark word boundaries (for bounded ngrams)
+BOUNDARY = "_"
+BOUNDARY_CODE = 0
+
+
+class PhoneticForm(bytes):
+    """A phonetic form, stored as the sequence of its phonemes' codes in a
+    `PhonemeInventory` (one byte per phoneme). Hashing, equality, iteration
+    (over the codes) and length are those of `bytes`."""
+    __slots__ = ()
+
+    def bounded(self) -> 'PhoneticForm':
+        """Same phonetic form, surrounded by word boundaries"""
+        return PhoneticForm(bytes((BOUNDARY_CODE,)) + self + bytes((BOUNDARY_CODE,)))
+
+
+class PhonemeInventory:
+    """Maps phonemes to small integer codes (code 0 being reserved for the
+    word boundary), to build and decode `PhoneticForm` objects.
+    Phonemes that are unknown to the inventory are added on the fly."""
+    max_size = 256
+
+    def __init__(self, phonemes: Iterable[Phoneme] = ()):
+        self.phonemes: List[Phoneme] = [BOUNDARY]
+        self.codes: Dict[Phoneme, int] = {BOUNDARY: BOUNDARY_CODE}
+        for phoneme in phonemes:
+            self.add(phoneme)
+
+    def __len__(self):
+        return len(self.phonemes)
+
+    def __contains__(self, phoneme: Phoneme):
+        return phoneme in self.codes
+
+    def add(self, phoneme: Phoneme) -> int:
+        code = self.codes.get(phoneme)
+        if code is not None:
+            return code
+        if len(self.phonemes) >= self.max_size:
+            raise ValueError(f"Phoneme inventory can't hold more than {self.max_size} phonemes")
+        code = self.codes[phoneme] = len(self.phonemes)
+        self.phonemes.append(phoneme)
+        return code
+
+    def encode(self, phonemes: Iterable[Phoneme]) -> PhoneticForm:
+        return PhoneticForm(self.add(phoneme) for phoneme in phonemes)
+
+    def parse(self, phonetic: str) -> PhoneticForm:
+        """Encodes a space-separated phonetic form (as found in the CSVs)"""
+        try:
+            return PhoneticForm(self.codes[phoneme] for phoneme in phonetic.split(" "))
+        except KeyError:
+            return self.encode(phonetic.split(" "))
+
+    def decode(self, form: PhoneticForm) -> List[Phoneme]:
+        return [self.phonemes[code] for code in form]
+
+    def fmt(self, form: PhoneticForm) -> str:
+        """Formats a phonetic form back to a space-separated string"""
+        return " ".join(self.phonemes[code] for code in form)
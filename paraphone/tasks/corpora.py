@@ -1,10 +1,18 @@
+import hashlib
+import multiprocessing
+import os
 import re
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
 from pathlib import Path
 from shutil import copyfile
-from typing import Set, List, Literal, Iterable, Optional
+from typing import Set, List, Literal, Iterable, Optional, Dict, FrozenSet, Tuple, Callable
 
+import numpy as np
 import pandas
+import yaml
+from scipy import sparse
 from sortedcontainers import SortedDict
 from tqdm import tqdm
 
@@ -12,7 +20,7 @@ from .base import BaseTask, CorporaTaskMixin
 from .filters.base import CandidatesPairCSV
 from .imports import FileID
 from .tokenize import TokenizedWordsCSV
-from ..utils import logger
+from ..utils import logger, hash_file
 from ..workspace import Workspace, WorkspaceCSV
 
 
@@ -20,7 +28,7 @@ def load_group_words(group: Set[FileID], workspace: Workspace) -> Counter:
     tokenized_folder = workspace.root_path / Path("datasets/tokenized/per_text/")
 
     group_words = Counter()
-    for file_id in group:
+    for file_id in sorted(group):
         tokenized_file = TokenizedWordsCSV(tokenized_folder / Path(f"{file_id}.csv"))
         try:
             group_words.update(tokenized_file.to_dict())
@@ -31,11 +39,192 @@ def load_group_words(group: Set[FileID], workspace: Workspace) -> Counter:
     return group_words
 
 
+class GroupsWordsMatrix:
+    """Words counts of a family's groups of texts, as the rows of a sparse
+    (groups x vocabulary) matrix. The vocabulary (word -> column) is shared
+    by all families, and grows as new words are found."""
+
+    def __init__(self, groups: List[FrozenSet[FileID]], counts: sparse.csr_matrix,
+                 vocabulary: Dict[str, int]):
+        self.groups = groups
+        self.counts = counts
+        self.vocabulary = vocabulary
+
+    @classmethod
+    def from_counters(cls, groups: List[FrozenSet[FileID]], counters: Iterable[Counter],
+                      vocabulary: Dict[str, int]) -> 'GroupsWordsMatrix':
+        indptr, indices, data = [0], [], []
+        for group_words in counters:
+            indices.extend(vocabulary.setdefault(word, len(vocabulary)) for word in group_words)
+            data.extend(group_words.values())
+            indptr.append(len(indices))
+        counts = sparse.csr_matrix((np.array(data, dtype=np.int64), np.array(indices, dtype=np.int64), indptr),
+                                   shape=(len(groups), len(vocabulary)))
+        counts.eliminate_zeros()
+        return cls(groups, counts, vocabulary)
+
+    def subgroups(self, group: FrozenSet[FileID]) -> Optional[List[int]]:
+        """Rows of the (disjoint) groups whose union is the given group, if any"""
+        subgroups_rows = {subgroup: row for row, subgroup in enumerate(self.groups) if subgroup <= group}
+        if (sum(map(len, subgroups_rows)) != len(group)
+                or frozenset().union(*subgroups_rows) != group):
+            return None
+        return list(subgroups_rows.values())
+
+    def union_groups(self, groups: List[FrozenSet[FileID]], workspace: Workspace) -> 'GroupsWordsMatrix':
+        """Words counts of coarser groups, summed from the rows of the groups
+        they are a union of. Groups that aren't a union of these groups are
+        loaded from their texts' words lists."""
+        # (coarser groups x groups) membership matrix, and loaded groups' counts
+        membership_rows, membership_cols = [], []
+        loaded_rows, loaded_counters = [], []
+        for row, group in enumerate(groups):
+            subgroups_rows = self.subgroups(group)
+            if subgroups_rows is None:
+                loaded_rows.append(row)
+                loaded_counters.append(load_group_words(group, workspace))
+                continue
+            membership_rows.extend([row] * len(subgroups_rows))
+            membership_cols.extend(subgroups_rows)
+        membership = sparse.csr_matrix((np.ones(len(membership_rows), dtype=np.int64),
+                                        (membership_rows, membership_cols)),
+                                       shape=(len(groups), len(self.groups)))
+        counts = membership @ self.counts
+        if loaded_rows:
+            loaded = self.from_counters([groups[row] for row in loaded_rows],
+                                        loaded_counters, self.vocabulary)
+            counts.resize((len(groups), len(self.vocabulary)))
+            # moving the loaded groups' counts to their rows
+            placement = sparse.csr_matrix((np.ones(len(loaded_rows), dtype=np.int64),
+                                           (loaded_rows, np.arange(len(loaded_rows)))),
+                                          shape=(len(groups), len(loaded_rows)))
+            counts = counts + placement @ loaded.counts
+        return GroupsWordsMatrix(groups, sparse.csr_matrix(counts), self.vocabulary)
+
+    def vocabulary_counts(self) -> sparse.csr_matrix:
+        """Groups' words counts, over the whole (current) vocabulary"""
+        counts = self.counts.copy()
+        counts.resize((len(self.groups), len(self.vocabulary)))
+        return counts
+
+
+def groups_intersection(counts: sparse.csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+    """Mask of the words found in all groups (rows of the counts matrix),
+    and the words' counts, summed over all groups"""
+    counts = counts.tocsc()
+    words_mask = counts.getnnz(axis=0) == counts.shape[0]
+    return words_mask, np.asarray(counts.sum(axis=0), dtype=np.int64).ravel()
+
+
+def corpora_loading_initializer(workspace: Workspace):
+    global corpora_workspace
+    corpora_workspace = workspace
+
+
+def corpora_loading_runner(group: FrozenSet[FileID]) -> Counter:
+    return load_group_words(group, corpora_workspace)
+
+
+def corpora_writing_initializer(words: List[str]):
+    global corpora_words
+    corpora_words = words
+
+
+def corpora_writing_runner(words_list: Tuple[Path, np.ndarray, np.ndarray]) -> Path:
+    file_path, words_ids, words_counts = words_list
+    logger.debug(f"Writing words list {file_path}")
+    words_csv = TokenizedWordsCSV(file_path)
+    # sorting words by word count (decreasing), then alphabetically, so the
+    # order doesn't depend on the vocabulary's order
+    words = [corpora_words[word_id] for word_id in words_ids.tolist()]
+    with words_csv.dict_writer as dict_writer:
+        dict_writer.writeheader()
+        for word, count in sorted(zip(words, words_counts.tolist()),
+                                  key=lambda item: (-item[1], item[0])):
+            dict_writer.writerow({
+                "word": word, "count": count
+            })
+    return file_path
+
+
+@dataclass
+class FamilyRecord:
+    id: int
+    # hash of the family's groups and of their texts' words lists
+    input_hash: str
+    # number of words found in all the family's groups
+    intersection_words: int
+    # hash of the intersections of the family and of all finer families
+    # (from which the corpus's words are removed)
+    corpus_hash: Optional[str]
+    corpus_words: Optional[int]
+
+
+class FamiliesManifest:
+    """Records, in `corpora/families/manifest.yml`, the families whose
+    intersection (the words found in all their groups, and their counts)
+    is cached in `corpora/families/family_[id].csv`, and the inputs of the
+    intersection and of the corpus built from it."""
+
+    def __init__(self, families_folder: Path):
+        self.families_folder = families_folder
+        self.families: Dict[int, FamilyRecord] = {}
+
+    @property
+    def path(self) -> Path:
+        return self.families_folder / Path("manifest.yml")
+
+    @classmethod
+    def load(cls, families_folder: Path) -> 'FamiliesManifest':
+        manifest = cls(families_folder)
+        if manifest.path.exists():
+            with open(manifest.path) as manifest_file:
+                manifest_dict = yaml.safe_load(manifest_file)
+            manifest.families = {family["id"]: FamilyRecord(**family)
+                                 for family in manifest_dict["families"]}
+        return manifest
+
+    def save(self):
+        with open(self.path, "w") as manifest_file:
+            yaml.safe_dump({"families": [asdict(family) for family in self.families.values()]},
+                           manifest_file, sort_keys=False)
+
+    def intersection_path(self, family_id: int) -> Path:
+        return self.families_folder / Path(f"family_{family_id}.csv")
+
+    def cached_intersection(self, family_id: int, input_hash: Optional[str]) -> Optional[FamilyRecord]:
+        """The family's record, if its intersection is cached (and was computed
+        from the given inputs, if their hash is given)"""
+        record = self.families.get(family_id)
+        if record is None or not self.intersection_path(family_id).is_file():
+            return None
+        if input_hash is not None and record.input_hash != input_hash:
+            return None
+        return record
+
+
 class CorporaCreationTask(BaseTask):
     """Creates corpora based on the list of tokenized words for each text
     in the dataset and the text files families. The output words list are
     compted from the intersection of the words of the texts from the families'
-    groups"""
+    groups.
+
+    Families are processed bottom-up, from the finest (family 64) to the
+    coarsest (family 1). Only the finest family's groups are loaded from the
+    texts' words lists (each text is thus only read once), and the groups of
+    a coarser family, which are unions of finer groups, sum the words counts
+    of these finer groups. Groups' words counts are rows of a sparse
+    (groups x vocabulary) matrix, so that the intersection of a family's
+    groups is computed column-wise.
+
+    The families' intersections are independent, and are computed (and their
+    words lists written) in parallel, the words of finer families being
+    removed from coarser families in between, in a single ordered pass.
+
+    Intersections are cached along with a hash of their inputs, and only the
+    families whose inputs changed are recomputed. If a family is given, only
+    that family is recomputed, the others' cached intersections being reused,
+    and only its corpus and the corpora of the coarser families are written."""
     requires = [
         "datasets/tokenized/all.csv",
         "datasets/families/*/*.txt"
@@ -44,75 +233,184 @@ class CorporaCreationTask(BaseTask):
     creates = [
         "corpora/",
         "corpora/tokenized/*.csv",
+        "corpora/families/manifest.yml",
     ]
 
+    def __init__(self, num_workers: int = 1, family: Optional[int] = None):
+        super().__init__()
+        self.num_workers = num_workers
+        self.family = family
+
     @staticmethod
     def sort_families_folders(folders: Iterable[Path]) -> List[Path]:
         return sorted(folders, key=lambda x: int(x.stem.split("_")[1]),
                       reverse=True)
 
-    def run(self, workspace: Workspace):
-        workspace.corpora.mkdir(parents=True, exist_ok=True)
+    @staticmethod
+    def load_group(group_filepath: Path) -> FrozenSet[FileID]:
+        assert group_filepath.is_file()
+        with open(group_filepath) as group_file:
+            return frozenset(file_id for file_id in group_file.read().split("\n") if file_id)
 
-        logger.info("Building families words lists...")
+    def load_families(self, workspace: Workspace) -> Dict[int, Tuple[List[Path], List[FrozenSet[FileID]]]]:
+        """Groups files and groups of each family, from the finest to the coarsest"""
         families_folder = workspace.datasets / Path("families/")
-        # Families *have* to be sorted
-        pbar = tqdm(self.sort_families_folders(families_folder.iterdir()))
-        previous_group_words: Set[str] = set()
-        for family_folder in pbar:
+        families = {}
+        # Families *have* to be sorted, from the finest to the coarsest
+        for family_folder in self.sort_families_folders(families_folder.iterdir()):
             family_folder: Path
             assert family_folder.is_dir()
             family_id = int(re.fullmatch(r"family_([0-9]+)", family_folder.name)[1])
             assert len(list(family_folder.iterdir())) == family_id
-
-            family_words_dict = None
             groups_paths = self.sort_families_folders(list(family_folder.iterdir()))
-            for group_filepath in groups_paths:
-                pbar.set_description(f"Family {family_id}: {group_filepath.name}")
+            families[family_id] = groups_paths, [self.load_group(group_filepath)
+                                                 for group_filepath in groups_paths]
+        return families
 
-                assert group_filepath.is_file()
-                with open(group_filepath) as group_file:
-                    group = set(file_id for file_id in group_file.read().split("\n") if file_id)
-                group_words_dict = load_group_words(group, workspace)
+    @staticmethod
+    def family_hash(groups: List[FrozenSet[FileID]], texts_hashes: Dict[FileID, str],
+                    workspace: Workspace) -> str:
+        """Hash of the family's groups and of their texts' words lists (each
+        text's hash is computed once, and shared by all families)"""
+        tokenized_folder = workspace.root_path / Path("datasets/tokenized/per_text/")
+        family_hash = hashlib.sha256()
+        for group in groups:
+            for file_id in sorted(group):
+                if file_id not in texts_hashes:
+                    text_path = tokenized_folder / Path(f"{file_id}.csv")
+                    texts_hashes[file_id] = hash_file(text_path) if text_path.is_file() else ""
+                family_hash.update(f"{file_id}:{texts_hashes[file_id]}\n".encode("utf-8"))
+            family_hash.update(b"\n")
+        return family_hash.hexdigest()
+
+    def parallel_map(self, func: Callable, iterable: Iterable,
+                     initializer: Optional[Callable] = None, initargs: Tuple = ()) -> Iterable:
+        """Ordered map, in parallel if there are several workers"""
+        if self.num_workers <= 1:
+            if initializer is not None:
+                initializer(*initargs)
+            yield from map(func, iterable)
+            return
+        with multiprocessing.Pool(processes=self.num_workers,
+                                  initializer=initializer, initargs=initargs) as pool:
+            yield from pool.imap(func, iterable)
+
+    def compute_intersections(self, families: Dict[int, Tuple[List[Path], List[FrozenSet[FileID]]]],
+                              families_ids: Set[int], vocabulary: Dict[str, int],
+                              workspace: Workspace) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """Ids and counts of the words found in all groups of each given family"""
+        logger.info("Building families groups words counts...")
+        # family id -> words counts of the family's groups, built bottom-up
+        # until the coarsest family to compute
+        families_groups_words: Dict[int, GroupsWordsMatrix] = {}
+        finer_groups_words: Optional[GroupsWordsMatrix] = None
+        for family_id, (_, groups) in tqdm(families.items()):
+            if finer_groups_words is None:
+                groups_counters = self.parallel_map(corpora_loading_runner, groups,
+                                                    corpora_loading_initializer, (workspace,))
+                groups_words = GroupsWordsMatrix.from_counters(groups, groups_counters, vocabulary)
+            else:
+                groups_words = finer_groups_words.union_groups(groups, workspace)
+            finer_groups_words = groups_words
+            if family_id in families_ids:
+                families_groups_words[family_id] = groups_words
+            if families_ids <= set(families_groups_words):
+                break
+
+        # the families' intersections are independent, and computed in parallel
+        logger.info("Intersecting families groups...")
+        families_intersections = {}
+        for family_id, (words_mask, words_counts) in zip(families_groups_words, tqdm(self.parallel_map(
+                groups_intersection,
+                (groups_words.vocabulary_counts() for groups_words in families_groups_words.values())),
+                total=len(families_groups_words))):
+            words_ids = np.flatnonzero(words_mask)
+            families_intersections[family_id] = words_ids, words_counts[words_ids]
+        return families_intersections
 
-                # the first group is taken as base for the intersection
-                if family_words_dict is None:
-                    family_words_dict = group_words_dict
-                else:
-                    # else we only keep the words set that intersect
-                    # and increment their counts with the currentgroup's count
-                    words_intersection = (set(group_words_dict) & set(family_words_dict))
-                    for word in list(family_words_dict):
-                        if word in words_intersection:
-                            family_words_dict[word] += group_words_dict[word]
-                        else:
-                            del family_words_dict[word]
-
-            # removing words from "previous" family
-            len_before = len(family_words_dict)
-            for word in previous_group_words:
-                if word in family_words_dict:
-                    del family_words_dict[word]
-            previous_group_words.update(set(family_words_dict.keys()))
-
-            logger.debug(f"Removed {len_before - len(family_words_dict)} words "
+    @staticmethod
+    def load_intersection(intersection_path: Path, vocabulary: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+        words_counts = TokenizedWordsCSV(intersection_path).to_dict()
+        words_ids = np.fromiter((vocabulary.setdefault(word, len(vocabulary)) for word in words_counts),
+                                dtype=np.int64, count=len(words_counts))
+        return words_ids, np.fromiter(words_counts.values(), dtype=np.int64, count=len(words_counts))
+
+    def run(self, workspace: Workspace):
+        workspace.corpora.mkdir(parents=True, exist_ok=True)
+        families = self.load_families(workspace)
+        if self.family is not None and self.family not in families:
+            raise ValueError(f"Family {self.family} not found, available families are "
+                             f"{', '.join(map(str, families))}")
+        manifest = FamiliesManifest.load(workspace.corpora / Path("families/"))
+
+        # finding the families whose cached intersection can be reused
+        texts_hashes: Dict[FileID, str] = {}
+        input_hashes: Dict[int, str] = {}
+        cached_families: Dict[int, FamilyRecord] = {}
+        for family_id, (_, groups) in families.items():
+            if self.family is not None and family_id != self.family:
+                # the other families' cached intersections are reused as is
+                record = manifest.cached_intersection(family_id, None)
+                if record is not None:
+                    cached_families[family_id] = record
+                    continue
+            input_hashes[family_id] = self.family_hash(groups, texts_hashes, workspace)
+            if self.family is None:
+                record = manifest.cached_intersection(family_id, input_hashes[family_id])
+                if record is not None:
+                    cached_families[family_id] = record
+                    del input_hashes[family_id]
+        logger.info(f"Reusing the cached intersections of {len(cached_families)} families, "
+                    f"computing {len(input_hashes)} families")
+
+        vocabulary: Dict[str, int] = {}
+        families_intersections: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for family_id in cached_families:
+            families_intersections[family_id] = self.load_intersection(
+                manifest.intersection_path(family_id), vocabulary)
+        if input_hashes:
+            families_intersections.update(self.compute_intersections(
+                families, set(input_hashes), vocabulary, workspace))
+
+        # removing words from "previous" families, from the finest to the coarsest
+        previous_words_mask = np.zeros(len(vocabulary), dtype=bool)
+        corpora_hash = hashlib.sha256()
+        # (output path, words ids, words counts) of the words lists to write
+        words_lists: List[Tuple[Path, np.ndarray, np.ndarray]] = []
+        tokenized_corpora_folder = workspace.corpora / Path("tokenized/")
+        tokenized_corpora_folder.mkdir(parents=True, exist_ok=True)
+        for family_id in families:
+            words_ids, words_counts = families_intersections[family_id]
+            if family_id in cached_families:
+                record = cached_families[family_id]
+            else:
+                record = FamilyRecord(id=family_id, input_hash=input_hashes[family_id],
+                                      intersection_words=len(words_ids),
+                                      corpus_hash=None, corpus_words=None)
+                words_lists.append((manifest.intersection_path(family_id), words_ids, words_counts))
+
+            kept_words = ~previous_words_mask[words_ids]
+            previous_words_mask[words_ids] = True
+            logger.debug(f"Removed {len(words_ids) - np.count_nonzero(kept_words)} words "
                          f"from smaller corpora in corpus {family_id}")
 
-            logger.debug(f"Writing words list for family {family_id}")
-            tokenized_corpora_folder = workspace.corpora / Path("tokenized/")
-            tokenized_corpora_folder.mkdir(parents=True, exist_ok=True)
-            family_words_csv = TokenizedWordsCSV(tokenized_corpora_folder /
-                                                 Path(f"corpus_{family_id}.csv"))
-            # sorting dict by word count (decreasing)
-            family_words_dict = dict(sorted(family_words_dict.items(),
-                                            key=lambda item: item[1],
-                                            reverse=True))
-            with family_words_csv.dict_writer as dict_writer:
-                dict_writer.writeheader()
-                for word, count in family_words_dict.items():
-                    dict_writer.writerow({
-                        "word": word, "count": count
-                    })
+            # a corpus depends on its family's intersection and on the finer families'
+            corpora_hash.update(f"{family_id}:{record.input_hash}\n".encode("utf-8"))
+            corpus_path = tokenized_corpora_folder / Path(f"corpus_{family_id}.csv")
+            if record.corpus_hash != corpora_hash.hexdigest() or not corpus_path.is_file():
+                record.corpus_hash = corpora_hash.hexdigest()
+                record.corpus_words = int(np.count_nonzero(kept_words))
+                words_lists.append((corpus_path, words_ids[kept_words], words_counts[kept_words]))
+            manifest.families[family_id] = record
+
+        logger.info(f"Writing {len(words_lists)} words lists...")
+        manifest.families_folder.mkdir(parents=True, exist_ok=True)
+        for _ in tqdm(self.parallel_map(corpora_writing_runner, words_lists,
+                                        corpora_writing_initializer, (list(vocabulary),)),
+                      total=len(words_lists)):
+            pass
+        manifest.families = dict(sorted(manifest.families.items(), reverse=True))
+        manifest.save()
 
 
 class ZeroSpeechCSV(WorkspaceCSV):
@@ -122,7 +420,22 @@ class ZeroSpeechCSV(WorkspaceCSV):
         super().__init__(file_path, separator=",", header=self.header)
 
 
+LINK_MODES = ("copy", "hardlink", "symlink", "reflink")
+# ioctl request cloning a file's extents (FICLONE, from linux/fs.h)
+FICLONE = 0x40049409
+
+
+def reflink_file(source: Path, destination: Path):
+    """Copy-on-write clone of a file, for filesystems supporting it (btrfs, xfs...)"""
+    import fcntl
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+
+
 class BuildZeroSpeechTestSetsTask(BaseTask, CorporaTaskMixin):
+    """Builds the ZeroSpeech test set of each corpus: its gold CSV, its words
+    frequencies table, and its audio files, which are copied or linked
+    (using a thread pool) from the synthesized audio files"""
     requires = [
         "corpora/wuggy_pairs/*",
         "synth/audio/phonetic/",
@@ -131,11 +444,72 @@ class BuildZeroSpeechTestSetsTask(BaseTask, CorporaTaskMixin):
     def __init__(self,
                  output_folder : Path,
                  real_word_synth: Literal["text", "phonetic"],
-                 for_corpus: Optional[int] = None):
+                 for_corpus: Optional[int] = None,
+                 link_mode: str = "copy",
+                 num_threads: int = 16):
         super().__init__()
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"Invalid link mode {link_mode}, should be one "
+                             f"of {', '.join(LINK_MODES)}")
         self.real_word_synth = real_word_synth
         self.for_corpus = for_corpus
         self.output_folder  = output_folder
+        self.link_mode = link_mode
+        self.num_threads = num_threads
+        # whether reflinks are supported by the audio folder's filesystem,
+        # decided on the first linked file, before the linking threads start
+        self._reflink_supported = True
+
+    @staticmethod
+    def reflink_or_copy(source: Path, destination: Path) -> bool:
+        """Reflinks the file, or else copies it. Returns whether it was reflinked"""
+        try:
+            reflink_file(source, destination)
+            return True
+        except OSError as error:
+            if not source.is_file():
+                destination.unlink(missing_ok=True)
+                raise FileNotFoundError(f"Audio file {source} not found") from error
+        try:
+            copyfile(source, destination)
+        except BaseException:
+            # the failed reflink left an empty destination file
+            destination.unlink(missing_ok=True)
+            raise
+        return False
+
+    def link_file(self, source: Path, destination: Path):
+        if self.link_mode == "hardlink":
+            os.link(source, destination)
+        elif self.link_mode == "symlink":
+            # a symlink to a missing file would be silently created
+            if not source.is_file():
+                raise FileNotFoundError(f"Audio file {source} not found")
+            os.symlink(source.resolve(), destination)
+        elif self.link_mode == "reflink" and self._reflink_supported:
+            self.reflink_or_copy(source, destination)
+        else:
+            copyfile(source, destination)
+
+    def link_audio_files(self, audio_files: Dict[Path, Path], audio_folder: Path):
+        """Copies or links the audio files (destination -> source) that aren't
+        already in the audio folder, which is listed only once"""
+        existing_files = set(os.listdir(audio_folder))
+        missing_files = [(source, destination) for destination, source in audio_files.items()
+                         if destination.name not in existing_files]
+        logger.info(f"Found {len(audio_files) - len(missing_files)} audio files in {audio_folder}, "
+                    f"{len(missing_files)} audio files left to {self.link_mode}")
+        if self.link_mode == "reflink" and missing_files:
+            # the first file is reflinked (or copied) in the main thread, so the
+            # linking threads only read whether reflinks are supported
+            self._reflink_supported = self.reflink_or_copy(*missing_files.pop(0))
+            if not self._reflink_supported:
+                logger.warning(f"Couldn't reflink audio files to {audio_folder}, "
+                               f"copying them instead")
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            for _ in tqdm(executor.map(lambda files: self.link_file(*files), missing_files),
+                          total=len(missing_files)):
+                pass
 
     def build_frequencies_csv(self,
                               zr_corpus_folder: Path,
@@ -181,6 +555,8 @@ class BuildZeroSpeechTestSetsTask(BaseTask, CorporaTaskMixin):
         zr_corpus_csv = ZeroSpeechCSV(zr_csv_path)
 
         pbar = tqdm(total=corpus_wuggy_pairs_csv.lines_count * len(voices))
+        # destination -> source of the pairs' audio files
+        audio_files: Dict[Path, Path] = {}
 
         with zr_corpus_csv.dict_writer as dict_writer:
             dict_writer.writeheader()
@@ -214,7 +590,7 @@ class BuildZeroSpeechTestSetsTask(BaseTask, CorporaTaskMixin):
                         "correct": 0
                     })
 
-                    # copying audio files for the pair
+                    # audio files for the pair, copied or linked once the gold CSV is written
                     if self.real_word_synth == "text":
                         word_audio_path = text_synth_folder / Path(f"{voice}/{word_filename}.ogg")
                     else:
@@ -223,12 +599,13 @@ class BuildZeroSpeechTestSetsTask(BaseTask, CorporaTaskMixin):
                     fake_word_audio_path = phonetic_synth_folder / Path(f"{voice}/{fake_word_filename}.ogg")
                     fake_word_cp_path = zr_audio_folder / Path(f"{fake_word_filename}-{voice}.ogg")
 
-                    if not word_cp_path.is_file():
-                        copyfile(word_audio_path, word_cp_path)
-                    if not fake_word_cp_path.is_file():
-                        copyfile(fake_word_audio_path, fake_word_cp_path)
+                    audio_files[word_cp_path] = word_audio_path
+                    audio_files[fake_word_cp_path] = fake_word_audio_path
 
                     pbar.update()
+        pbar.close()
+
+        self.link_audio_files(audio_files, zr_audio_folder)
 
     def run(self, workspace: Workspace):
         zr_folder = self.output_folder
@@ -1,13 +1,18 @@
+import hashlib
 import re
-from dataclasses import dataclass
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from dataclasses import dataclass, asdict
 from pathlib import Path
-from typing import Tuple, List, Iterable, Set, Optional
+from typing import Tuple, List, Iterable, Set, Optional, Dict, Any
 
+import yaml
 from tqdm import tqdm
 
 from ..base import BaseTask, CorporaTaskMixin
 from ..tokenize import TokenizedWordsCSV
-from ...utils import logger
+from ...utils import logger, chunkify, hash_file
 from ...workspace import Workspace, WorkspaceCSV
 
 
@@ -30,58 +35,285 @@ class CandidatesPairCSV(WorkspaceCSV):
                 yield row["word"], row["word_pho"], row["fake_word_pho"]
 
 
+@dataclass
+class StepRecord:
+    id: int
+    name: str
+    # output file name (None for steps whose output wasn't written)
+    file: Optional[str]
+    params: Dict[str, Any]
+    rows: int
+    # hash of everything the step's output depends on (None if unknown)
+    input_hash: Optional[str]
+    duration: Optional[float]
+
+
+class StepsManifest:
+    """Records the steps of the filtering sub-pipeline in `steps/manifest.yml`.
+
+    Steps of the current run are `steps[:cursor]`, the last of which is the
+    input of the next step. Steps beyond the cursor are the (still valid)
+    outputs of a previous run, and are reused if the next steps have
+    the same inputs and parameters."""
+    step_re = re.compile(r"step_([0-9]+)_(.*)\.csv")
+
+    def __init__(self, steps_folder: Path):
+        self.steps_folder = steps_folder
+        self.steps: List[StepRecord] = []
+        self.cursor = 0
+
+    @property
+    def path(self) -> Path:
+        return self.steps_folder / Path("manifest.yml")
+
+    @classmethod
+    def from_workspace(cls, workspace: Workspace) -> 'StepsManifest':
+        return cls.load(workspace.candidates_filtering / Path("steps"))
+
+    @classmethod
+    def load(cls, steps_folder: Path) -> 'StepsManifest':
+        manifest = cls(steps_folder)
+        if manifest.path.exists():
+            with open(manifest.path) as manifest_file:
+                manifest_dict = yaml.safe_load(manifest_file)
+            manifest.steps = [StepRecord(**step) for step in manifest_dict["steps"]]
+            manifest.cursor = manifest_dict["cursor"]
+        elif steps_folder.exists():
+            # steps folder created before the manifest existed: the steps
+            # are recovered from their file names, and can't be reused
+            for filepath in sorted(steps_folder.iterdir()):
+                re_match = cls.step_re.match(filepath.name)
+                if re_match is None:
+                    continue
+                manifest.steps.append(StepRecord(
+                    id=int(re_match[1]), name=re_match[2], file=filepath.name, params={},
+                    rows=CandidatesPairCSV(filepath).lines_count - 1,
+                    input_hash=None, duration=None))
+            manifest.steps.sort(key=lambda step: step.id)
+            manifest.cursor = len(manifest.steps)
+        return manifest
+
+    def save(self):
+        with open(self.path, "w") as manifest_file:
+            yaml.safe_dump({"cursor": self.cursor,
+                            "steps": [asdict(step) for step in self.steps]},
+                           manifest_file, sort_keys=False)
+
+    @property
+    def current_step(self) -> StepRecord:
+        if self.cursor == 0:
+            raise FileNotFoundError(f"No filtering step found in {self.steps_folder}")
+        return self.steps[self.cursor - 1]
+
+    def step_path(self, step: StepRecord) -> Path:
+        if step.file is None:
+            raise FileNotFoundError(f"Output of filtering step {step.id} ({step.name}) "
+                                    f"wasn't written")
+        return self.steps_folder / Path(step.file)
+
+    def next_input_hash(self, resources_hash: str) -> Optional[str]:
+        """Hash of the inputs of the step following the current step: the
+        current step's own inputs and parameters, and the next step's resources"""
+        step = self.current_step
+        if step.input_hash is None:
+            return None
+        inputs_hash = hashlib.sha256()
+        for part in (step.input_hash, step.name,
+                     yaml.safe_dump(step.params, sort_keys=True),
+                     resources_hash):
+            inputs_hash.update(part.encode("utf-8"))
+        return inputs_hash.hexdigest()
+
+    def find_reusable(self, name: str, params: Dict[str, Any],
+                      input_hash: Optional[str]) -> Optional[StepRecord]:
+        """Returns the next step recorded from a previous run if its inputs
+        and parameters match"""
+        if input_hash is None or self.cursor >= len(self.steps):
+            return None
+        step = self.steps[self.cursor]
+        if (step.name == name and step.params == params and step.input_hash == input_hash
+                and step.file is not None and self.step_path(step).exists()):
+            return step
+        return None
+
+    def matches(self, steps: List[StepRecord]) -> bool:
+        """Checks if the recorded steps are the same as the given steps (same names,
+        parameters and inputs), and if the output of the last one is still there"""
+        if len(self.steps) < len(steps) or steps[-1].input_hash is None:
+            return False
+        for recorded_step, step in zip(self.steps, steps):
+            if (recorded_step.name, recorded_step.params, recorded_step.input_hash) \
+                    != (step.name, step.params, step.input_hash):
+                return False
+        last_step = self.steps[len(steps) - 1]
+        return last_step.file is not None and self.step_path(last_step).exists()
+
+    def truncate(self):
+        """Removes the steps beyond the cursor (and their outputs)"""
+        for step in self.steps[self.cursor:]:
+            if step.file is not None:
+                self.step_path(step).unlink(missing_ok=True)
+        self.steps = self.steps[:self.cursor]
+
+    def append(self, step: StepRecord):
+        self.truncate()
+        self.steps.append(step)
+        self.cursor = len(self.steps)
+
+
+def resources_hash(workspace: Workspace, requires: List[str]) -> str:
+    """Hash of the contents of a step's required files (apart from the
+    filtering pipeline's own files)"""
+    files_hash = hashlib.sha256()
+    for path_template in requires:
+        if path_template.startswith(("candidates_filtering/", "wuggy/candidates.csv")):
+            continue
+        for file_path in sorted(workspace.root_path.glob(path_template)):
+            if file_path.is_file():
+                files_hash.update(hash_file(file_path).encode("utf-8"))
+    return files_hash.hexdigest()
+
+
 class FilteringTaskMixin(BaseTask):
-    step_re = re.compile("step_([0-9]+).*")
     step_name: str
+    # stateful filters need to see all the pairs output by the previous step
+    # (via `observe_pair`) before being able to decide which ones to keep
+    stateful: bool = False
+    # the decisions of nondeterministic filters depend on the pairs they've
+    # been called on before (e.g., they draw from the random generator)
+    deterministic: bool = True
+    # number of pairs passed at once to `keep_pairs`
+    batch_size: int = 2 ** 12
+    # whether the step's output from a previous run can be reused if the
+    # step's inputs and parameters are unchanged
+    reuse_outputs: bool = True
 
     @classmethod
     def next_step_filename(cls, previous_step_id: int) -> Path:
         return Path(f"step_{previous_step_id + 1}_{cls.step_name}.csv")
 
+    @property
+    def step_params(self) -> Dict[str, Any]:
+        """Parameters of the filter that have an effect on its output"""
+        return {}
+
+    def previous_step(self, workspace: Workspace) -> StepRecord:
+        """Finds the last step in the filtering sub-pipeline"""
+        return StepsManifest.from_workspace(workspace).current_step
+
     def previous_step_filepath(self, workspace: Workspace) -> Tuple[Path, int]:
         """Finds the last output from the previous step in the filtering
         sub-pipeline"""
-        filtering_steps_folder = workspace.candidates_filtering / Path("steps")
-        found_steps_files: List[Tuple[Path, int]] = list()
-        for filepath in filtering_steps_folder.iterdir():
-            re_match = self.step_re.match(filepath.name)
-            if re_match is not None:
-                found_steps_files.append((filepath, int(re_match[1])))
-        return max(found_steps_files, key=lambda x: x[1])
+        manifest = StepsManifest.from_workspace(workspace)
+        previous_step = manifest.current_step
+        return manifest.step_path(previous_step), previous_step.id
 
     def previous_step_csv(self, workspace: Workspace) -> CandidatesPairCSV:
         filepath, _ = self.previous_step_filepath(workspace)
         return CandidatesPairCSV(filepath)
 
+    def prepare(self, workspace: Workspace):
+        """Loads the resources needed by the filter (called before any
+        pair is observed or filtered)"""
+        pass
+
+    def observe_pair(self, word_pair: WordPair):
+        """Called, for stateful filters, on every pair of the previous step"""
+        pass
+
+    def end_observation(self):
+        """Called, for stateful filters, once all pairs have been observed"""
+        pass
+
     def keep_pair(self, word_pair: WordPair) -> bool:
         raise NotImplemented()
 
-    def filter(self, workspace: Workspace):
-        """Filters out candidates based on the `keep_pair` function's output"""
+    def keep_pairs(self, word_pairs: List[WordPair]) -> List[bool]:
+        """Batched version of `keep_pair`. Can be overridden by filters
+        that can process several pairs at once more efficiently"""
+        return [self.keep_pair(word_pair) for word_pair in word_pairs]
+
+    def close(self):
+        """Called once the filter has been applied to all pairs"""
+        pass
+
+    def filter(self, workspace: Workspace) -> int:
+        """Filters out candidates based on the `keep_pair` function's output.
+        Returns the number of kept pairs."""
 
-        previous_step_path, previous_step_id = self.previous_step_filepath(workspace)
-        input_csv = CandidatesPairCSV(previous_step_path)
-        output_csv = CandidatesPairCSV(previous_step_path.parent
-                                       / self.next_step_filename(previous_step_id))
+        manifest = StepsManifest.from_workspace(workspace)
+        previous_step = manifest.current_step
+        input_csv = CandidatesPairCSV(manifest.step_path(previous_step))
+        output_csv = CandidatesPairCSV(manifest.steps_folder
+                                       / self.next_step_filename(previous_step.id))
 
         logger.info(f"Filtering pairs from {input_csv.file_path} into {output_csv.file_path}")
-        pairs_count = input_csv.lines_count
+        pairs_count = previous_step.rows
         kept_count = 0
+        pbar = tqdm(total=pairs_count)
         with output_csv.dict_writer as dict_writer:
             dict_writer.writeheader()
-            for word, word_pho, fake_word_pho in tqdm(input_csv, total=pairs_count):
-                word_pair = WordPair(word, word_pho, fake_word_pho)
-                if self.keep_pair(word_pair):
-                    kept_count += 1
-                    dict_writer.writerow({
-                        "word": word, "word_pho": word_pho, "fake_word_pho": fake_word_pho
-                    })
-        logger.info(f"Kept {kept_count} ({kept_count / pairs_count:.0%}) of pairs.")
+            word_pairs_iter = (WordPair(*row) for row in input_csv)
+            for word_pairs in chunkify(word_pairs_iter, self.batch_size):
+                for word_pair, keep in zip(word_pairs, self.keep_pairs(word_pairs)):
+                    if keep:
+                        kept_count += 1
+                        dict_writer.writerow({
+                            "word": word_pair.word,
+                            "word_pho": word_pair.word_pho,
+                            "fake_word_pho": word_pair.fake_word_pho
+                        })
+                pbar.update(len(word_pairs))
+        pbar.close()
+        self.close()
+        logger.info(f"Kept {kept_count} ({kept_count / max(pairs_count, 1):.0%}) of pairs.")
+        return kept_count
+
+    def apply(self, workspace: Workspace) -> int:
+        """Runs the filter on the previous step's output, returning the number
+        of kept pairs"""
+        self.prepare(workspace)
+        if self.stateful:
+            for word, word_pho, fake_word_pho in self.previous_step_csv(workspace):
+                self.observe_pair(WordPair(word, word_pho, fake_word_pho))
+            self.end_observation()
+        return self.filter(workspace)
+
+    def run(self, workspace: Workspace):
+        manifest = StepsManifest.from_workspace(workspace)
+        input_hash = manifest.next_input_hash(resources_hash(workspace, self.requires))
+        reusable_step = manifest.find_reusable(self.step_name, self.step_params, input_hash)
+        if reusable_step is not None and self.reuse_outputs:
+            logger.info(f"Inputs and parameters of step {self.step_name} are unchanged, "
+                        f"reusing {reusable_step.file}")
+            manifest.cursor += 1
+            manifest.save()
+            return
+
+        # removing the outputs of a previous run that are now outdated
+        manifest.truncate()
+        manifest.save()
+        previous_step = manifest.current_step
+        start_time = time.perf_counter()
+        kept_count = self.apply(workspace)
+        manifest.append(StepRecord(
+            id=previous_step.id + 1,
+            name=self.step_name,
+            file=str(self.next_step_filename(previous_step.id)),
+            params=self.step_params,
+            rows=kept_count,
+            input_hash=input_hash,
+            duration=round(time.perf_counter() - start_time, 3)
+        ))
+        manifest.save()
 
 
 class CorpusFinalFilteringTask(FilteringTaskMixin, CorporaTaskMixin, BaseTask):
     """Specific version of the `FilteringTaskMixin` made for the final
-    step of the pipeline, and that is corpus-specific."""
+    step of the pipeline, and that is corpus-specific.
+
+    In `single_pass` mode, the previous step is read only once for all corpora,
+    each kept pair being routed to the output of every corpus containing its word."""
 
     requires = [
         "corpora/tokenized/*.csv"
@@ -91,24 +323,33 @@ class CorpusFinalFilteringTask(FilteringTaskMixin, CorporaTaskMixin, BaseTask):
         "corpora/wuggy_pairs/*.csv"
     ]
 
-    def __init__(self, for_corpus: Optional[int] = None):
+    def __init__(self, for_corpus: Optional[int] = None, single_pass: bool = False):
         super().__init__()
         self.for_corpus = for_corpus
+        self.single_pass = single_pass
 
     @classmethod
     def get_tokenized_corpus(cls, workspace: Workspace, corpus_id: int) -> TokenizedWordsCSV:
         csv_path =  workspace.corpora / Path(f"tokenized/corpus_{corpus_id}.csv")
         return TokenizedWordsCSV(csv_path)
 
+    @classmethod
+    def get_output_csv(cls, workspace: Workspace, corpus_id: int) -> CandidatesPairCSV:
+        output_corpora_folder = workspace.corpora / Path("wuggy_pairs")
+        output_corpora_folder.mkdir(parents=True, exist_ok=True)
+        return CandidatesPairCSV(output_corpora_folder / Path(f"corpus_{corpus_id}.csv"))
+
+    def keep_pair_for_corpus(self, word_pair: WordPair, corpus_id: int) -> bool:
+        return self.keep_pair(word_pair)
+
     def filter(self, workspace: Workspace, corpus_id: int):  # noqa
         """Filters out candidates based on the `keep_pair` function's output,
         and only for the """
 
-        previous_step_path, previous_step_id = self.previous_step_filepath(workspace)
-        input_csv = CandidatesPairCSV(previous_step_path)
-        output_corpora_folder = workspace.corpora / Path("wuggy_pairs")
-        output_corpora_folder.mkdir(parents=True, exist_ok=True)
-        output_csv = CandidatesPairCSV(output_corpora_folder / Path(f"corpus_{corpus_id}.csv"))
+        manifest = StepsManifest.from_workspace(workspace)
+        previous_step = manifest.current_step
+        input_csv = CandidatesPairCSV(manifest.step_path(previous_step))
+        output_csv = self.get_output_csv(workspace, corpus_id)
 
         # retrieving the tokenized word list of corpus to eliminate all words
         # not contained in that corpus
@@ -117,7 +358,7 @@ class CorpusFinalFilteringTask(FilteringTaskMixin, CorporaTaskMixin, BaseTask):
 
         logger.info(f"Filtering pairs (for corpus {corpus_id}), "
                     f"from {input_csv.file_path} into {output_csv.file_path}")
-        pairs_count = input_csv.lines_count
+        pairs_count = previous_step.rows
         kept_count = 0
         with output_csv.dict_writer as dict_writer:
             dict_writer.writeheader()
@@ -125,15 +366,60 @@ class CorpusFinalFilteringTask(FilteringTaskMixin, CorporaTaskMixin, BaseTask):
                 if word not in corpus_words_pho:
                     continue
                 word_pair = WordPair(word, word_pho, fake_word_pho)
-                if self.keep_pair(word_pair):
+                if self.keep_pair_for_corpus(word_pair, corpus_id):
                     kept_count += 1
                     dict_writer.writerow({
                         "word": word, "word_pho": word_pho, "fake_word_pho": fake_word_pho
                     })
-        logger.info(f"Kept {kept_count} ({kept_count / pairs_count:.0%}) of pairs for corpus {corpus_id}")
+        logger.info(f"Kept {kept_count} ({kept_count / max(pairs_count, 1):.0%}) of pairs for corpus {corpus_id}")
+
+    def filter_all(self, workspace: Workspace, corpus_ids: List[int]):
+        """Same as `filter`, but for all corpora at once, in a single pass
+        over the previous step's output"""
+        manifest = StepsManifest.from_workspace(workspace)
+        previous_step = manifest.current_step
+        input_csv = CandidatesPairCSV(manifest.step_path(previous_step))
+
+        # word -> corpora that contain that word
+        words_corpora: Dict[str, List[int]] = defaultdict(list)
+        for corpus_id in corpus_ids:
+            tokenized_corpus_csv = self.get_tokenized_corpus(workspace, corpus_id)
+            for word in {word for word, _ in tokenized_corpus_csv}:
+                words_corpora[word].append(corpus_id)
+
+        logger.info(f"Filtering pairs from {input_csv.file_path} for corpora "
+                    f"{', '.join(map(str, corpus_ids))}")
+        pairs_count = previous_step.rows
+        kept_counts = {corpus_id: 0 for corpus_id in corpus_ids}
+        with ExitStack() as stack:
+            dict_writers = {
+                corpus_id: stack.enter_context(self.get_output_csv(workspace, corpus_id).dict_writer)
+                for corpus_id in corpus_ids
+            }
+            for dict_writer in dict_writers.values():
+                dict_writer.writeheader()
+            for word, word_pho, fake_word_pho in tqdm(input_csv, total=pairs_count):
+                word_corpora = words_corpora.get(word)
+                if word_corpora is None:
+                    continue
+                word_pair = WordPair(word, word_pho, fake_word_pho)
+                for corpus_id in word_corpora:
+                    if self.keep_pair_for_corpus(word_pair, corpus_id):
+                        kept_counts[corpus_id] += 1
+                        dict_writers[corpus_id].writerow({
+                            "word": word, "word_pho": word_pho, "fake_word_pho": fake_word_pho
+                        })
+        for corpus_id, kept_count in kept_counts.items():
+            logger.info(f"Kept {kept_count} ({kept_count / max(pairs_count, 1):.0%}) "
+                        f"of pairs for corpus {corpus_id}")
+
+    def prepare_corpus(self, workspace: Workspace, corpus_id: int):
+        """Computes the corpus-specific data needed by `keep_pair_for_corpus`"""
+        pass
 
     def run_for_corpus(self, workspace: Workspace, corpus_id: int):
-        raise NotImplemented()
+        self.prepare_corpus(workspace, corpus_id)
+        self.filter(workspace, corpus_id)
 
     def run(self, workspace: Workspace):
         corpora = self.find_corpora(workspace.corpora / Path("tokenized/"))
@@ -141,8 +427,13 @@ class CorpusFinalFilteringTask(FilteringTaskMixin, CorporaTaskMixin, BaseTask):
             assert self.for_corpus in {corpus_id for corpus_id, _ in corpora}
             corpora = [(self.for_corpus, None)]
 
+        if self.single_pass:
+            for corpus_id, _, in corpora:
+                logger.info(f"Preparing {self.__class__.__name__} for corpus {corpus_id}.")
+                self.prepare_corpus(workspace, corpus_id)
+            self.filter_all(workspace, [corpus_id for corpus_id, _ in corpora])
+            return
+
         for corpus_id, _, in corpora:
             logger.info(f"Running {self.__class__.__name__} for corpus {corpus_id}.")
             self.run_for_corpus(workspace, corpus_id)
-
-
@@ -1,14 +1,19 @@
+import multiprocessing
+import random
 from collections import defaultdict
+from csv import DictWriter
 from pathlib import Path
-from typing import Iterable, List, Tuple, Set, Optional
+from typing import Iterable, List, Tuple, Set, Optional, Dict, Sequence
 
+import numpy as np
 from tqdm import tqdm
 
 from .base import FilteringTaskMixin, CandidatesPairCSV, WordPair, CorpusFinalFilteringTask
-from ..syllabify import SyllabifiedWordsCSV
-from ..tokenize import TokenizedWordsCSV
-from ...ngrams_tools import NGramComputer, FakeWordsBalancer, abs_sum_score_fn, rank
-from ...utils import logger, Phoneme, consecutive_pairs
+from ...ngram_model import PhonotacticModel, NgramScoresTable
+from ...ngrams_tools import BatchNgramScorer, FakeWordsBalancer, LocalSearchBalancer, abs_sum_score_fn, \
+    word_category, WordCategory, WordId, NgramModelSpec, SmoothedNgramModel
+from ...phonetic import PhoneticForm
+from ...utils import logger, Phoneme, chunkify
 from ...workspace import Workspace, WorkspaceCSV
 
 # TODO : file names for the filtering steps are named
@@ -21,10 +26,13 @@ class NgramScoresCSV(WorkspaceCSV):
               'unigram_bounded', 'unigram_unbounded',
               'bigram_bounded', 'bigram_unbounded']
 
-    def __init__(self, file_path: Path):
-        super().__init__(file_path, separator="\t", header=self.header)
+    def __init__(self, file_path: Path, extra_scores: Sequence[str] = ()):
+        # extra score columns, from the smoothed ngram models
+        super().__init__(file_path, separator="\t", header=self.header + list(extra_scores))
 
     def __iter__(self) -> Iterable[Tuple[str, float, float, float, float]]:
+        """Only yields the unigram and bigram scores (see `iter_scores` for
+        all the scores, including the smoothed models' scores)"""
         with self.dict_reader as dict_reader:
             for row in dict_reader:
                 yield (row["phonetic"],
@@ -33,147 +41,289 @@ class NgramScoresCSV(WorkspaceCSV):
                        float(row["bigram_bounded"]),
                        float(row["bigram_unbounded"]))
 
-
-class PhonemizedWordsFrequencyCSV(WorkspaceCSV):
-    header = ['word', 'phonetic', 'frequency']
-
-    def __init__(self, file_path: Path):
-        super().__init__(file_path, separator="\t", header=self.header)
-
-    def __iter__(self) -> Iterable[Tuple[List[Phoneme], int]]:
+    def iter_scores(self) -> Iterable[Tuple[str, Dict[str, float]]]:
+        """Yields each phonetic form with all its scores (the file's columns)"""
         with self.dict_reader as dict_reader:
+            score_names = [name for name in dict_reader.fieldnames if name != "phonetic"]
             for row in dict_reader:
-                yield (row["word"],
-                       row["phonetic"].split(" "),
-                       int(row["frequency"]))
+                yield row["phonetic"], {name: float(row[name]) for name in score_names}
 
 
 class NgramScoringTask(FilteringTaskMixin):
+    """Scores the phonetic forms of all candidate pairs with the (memory-mapped)
+    ngram models of the workspace's ngram model file.
+
+    Along with the scores CSV, the scores are written to a binary scores
+    table, which is memory-mapped by the ngram balancing."""
     requires = [
-        "datasets/tokenized/all.csv",  # used for word frequency (not normalized)
+        "models/ngrams.bin",
         "wuggy/candidates.csv",
         "candidates_filtering/steps/*"
     ]
 
     creates = [
-        "candidates_filtering/ngram/phonemized_words_frequencies.csv",
         "candidates_filtering/ngram/scores.csv",
+        "candidates_filtering/ngram/scores.bin",
     ]
+    stats_subpath = Path("ngram_scores.yml")
+    batch_size = 2 ** 16
+
+    def __init__(self, models: Optional[List[NgramModelSpec]] = None):
+        super().__init__()
+        # additional smoothed ngram models, each adding a score column
+        self.models_specs = models if models is not None else []
 
     def run(self, workspace: Workspace):
-        # TODO: comment this for E.D.
         ngram_data_folder = workspace.candidates_filtering / Path("ngram/")
         ngram_data_folder.mkdir(parents=True, exist_ok=True)
-        # firstly, generate the {phonemized word -> frequency} csv
-        # from the syllabic CSV (some useless words are filtered out)
-        syllabic_csv = SyllabifiedWordsCSV(workspace.phonemized / Path("syllabic.csv"))
-        frequency_csv = PhonemizedWordsFrequencyCSV(ngram_data_folder
-                                                    / Path("phonemized_words_frequencies.csv"))
-        tokenized_csv = TokenizedWordsCSV(workspace.tokenized / Path("all.csv"))
-        words_freq = tokenized_csv.to_dict()
-        with frequency_csv.dict_writer as freq_writer:
-            freq_writer.writeheader()
-            for word, phon, syll in syllabic_csv:
-                freq_writer.writerow({
-                    "word": word,
-                    "phonetic": " ".join(phon),
-                    "frequency": words_freq[word]
-                })
-
-        logger.info("Computing ngrams probabilities over the phonemized dataset")
-        phonemes_freqs = {tuple(phonetic): frequency for _, phonetic, frequency in frequency_csv}
-        ngram_computer = NGramComputer(phonemes_freqs)
-        bigrams_bounded = ngram_computer.bigrams(bounded=True)
-        bigrams_unbounded = ngram_computer.bigrams(bounded=False)
-        unigram_bounded = ngram_computer.unigrams(bounded=True)
-        unigram_unbounded = ngram_computer.unigrams(bounded=False)
+        logger.info(f"Loading ngram model {workspace.ngram_model}")
+        ngram_model = PhonotacticModel.load(workspace.ngram_model)
+        inventory = ngram_model.inventory
+        scorer = ngram_model.scorer()
+        models = [ngram_model.smoothed_model(model_spec) for model_spec in self.models_specs]
 
         logger.info("Computing ngram scores over the wuggy real words/fake words pairs")
         last_step_path, last_step_id = self.previous_step_filepath(workspace)
         candidates_csv = CandidatesPairCSV(last_step_path)
-        ngrams_scores_csv = NgramScoresCSV(ngram_data_folder / Path("scores.csv"))
-        phonetic_forms: Set[Tuple[str]] = set()
+        pairs_count = self.previous_step(workspace).rows
+        ngrams_scores_csv = NgramScoresCSV(ngram_data_folder / Path("scores.csv"),
+                                           extra_scores=[spec.name for spec in self.models_specs])
+        phonetic_forms: Set[PhoneticForm] = set()
+        # batch of (phonetic form, its CSV representation) to be scored
+        forms_batch: List[Tuple[PhoneticForm, str]] = []
+        # scored forms and their scores (for each batch), for the scores table
+        scored_forms: List[PhoneticForm] = []
+        batches_scores: List[Dict[str, np.ndarray]] = []
         with ngrams_scores_csv.dict_writer as dict_writer:
             dict_writer.writeheader()
-            for _, word_pho, fake_word_pho in tqdm(candidates_csv,
-                                                   total=candidates_csv.lines_count):
-                for phonemes in (word_pho, fake_word_pho):
-                    phonemes = phonemes.split(" ")
-                    if tuple(phonemes) in phonetic_forms:
+            for _, word_pho, fake_word_pho in tqdm(candidates_csv, total=pairs_count):
+                for phonetic in (word_pho, fake_word_pho):
+                    phonemes = inventory.parse(phonetic)
+                    if phonemes in phonetic_forms:
                         continue
+                    phonetic_forms.add(phonemes)
+                    forms_batch.append((phonemes, phonetic))
+                if len(forms_batch) >= self.batch_size:
+                    scored_forms.extend(form for form, _ in forms_batch)
+                    batches_scores.append(self.write_scores(dict_writer, scorer, models, forms_batch))
+                    forms_batch = []
+            scored_forms.extend(form for form, _ in forms_batch)
+            batches_scores.append(self.write_scores(dict_writer, scorer, models, forms_batch))
+
+        scores_table_path = ngram_data_folder / Path("scores.bin")
+        logger.info(f"Writing ngram scores table to {scores_table_path}")
+        scores_table = NgramScoresTable.build(
+            scored_forms,
+            {score_name: np.concatenate([batch_scores[score_name] for batch_scores in batches_scores])
+             for score_name in ngrams_scores_csv.header[1:]},
+            inventory)
+        scores_table.save(scores_table_path)
+
+        self.stats = {
+            "scored_forms": len(phonetic_forms),
+            "zero_probability_forms": scorer.zero_prob_counts
+        }
+        for score_name, zero_prob_count in scorer.zero_prob_counts.items():
+            if zero_prob_count:
+                logger.warning(f"{zero_prob_count} phonetic forms have a zero "
+                               f"probability for {score_name}")
+
+    @staticmethod
+    def write_scores(dict_writer: DictWriter, scorer: BatchNgramScorer,
+                     models: List[SmoothedNgramModel],
+                     forms_batch: List[Tuple[PhoneticForm, str]]) -> Dict[str, np.ndarray]:
+        forms = [form for form, _ in forms_batch]
+        scores = scorer.score_forms(forms)
+        for model in models:
+            scores[model.spec.name] = model.score_forms(forms)
+        scores_lists = {score_name: score.tolist() for score_name, score in scores.items()}
+        for i, (_, phonetic) in enumerate(forms_batch):
+            row = {score_name: score[i] for score_name, score in scores_lists.items()}
+            row["phonetic"] = phonetic
+            dict_writer.writerow(row)
+        return scores
+
+
+BALANCING_SEED = 4577
+BALANCING_SOLVERS = ("greedy", "local-search")
+
+
+def balancing_initializer(task: 'NgramBalanceScoresTask', workspace: Workspace):
+    global balancing_task, balancing_workspace
+    balancing_task, balancing_workspace = task, workspace
 
-                    phonemes_bounded = ["_"] + phonemes + ["_"]
-                    row = {"phonetic": " ".join(phonemes),
-                           "unigram_unbounded": ngram_computer.to_ngram_logprob(
-                               phonemes, unigram_unbounded),
-                           "unigram_bounded": ngram_computer.to_ngram_logprob(
-                               phonemes_bounded, unigram_bounded),
-                           "bigram_unbounded": ngram_computer.to_ngram_logprob(
-                               consecutive_pairs(phonemes), bigrams_unbounded),
-                           "bigram_bounded": ngram_computer.to_ngram_logprob(
-                               consecutive_pairs(phonemes_bounded), bigrams_bounded)
-                           }
-                    dict_writer.writerow(row)
-                    phonetic_forms.add(tuple(phonemes))
+
+def balancing_runner(corpus_id: int) -> Tuple[int, Set[Tuple[str, str]]]:
+    return corpus_id, balancing_task.balance_corpus(balancing_workspace, corpus_id)
 
 
 class NgramBalanceScoresTask(CorpusFinalFilteringTask):
     """Use computed ngram scores to select only one fake word candidate per
-    real word"""
+    real word.
+
+    The scores, categories and candidate pairs are loaded once for all corpora,
+    and the corpora can be balanced in parallel. Each corpus is balanced
+    with its own seed, so results don't depend on the number of workers."""
 
     requires = [
-        "candidates_filtering/ngram/phonemized_words_frequencies.csv",
-        "candidates_filtering/ngram/scores.csv",
+        "models/ngrams.bin",
+        "candidates_filtering/ngram/scores.bin",
     ]
     step_name = "ngram"
+    # number of candidate pairs parsed and looked up at once in the scores table
+    pairs_batch_size = 2 ** 16
 
-    def __init__(self, for_corpus: Optional[int] = None, num_to_keep=1):
-        super().__init__(for_corpus=for_corpus)
-        self._chosen_pairs: Set[Tuple[str, str]] = set()
+    def __init__(self, for_corpus: Optional[int] = None, num_to_keep=1,
+                 single_pass: bool = False, num_workers: int = 1,
+                 criteria: Optional[List[str]] = None,
+                 solver: str = "greedy", time_budget: float = 60.):
+        super().__init__(for_corpus=for_corpus, single_pass=single_pass)
+        if solver not in BALANCING_SOLVERS:
+            raise ValueError(f"Invalid balancing solver {solver}, should be one "
+                             f"of {', '.join(BALANCING_SOLVERS)}")
+        # the local search improves the greedy solution, within its time budget (for each corpus)
+        self.solver = solver
+        self.time_budget = time_budget
+        # scores used to balance the words and nonwords (defaults to all scores)
+        self.criteria = criteria
+        # corpus_id -> chosen (word, nonword) pairs for that corpus
+        self._chosen_pairs: Dict[int, Set[Tuple[str, str]]] = dict()
         self.num_to_keep = num_to_keep
+        self.num_workers = num_workers
+        # data shared by all corpora, loaded by `load_balancing_data`. Phonetic
+        # forms are identified by their id in the (memory-mapped) scores table
+        self.scores_table: Optional[NgramScoresTable] = None
+        self.scores: Optional[np.ndarray] = None
+        self.categories: Optional[Dict[WordId, WordCategory]] = None
+        # distinct words of the candidate pairs, the index of each pair's word
+        # in that list, and the (word_pho, fake_word_pho) ids of each pair
+        self.candidate_words: Optional[List[str]] = None
+        self.pairs_words: Optional[np.ndarray] = None
+        self.candidate_pairs: Optional[np.ndarray] = None
+
+    def keep_pair_for_corpus(self, word_pair: WordPair, corpus_id: int) -> bool:
+        return (word_pair.word_pho, word_pair.fake_word_pho) in self._chosen_pairs[corpus_id]
 
-    def keep_pair(self, word_pair: WordPair) -> bool:
-        return (word_pair.word_pho, word_pair.fake_word_pho) in self._chosen_pairs
+    def load_balancing_data(self, workspace: Workspace):
+        if self.candidate_pairs is not None:
+            return
 
-    def run_for_corpus(self, workspace: Workspace, corpus_id: int):
-        ngram_data_folder = workspace.candidates_filtering / Path("ngram")
-        freqs_csv = PhonemizedWordsFrequencyCSV(ngram_data_folder / Path("phonemized_words_frequencies.csv"))
-        scores_csv = NgramScoresCSV(ngram_data_folder / Path("scores.csv"))
+        scores_table_path = workspace.candidates_filtering / Path("ngram/scores.bin")
+        logger.info("Loading words categories, ngram scores and candidate pairs")
+        self.scores_table = NgramScoresTable.load(scores_table_path)
+        inventory = self.scores_table.inventory
+        criteria = self.criteria if self.criteria is not None else self.scores_table.score_names
+        missing_scores = set(criteria) - set(self.scores_table.score_names)
+        if missing_scores:
+            raise ValueError(f"Scores {', '.join(sorted(missing_scores))} not found in "
+                             f"{scores_table_path}, available scores are "
+                             f"{', '.join(self.scores_table.score_names)}")
+        # view of the criteria's fields, still memory-mapped
+        self.scores = self.scores_table.scores[criteria]
 
-        #
-        categories = {
-            " ".join(word_pho): (len(word_pho), rank(freq))
-            for _, word_pho, freq in freqs_csv
+        # the categories are computed from the ngram model's training forms
+        forms_frequencies = PhonotacticModel.load(workspace.ngram_model).forms_frequencies()
+        forms_ids = self.scores_table.ids(list(forms_frequencies))
+        self.categories = {
+            form_id: word_category(form, freq)
+            for form_id, (form, freq) in zip(forms_ids.tolist(), forms_frequencies.items())
+            if form_id >= 0
         }
-        scores = {}  # phonetic_form -> ngram scores (unigram, bigram, etc...)
-        with scores_csv.dict_reader as dict_reader:
-            for row in dict_reader:
-                phonetic = row.pop("phonetic")
-                scores[phonetic] = {score_name: float(score)
-                                    for score_name, score in row.items()}
+
+        # the pairs are streamed, by batches, into arrays preallocated for the
+        # step's lines count (which also counts the header). Words are repeated
+        # for each of their candidates, and are only stored once.
+        candidates_csv = self.previous_step_csv(workspace)
+        max_pairs_count = candidates_csv.lines_count
+        words_indices: Dict[str, int] = dict()
+        self.pairs_words = np.empty(max_pairs_count, dtype=np.int64)
+        self.candidate_pairs = np.empty((max_pairs_count, 2), dtype=np.int64)
+        pairs_count = 0
+        for pairs_batch in chunkify(candidates_csv, self.pairs_batch_size):
+            batch_end = pairs_count + len(pairs_batch)
+            pairs_forms: List[PhoneticForm] = []
+            for pair_id, (word, word_pho, fake_word_pho) in enumerate(pairs_batch, start=pairs_count):
+                self.pairs_words[pair_id] = words_indices.setdefault(word, len(words_indices))
+                pairs_forms.append(inventory.parse(word_pho))
+                pairs_forms.append(inventory.parse(fake_word_pho))
+            self.candidate_pairs[pairs_count:batch_end] = \
+                self.scores_table.ids(pairs_forms).reshape(-1, 2)
+            pairs_count = batch_end
+        self.candidate_words = list(words_indices)
+        self.pairs_words = self.pairs_words[:pairs_count]
+        self.candidate_pairs = self.candidate_pairs[:pairs_count]
+        if (self.candidate_pairs < 0).any():
+            raise ValueError(f"Some candidate pairs haven't been scored in {scores_table_path}, "
+                             f"the ngram scoring should be run again")
+
+    def build_balancer(self, workspace: Workspace, corpus_id: int) -> FakeWordsBalancer:
+        """Builds the balancer for the candidate pairs of a corpus's words"""
+        self.load_balancing_data(workspace)
 
         # retrieving the tokenized word list of corpus to eliminate all words
         # not contained in that corpus
         tokenized_corpus_csv = self.get_tokenized_corpus(workspace, corpus_id)
         corpus_words_pho: Set[str] = {word for word, _ in tokenized_corpus_csv}
 
-        previous_step_csv_path, previous_step_id = self.previous_step_filepath(workspace)
-        previous_step_csv = CandidatesPairCSV(previous_step_csv_path)
         # only for words contained in the corpus
-        word_nonwords = defaultdict(list)  # word -> list(nonwords)
-        for word, word_pho, fake_word_pho in previous_step_csv:
-            if word not in corpus_words_pho:
-                continue
-            word_nonwords[word_pho].append(fake_word_pho)
-
-        balancer = FakeWordsBalancer(words_scores=scores,
-                                     word_categories=categories,
-                                     word_nonword_pairs=word_nonwords,
-                                     objective_fn=abs_sum_score_fn,
-                                     num_to_keep=self.num_to_keep)
-
-        logger.info("Finding a balanced nonword candidate for each word")
-        for word, fake_word in tqdm(balancer.iter_balanced_pairs(), total=len(word_nonwords)):
-            self._chosen_pairs.add((word, fake_word))
-
-        self.filter(workspace, corpus_id)
+        corpus_words_mask = np.array([word in corpus_words_pho for word in self.candidate_words],
+                                     dtype=bool)
+        corpus_pairs = self.candidate_pairs[corpus_words_mask[self.pairs_words]]
+        word_nonwords: Dict[WordId, List[WordId]] = defaultdict(list)  # word -> list(nonwords)
+        for word_id, fake_word_id in corpus_pairs.tolist():
+            word_nonwords[word_id].append(fake_word_id)
+
+        if self.solver == "local-search":
+            return LocalSearchBalancer(words_scores=self.scores,
+                                       word_categories=self.categories,
+                                       word_nonword_pairs=word_nonwords,
+                                       objective_fn=abs_sum_score_fn,
+                                       num_to_keep=self.num_to_keep,
+                                       time_budget=self.time_budget)
+        return FakeWordsBalancer(words_scores=self.scores,
+                                 word_categories=self.categories,
+                                 word_nonword_pairs=word_nonwords,
+                                 objective_fn=abs_sum_score_fn,
+                                 num_to_keep=self.num_to_keep)
+
+    def balance_corpus(self, workspace: Workspace, corpus_id: int) -> Set[Tuple[str, str]]:
+        """Chooses the balanced (word, nonword) pairs for a corpus"""
+        random.seed(BALANCING_SEED + corpus_id)
+        balancer = self.build_balancer(workspace, corpus_id)
+
+        logger.info(f"Finding {self.num_to_keep} balanced nonword candidate(s) "
+                    f"for each word of corpus {corpus_id}")
+        chosen_pairs_ids = list(tqdm(balancer.iter_balanced_pairs(),
+                                     total=len(balancer.word_nonword_pairs) * self.num_to_keep,
+                                     disable=self.num_workers > 1))
+        inventory = self.scores_table.inventory
+        chosen_pairs = {(inventory.fmt(self.scores_table.form(word_id)),
+                         inventory.fmt(self.scores_table.form(fake_word_id)))
+                        for word_id, fake_word_id in chosen_pairs_ids}
+        if isinstance(balancer, LocalSearchBalancer):
+            logger.info(f"Corpus {corpus_id}: local search improved the balance objective "
+                        f"from {balancer.greedy_objective:.5f} to {balancer.objective:.5f} "
+                        f"({balancer.moves_count} moves in {balancer.passes_count} passes)")
+        else:
+            logger.info(f"Corpus {corpus_id}: balance objective is {balancer.balance_objective():.5f}")
+        return chosen_pairs
+
+    def prepare_corpus(self, workspace: Workspace, corpus_id: int):
+        if corpus_id not in self._chosen_pairs:
+            self._chosen_pairs[corpus_id] = self.balance_corpus(workspace, corpus_id)
+
+    def run(self, workspace: Workspace):
+        corpora = self.find_corpora(workspace.corpora / Path("tokenized/"))
+        corpus_ids = [corpus_id for corpus_id, _ in corpora
+                      if self.for_corpus is None or corpus_id == self.for_corpus]
+        if self.num_workers > 1 and len(corpus_ids) > 1:
+            self.load_balancing_data(workspace)
+            logger.info(f"Balancing {len(corpus_ids)} corpora with {self.num_workers} workers")
+            pool = multiprocessing.Pool(processes=min(self.num_workers, len(corpus_ids)),
+                                        initializer=balancing_initializer,
+                                        initargs=(self, workspace))
+            with pool:
+                for corpus_id, chosen_pairs in tqdm(pool.imap_unordered(balancing_runner, corpus_ids),
+                                                    total=len(corpus_ids)):
+                    self._chosen_pairs[corpus_id] = chosen_pairs
+        super().run(workspace)
@@ -0,0 +1,198 @@
+import shutil
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import List, Optional, Iterable
+
+from tqdm import tqdm
+
+from .base import FilteringTaskMixin, CandidatesPairCSV, WordPair, StepsManifest, StepRecord, \
+    resources_hash
+from ..base import BaseTask
+from ..wuggy_gen import FakeWordsCandidatesCSV
+from ...utils import logger, chunkify, hash_file
+from ...workspace import Workspace
+
+
+class FusedFilteringTask(BaseTask):
+    """Initializes the filtering sub-pipeline and runs a sequence of filters
+    in a single streaming pass over the wuggy candidates, instead of one
+    read/write pass of the steps CSVs per filter.
+
+    Only the last step's output is written to the steps folder (with the same
+    name as if each filter had been run separately), unless `write_steps`
+    is set. All steps are recorded in the steps manifest, and the whole pass
+    is skipped if the candidates, filters and their resources are unchanged.
+    Stateful filters still need one observation pass over the candidates, in
+    which the pairs are filtered by the preceding filters. Thus, filters
+    preceding a stateful filter have to be deterministic.
+    """
+    requires = [
+        "wuggy/candidates.csv",
+    ]
+
+    creates = [
+        "candidates_filtering/steps/",
+    ]
+    stats_subpath = Path("filtering.yml")
+    batch_size = 2 ** 14
+
+    def __init__(self, filters: List[FilteringTaskMixin], write_steps: bool = False):
+        super().__init__()
+        assert filters
+        for filter_id, filter_task in enumerate(filters):
+            if not filter_task.stateful:
+                continue
+            for previous_filter in filters[:filter_id]:
+                if not previous_filter.deterministic:
+                    raise ValueError(f"Nondeterministic filter {previous_filter.step_name} "
+                                     f"can't precede stateful filter {filter_task.step_name} "
+                                     f"in a fused filtering pass")
+        self.filters = filters
+        self.write_steps = write_steps
+
+    def check_requirements(self, workspace: Workspace):
+        super().check_requirements(workspace)
+        for filter_task in self.filters:
+            filter_task.check_requirements(workspace)
+
+    def iter_batches(self, candidates_csv: FakeWordsCandidatesCSV) -> Iterable[List[WordPair]]:
+        word_pairs_iter = (WordPair(*row) for row in candidates_csv.iter_pairs())
+        return chunkify(word_pairs_iter, self.batch_size)
+
+    @staticmethod
+    def apply_filter(filter_task: FilteringTaskMixin,
+                     word_pairs: List[WordPair]) -> List[WordPair]:
+        if not word_pairs:
+            return word_pairs
+        return [word_pair for word_pair, keep in zip(word_pairs, filter_task.keep_pairs(word_pairs))
+                if keep]
+
+    def planned_steps(self, workspace: Workspace,
+                      candidates_csv: FakeWordsCandidatesCSV) -> List[StepRecord]:
+        """Records of the steps to be run (without their outputs' information)"""
+        steps_folder = workspace.candidates_filtering / Path("steps")
+        planned_manifest = StepsManifest(steps_folder)
+        planned_manifest.append(StepRecord(id=1, name="init", file=None, params={}, rows=0,
+                                           input_hash=hash_file(candidates_csv.file_path),
+                                           duration=None))
+        for filter_id, filter_task in enumerate(self.filters, start=1):
+            input_hash = planned_manifest.next_input_hash(
+                resources_hash(workspace, filter_task.requires))
+            planned_manifest.append(StepRecord(id=filter_id + 1, name=filter_task.step_name,
+                                               file=None, params=filter_task.step_params,
+                                               rows=0, input_hash=input_hash, duration=None))
+        return planned_manifest.steps
+
+    def filtered_pairs(self, candidates_csv: FakeWordsCandidatesCSV,
+                       filters: List[FilteringTaskMixin]) -> Iterable[WordPair]:
+        """Iterates over the candidates pairs that are kept by all filters"""
+        for word_pairs in self.iter_batches(candidates_csv):
+            for filter_task in filters:
+                word_pairs = self.apply_filter(filter_task, word_pairs)
+            yield from word_pairs
+
+    def build_stats(self, steps: List[StepRecord]):
+        """Summarizes the number of pairs kept by each step, from its record"""
+        self.stats = {
+            "input_pairs": steps[0].rows,
+            "steps": [
+                {"step": step.name,
+                 "input_pairs": previous_step.rows,
+                 "kept_pairs": step.rows}
+                for previous_step, step in zip(steps, steps[1:])
+            ]
+        }
+        for step_stats in self.stats["steps"]:
+            input_count = max(step_stats["input_pairs"], 1)
+            logger.info(f"{step_stats['step']}: kept {step_stats['kept_pairs']} "
+                        f"({step_stats['kept_pairs'] / input_count:.0%}) of pairs.")
+
+    def run(self, workspace: Workspace):
+        steps_folder = workspace.candidates_filtering / Path("steps")
+        candidates_csv = FakeWordsCandidatesCSV(workspace.wuggy / Path("candidates.csv"))
+        steps = self.planned_steps(workspace, candidates_csv)
+        manifest = StepsManifest.load(steps_folder)
+        if manifest.matches(steps) and (not self.write_steps
+                                        or all(step.file for step in manifest.steps[:len(steps)])):
+            logger.info("Candidates, filters and their resources are unchanged, "
+                        "reusing the previous filtering steps")
+            manifest.cursor = len(steps)
+            manifest.save()
+            # the stats file is rewritten after the run, from the reused steps
+            self.build_stats(manifest.steps[:len(steps)])
+            return
+
+        # cleaning up folder in case of re-initing
+        shutil.rmtree(steps_folder, ignore_errors=True)
+        steps_folder.mkdir(parents=True, exist_ok=True)
+        pairs_count = candidates_csv.lines_count
+        start_time = time.perf_counter()
+        # time spent in each filter (index 0 being the init step)
+        durations = [0.0] * len(steps)
+
+        # filters are prepared in their order, each one after the observation
+        # pass of the preceding stateful filters, as when they're run one after
+        # the other (some filters seed the random generator when prepared)
+        for filter_id, filter_task in enumerate(self.filters):
+            filter_start_time = time.perf_counter()
+            filter_task.prepare(workspace)
+            if filter_task.stateful:
+                logger.info(f"Observation pass for stateful filter {filter_task.step_name}")
+                for word_pair in tqdm(self.filtered_pairs(candidates_csv, self.filters[:filter_id]),
+                                      total=pairs_count):
+                    filter_task.observe_pair(word_pair)
+                filter_task.end_observation()
+            durations[filter_id + 1] += time.perf_counter() - filter_start_time
+
+        # one output CSV per step (step 1 being the init step). Only the
+        # last one is mandatory.
+        steps_csvs: List[Optional[CandidatesPairCSV]] = [None] * (len(self.filters) + 1)
+        if self.write_steps:
+            steps_csvs[0] = CandidatesPairCSV(steps_folder / Path("step_1_init.csv"))
+        for filter_id, filter_task in enumerate(self.filters, start=1):
+            if self.write_steps or filter_id == len(self.filters):
+                steps_csvs[filter_id] = CandidatesPairCSV(
+                    steps_folder / filter_task.next_step_filename(filter_id))
+
+        logger.info(f"Filtering pairs from {candidates_csv.file_path} with filters "
+                    f"{', '.join(filter_task.step_name for filter_task in self.filters)}")
+        kept_counts = [0] * (len(self.filters) + 1)
+        with ExitStack() as stack:
+            writers = [None if step_csv is None else stack.enter_context(step_csv.dict_writer)
+                       for step_csv in steps_csvs]
+            for writer in writers:
+                if writer is not None:
+                    writer.writeheader()
+
+            pbar = tqdm(total=pairs_count)
+            for word_pairs in self.iter_batches(candidates_csv):
+                pbar.update(len(word_pairs))
+                # step 0 is the init step, which keeps everything
+                for step_id in range(len(writers)):
+                    if step_id > 0:
+                        filter_start_time = time.perf_counter()
+                        word_pairs = self.apply_filter(self.filters[step_id - 1], word_pairs)
+                        durations[step_id] += time.perf_counter() - filter_start_time
+                    kept_counts[step_id] += len(word_pairs)
+                    if writers[step_id] is not None:
+                        for word_pair in word_pairs:
+                            writers[step_id].writerow({"word": word_pair.word,
+                                                       "word_pho": word_pair.word_pho,
+                                                       "fake_word_pho": word_pair.fake_word_pho})
+            pbar.close()
+
+        for filter_task in self.filters:
+            filter_task.close()
+
+        # the init step is accounted for the time not spent in the filters
+        durations[0] = time.perf_counter() - start_time - sum(durations[1:])
+        for step, step_csv, rows, duration in zip(steps, steps_csvs, kept_counts, durations):
+            step.file = None if step_csv is None else step_csv.file_path.name
+            step.rows = rows
+            step.duration = round(duration, 3)
+        manifest = StepsManifest(steps_folder)
+        for step in steps:
+            manifest.append(step)
+        manifest.save()
+        self.build_stats(steps)
@@ -1,19 +1,24 @@
 import random
 import shutil
-from collections import defaultdict
-from itertools import chain
+import time
+from array import array
+from collections import defaultdict, Counter
+from itertools import islice
 from pathlib import Path
-from typing import Set, Tuple, List, Dict
+from typing import Set, Tuple, List, Dict, Optional, Iterator, Any
 
-import Levenshtein
+from rapidfuzz.distance import Levenshtein
+from rapidfuzz.process import cpdist
 from tqdm import tqdm
 
+from paraphone.phonetic import PhonemeInventory, PhoneticForm
 from paraphone.tasks.dictionaries import DictionaryCSV
-from paraphone.tasks.filters.base import FilteringTaskMixin, CandidatesPairCSV, WordPair, CorpusFinalFilteringTask
-from paraphone.tasks.phonemize import PhonemizedWordsCSV
+from paraphone.tasks.filters.base import FilteringTaskMixin, CandidatesPairCSV, WordPair, CorpusFinalFilteringTask, \
+    StepsManifest, StepRecord
+from paraphone.tasks.phonemize import PhonemizedWordsCSV, load_phoneme_inventory
 from paraphone.tasks.tokenize import TokenizedWordsCSV
 from paraphone.tasks.wuggy_gen import FakeWordsCandidatesCSV
-from paraphone.utils import logger
+from paraphone.utils import logger, chunkify, hash_file
 from paraphone.workspace import Workspace
 
 
@@ -24,19 +29,34 @@ class InitFilteringTask(FilteringTaskMixin):
 
     creates = [
         "candidates_filtering/steps/",
-        "candidates_filtering/steps/step_1_init.csv"
+        "candidates_filtering/steps/step_1_init.csv",
+        "candidates_filtering/steps/manifest.yml"
     ]
+    step_name = "init"
 
     def run(self, workspace: Workspace):
         steps_folder = workspace.candidates_filtering / Path("steps")
+        wuggy_candidates_csv = FakeWordsCandidatesCSV(workspace.wuggy / Path("candidates.csv"))
+        input_hash = hash_file(wuggy_candidates_csv.file_path)
+
+        # if the candidates haven't changed, the steps of the previous
+        # run are kept, to be reused by the next steps if possible
+        manifest = StepsManifest.load(steps_folder)
+        manifest.cursor = 0
+        if manifest.find_reusable(self.step_name, self.step_params, input_hash) is not None:
+            logger.info("Wuggy candidates are unchanged, reusing the previous filtering steps")
+            manifest.cursor = 1
+            manifest.save()
+            return
+
         # cleaning up folder in case of re-initing
         shutil.rmtree(steps_folder, ignore_errors=True)
         steps_folder.mkdir(parents=True, exist_ok=True)
-
-        wuggy_candidates_csv = FakeWordsCandidatesCSV(workspace.wuggy / Path("candidates.csv"))
         step_init_csv = CandidatesPairCSV(steps_folder / Path("step_1_init.csv"))
 
         logger.info(f"Initializing filtering pipeline with {wuggy_candidates_csv.file_path}")
+        start_time = time.perf_counter()
+        pairs_count = 0
         with step_init_csv.dict_writer as dict_writer:
             dict_writer.writeheader()
             for word, word_pho, _, fake_word_pho, _ in tqdm(wuggy_candidates_csv,
@@ -46,56 +66,68 @@ class InitFilteringTask(FilteringTaskMixin):
                     "word_pho": " ".join(word_pho),
                     "fake_word_pho": " ".join(fake_word_pho)
                 })
+                pairs_count += 1
+
+        manifest = StepsManifest(steps_folder)
+        manifest.append(StepRecord(id=1, name=self.step_name, file=step_init_csv.file_path.name,
+                                   params=self.step_params, rows=pairs_count,
+                                   input_hash=input_hash,
+                                   duration=round(time.perf_counter() - start_time, 3)))
+        manifest.save()
 
 
 class PassThroughFinalFilter(CorpusFinalFilteringTask):
     """Just copies the last step of the filtering pipeline into
     the respective corpora"""
 
-    def run_for_corpus(self, workspace: Workspace, corpus_id: int):
-        self.filter(workspace, corpus_id)
+    def keep_pair(self, word_pair: WordPair) -> bool:
+        return True
 
 
 class RandomFilterTask(FilteringTaskMixin):
     """Keeps a random split of the candidates determined by ratio."""
     step_name = "random"
+    deterministic = False
 
     def __init__(self, ratio: float):
         super().__init__()
         assert 0 < ratio < 1.0
         self.ratio = ratio
 
+    @property
+    def step_params(self) -> Dict[str, Any]:
+        return {"ratio": self.ratio}
+
     def keep_pair(self, word_pair: WordPair) -> bool:
         return random.random() < self.ratio
 
-    def run(self, workspace: Workspace):
+    def prepare(self, workspace: Workspace):
         random.seed(4577)
-        self.filter(workspace)
 
 
 class RandomPairFilterTask(FilteringTaskMixin):
     """Keeps only one of the word/nonword pairs, at random"""
     step_name = "random-pairs"
+    stateful = True
 
     def __init__(self):
         super().__init__()
         self._chosen_pairs: Set[Tuple[str, str]] = set()
+        self._word_nonword: Dict[str, List[str]] = defaultdict(list)  # word -> list(nonwords)
 
     def keep_pair(self, word_pair: WordPair) -> bool:
         return (word_pair.word_pho, word_pair.fake_word_pho) in self._chosen_pairs
 
-    def run(self, workspace: Workspace):
+    def prepare(self, workspace: Workspace):
         random.seed(4577)
 
-        previous_step_csv = self.previous_step_csv(workspace)
-        word_nonword = defaultdict(list)  # word -> list(nonwords)
-        for _, word_pho, fake_word_pho in tqdm(previous_step_csv):
-            word_nonword[word_pho].append(fake_word_pho)
+    def observe_pair(self, word_pair: WordPair):
+        self._word_nonword[word_pair.word_pho].append(word_pair.fake_word_pho)
 
-        for word, fake_words in tqdm(word_nonword.items()):
+    def end_observation(self):
+        for word, fake_words in tqdm(self._word_nonword.items()):
             chosen_fake_word = random.choice(fake_words)
             self._chosen_pairs.add((word, chosen_fake_word))
-        self.filter(workspace)
 
 
 class EqualsFilterTask(FilteringTaskMixin):
@@ -105,9 +137,6 @@ class EqualsFilterTask(FilteringTaskMixin):
     def keep_pair(self, word_pair: WordPair) -> bool:
         return word_pair.word_pho != word_pair.fake_word_pho
 
-    def run(self, workspace: Workspace):
-        self.filter(workspace)
-
 
 class MostFrequentHomophoneFilterTask(FilteringTaskMixin):
     """Filter homophones based on grapheme frequency (the grapheme with
@@ -117,6 +146,7 @@ class MostFrequentHomophoneFilterTask(FilteringTaskMixin):
         "datasets/tokenized/all.csv"
     ]
     step_name = "homophones"
+    stateful = True
 
     def __init__(self):
         super().__init__()
@@ -127,23 +157,25 @@ class MostFrequentHomophoneFilterTask(FilteringTaskMixin):
         # word_pho -> word
         self.kept_word_pho: Dict[str, str] = dict()
         self.kept_words: Set[str] = set()
+        self.tokenized_words: Dict[str, int] = dict()
 
     def keep_pair(self, word_pair: WordPair) -> bool:
         return word_pair.word in self.kept_words
 
-    def run(self, workspace: Workspace):
+    def prepare(self, workspace: Workspace):
         tokenized_words_csv = TokenizedWordsCSV(
             workspace.tokenized / Path("all.csv")
         )
-        tokenized_words = tokenized_words_csv.to_dict()
-        previous_step_csv = self.previous_step_csv(workspace)
-        for word, word_pho, _ in previous_step_csv:
-            if self.word_pho_freq[word_pho] < tokenized_words[word]:
-                self.word_pho_freq[word_pho] = tokenized_words[word]
-                self.kept_word_pho[word_pho] = word
+        self.tokenized_words = tokenized_words_csv.to_dict()
+
+    def observe_pair(self, word_pair: WordPair):
+        word, word_pho = word_pair.word, word_pair.word_pho
+        if self.word_pho_freq[word_pho] < self.tokenized_words[word]:
+            self.word_pho_freq[word_pho] = self.tokenized_words[word]
+            self.kept_word_pho[word_pho] = word
 
+    def end_observation(self):
         self.kept_words = set(self.kept_word_pho.values())
-        self.filter(workspace)
 
 
 class WuggyHomophonesFilterTask(FilteringTaskMixin):
@@ -161,7 +193,7 @@ class WuggyHomophonesFilterTask(FilteringTaskMixin):
     def keep_pair(self, word_pair: WordPair) -> bool:
         return word_pair.fake_word_pho not in self.all_words_phonemized
 
-    def run(self, workspace: Workspace):
+    def prepare(self, workspace: Workspace):
         self.all_words_phonemized = set()
         for dict_filepath in workspace.dictionaries.glob("**/dict_folded.csv"):
             dict_csv = DictionaryCSV(dict_filepath)
@@ -173,28 +205,108 @@ class WuggyHomophonesFilterTask(FilteringTaskMixin):
             " ".join(pho) for _, pho in phonemized_words_csv
         })
 
-        self.filter(workspace)
+
+def levenshtein_distances(encoded_pairs: List[Tuple[PhoneticForm, PhoneticForm]],
+                          score_cutoff: Optional[int] = None,
+                          workers: int = 1) -> List[int]:
+    """Edit distances of a batch of encoded pairs. With a `score_cutoff`,
+    distances above the cutoff are all reported as `score_cutoff + 1`.
+    The distances are computed by `workers` threads (without the GIL)."""
+    return cpdist([a for a, _ in encoded_pairs], [b for _, b in encoded_pairs],
+                  scorer=Levenshtein.distance, score_cutoff=score_cutoff,
+                  dtype="int32", workers=workers).tolist()
 
 
 class LevenshteinFilterTask(FilteringTaskMixin):
-    """Keeps pairs whose edit distance is lower than a threshold"""
+    """Keeps pairs whose edit distance is lower than a threshold.
+
+    Phonetic forms are encoded with the workspace's phoneme inventory. Pairs
+    are encoded in batches, and each batch's distances are computed by
+    rapidfuzz in `num_workers` threads."""
+    requires = [
+        "phonemized/all.csv"
+    ]
     step_name = "levenshtein"
+    stats_subpath = Path("levenshtein.yml")
+    batch_size = 2 ** 16
 
-    def __init__(self, max_distance: int):
+    def __init__(self, max_distance: int, num_workers: int = 1, sweep: bool = False):
         super().__init__()
         assert max_distance > 0
         self.max_distance = max_distance
-
-    def pho_to_str(self, pho_a: List[str], pho_b: List[str]) -> Tuple[str, str]:
-        """Remaps phoneme lists to ASCII strings for levenshtein edit distance"""
-        pho_set = set(chain.from_iterable([pho_a, pho_b]))
-        pho_map = {pho: chr(i) for i, pho in enumerate(pho_set)}
-        return "".join(pho_map[pho] for pho in pho_a), "".join(pho_map[pho] for pho in pho_b)
+        self.num_workers = num_workers
+        self.sweep = sweep
+        # the sweep's histogram is only computed if the step is actually run
+        self.reuse_outputs = not sweep
+        self.inventory: Optional[PhonemeInventory] = None
+        # distances computed by the sweep, in the order of the previous step's pairs
+        self.cached_distances: Optional[Iterator[int]] = None
+
+    def prepare(self, workspace: Workspace):
+        self.inventory = load_phoneme_inventory(workspace)
+
+    @property
+    def step_params(self) -> Dict[str, Any]:
+        return {"max_distance": self.max_distance}
+
+    def encode_pair(self, word_pair: WordPair) -> Tuple[PhoneticForm, PhoneticForm]:
+        return (self.inventory.parse(word_pair.word_pho),
+                self.inventory.parse(word_pair.fake_word_pho))
+
+    def distances(self, word_pairs: List[WordPair],
+                  score_cutoff: Optional[int] = None) -> List[int]:
+        encoded_pairs = [self.encode_pair(word_pair) for word_pair in word_pairs]
+        return levenshtein_distances(encoded_pairs, score_cutoff, workers=self.num_workers)
 
     def keep_pair(self, word_pair: WordPair) -> bool:
-        word_pho, fake_word_pho = self.pho_to_str(word_pair.word_pho.split(" "),
-                                                  word_pair.fake_word_pho.split(" "))
+        word_pho, fake_word_pho = self.encode_pair(word_pair)
         return Levenshtein.distance(word_pho, fake_word_pho) <= self.max_distance
 
-    def run(self, workspace: Workspace):
-        self.filter(workspace)
+    def keep_pairs(self, word_pairs: List[WordPair]) -> List[bool]:
+        if self.cached_distances is not None:
+            distances = list(islice(self.cached_distances, len(word_pairs)))
+        else:
+            distances = self.distances(word_pairs, self.max_distance)
+        return [distance <= self.max_distance for distance in distances]
+
+    def sweep_distances(self, workspace: Workspace) -> array:
+        """Computes the (uncapped) edit distance of all the pairs from the previous
+        step, and stores the distances histogram in the task's stats"""
+        input_csv = self.previous_step_csv(workspace)
+        logger.info(f"Computing edit distances histogram for {input_csv.file_path}")
+        distances = array("H")
+        pbar = tqdm(total=self.previous_step(workspace).rows)
+        word_pairs_iter = (WordPair(*row) for row in input_csv)
+        for word_pairs in chunkify(word_pairs_iter, self.batch_size):
+            distances.extend(self.distances(word_pairs))
+            pbar.update(len(word_pairs))
+        pbar.close()
+
+        pairs_count = len(distances)
+        histogram = Counter(distances)
+        kept_count = 0
+        kept_counts: Dict[int, int] = {}
+        for distance in range(max(histogram, default=0) + 1):
+            kept_count += histogram[distance]
+            kept_counts[distance] = kept_count
+            logger.info(f"Threshold {distance}: keeps {kept_count} "
+                        f"({kept_count / max(pairs_count, 1):.0%}) of pairs")
+        self.stats = {
+            "input_pairs": pairs_count,
+            "histogram": {distance: histogram[distance] for distance in sorted(histogram)},
+            "kept_pairs": kept_counts,
+            "threshold": self.max_distance,
+        }
+        return distances
+
+    def apply(self, workspace: Workspace) -> int:
+        if not self.sweep:
+            return super().apply(workspace)
+
+        self.prepare(workspace)
+        distances = self.sweep_distances(workspace)
+        # applying the threshold from the cached distances
+        self.cached_distances = iter(distances)
+        kept_count = self.filter(workspace)
+        self.cached_distances = None
+        return kept_count
@@ -11,6 +11,7 @@ from phonemizer.separator import Separator
 from .base import BaseTask
 from .dictionaries import DictionaryCSV, FoldingCSV
 from .tokenize import TokenizedWordsCSV
+from ..phonetic import PhonemeInventory, PhoneticForm
 from ..utils import count_lines, logger, Phoneme, null_logger
 from ..workspace import Workspace, WorkspaceCSV
 
@@ -39,6 +40,57 @@ class PhonemizedWordsCSV(WorkspaceCSV):
                 phonemic.add(row["phones"])
                 yield row["phones"].split(" ")
 
+    def iter_forms(self, inventory: PhonemeInventory) -> Iterable[Tuple[str, PhoneticForm]]:
+        with self.dict_reader as dict_reader:
+            for row in dict_reader:
+                yield row["word"], inventory.parse(row["phones"])
+
+
+class PhonemeInventoryCSV(WorkspaceCSV):
+    """Phonemes found in the phonemized words, with their code in the
+    workspace's phoneme inventory and their number of occurrences"""
+    header = ["code", "phoneme", "count"]
+
+    def __init__(self, file_path: Path):
+        super().__init__(file_path, separator="\t", header=self.header)
+
+    def __iter__(self) -> Iterable[Tuple[int, Phoneme, int]]:
+        with self.dict_reader as dict_reader:
+            for row in dict_reader:
+                yield int(row["code"]), row["phoneme"], int(row["count"])
+
+    def write_inventory(self, phonemes_counts: typing.Counter[Phoneme]) -> PhonemeInventory:
+        inventory = PhonemeInventory(sorted(phonemes_counts))
+        with self.dict_writer as dict_writer:
+            dict_writer.writeheader()
+            for code, phoneme in enumerate(inventory.phonemes):
+                if phoneme not in phonemes_counts:
+                    continue  # boundary pseudo-phoneme
+                dict_writer.writerow({"code": code,
+                                      "phoneme": phoneme,
+                                      "count": phonemes_counts[phoneme]})
+        return inventory
+
+    def load(self) -> PhonemeInventory:
+        inventory = PhonemeInventory()
+        for code, phoneme, _ in self:
+            assert inventory.add(phoneme) == code
+        return inventory
+
+
+def load_phoneme_inventory(workspace: Workspace) -> PhonemeInventory:
+    """Loads the workspace's phoneme inventory. For workspaces phonemized
+    before the inventory existed, it's rebuilt from the phonemized words."""
+    inventory_csv = PhonemeInventoryCSV(workspace.phonemized / Path("inventory.csv"))
+    if inventory_csv.file_path.exists():
+        return inventory_csv.load()
+    logger.warning(f"No phoneme inventory found at {inventory_csv.file_path}, "
+                   f"building it from the phonemized words")
+    phonemized_words_csv = PhonemizedWordsCSV(workspace.phonemized / Path("all.csv"))
+    return PhonemeInventory(sorted({phoneme
+                                    for phonemes in phonemized_words_csv.unique_phonemic
+                                    for phoneme in phonemes}))
+
 
 class BasePhonemizer:
     folder_name = ""
@@ -117,7 +169,8 @@ class PhonemizeTask(BaseTask):
     ]
 
     creates = [
-        "phonemized/all.csv"
+        "phonemized/all.csv",
+        "phonemized/inventory.csv",
     ]
     stats_subpath = Path("phonemize.yml")
 
@@ -137,6 +190,8 @@ class PhonemizeTask(BaseTask):
 
         # number of words per unique phonemic form
         phonemized_counter: typing.Counter[str] = Counter()
+        # number of occurrences of each phoneme, used to build the phoneme inventory
+        phonemes_counter: typing.Counter[Phoneme] = Counter()
 
         # computing length of tokenized words file
         pbar = tqdm.tqdm(total=count_lines(tokenized_words_csv.file_path))
@@ -160,6 +215,7 @@ class PhonemizeTask(BaseTask):
                         # if current word's phonetic form is already present,
                         # ignore word (else, add it to the current set of phonemized words)
                         phonemized_counter["".join(phones)] += 1
+                        phonemes_counter.update(phones)
 
                         # logging the phonemization in the stats
                         self.stats[phonemizer.__class__.__name__] += 1
@@ -175,6 +231,12 @@ class PhonemizeTask(BaseTask):
         # storing the number of unique phonetic forms and n-plicates phonetic form
         self.stats["n_plicates_count"] = dict(Counter(phonemized_counter.values()))
 
+        inventory_csv = PhonemeInventoryCSV(workspace.phonemized / Path("inventory.csv"))
+        inventory = inventory_csv.write_inventory(phonemes_counter)
+        logger.info(f"Wrote phoneme inventory ({len(inventory) - 1} phonemes) "
+                    f"to {inventory_csv.file_path}")
+        self.stats["inventory_size"] = len(inventory) - 1
+
 
 class PhonemizeFrenchTask(PhonemizeTask):
     requires = (CMUFrenchPhonemizer.requires
@@ -2,9 +2,9 @@ from collections import defaultdict
 from pathlib import Path
 from typing import Iterable, Tuple
 
-from ..ngrams_tools import NGramComputer
+from ..ngram_model import PhonotacticModel
 from .base import BaseTask, CorporaTaskMixin
-from .phonemize import PhonemizedWordsCSV
+from .phonemize import PhonemizedWordsCSV, load_phoneme_inventory
 from .tokenize import TokenizedWordsCSV
 from ..utils import logger
 from ..workspace import Workspace, WorkspaceCSV
@@ -30,6 +30,7 @@ class CorporaNgramStatsTask(BaseTask, CorporaTaskMixin):
 
     creates = {
         "stats/corpora/ngrams/*/*.csv",
+        "stats/corpora/ngrams/*/model.bin",
         "stats/corpora/ngram/"
     }
 
@@ -37,7 +38,8 @@ class CorporaNgramStatsTask(BaseTask, CorporaTaskMixin):
         corpora_ngrams_folder = workspace.stats / Path("corpora/ngrams/")
         corpora_ngrams_folder.mkdir(parents=True, exist_ok=True)
         phonemized_words_csv = PhonemizedWordsCSV(workspace.phonemized / Path("all.csv"))
-        phonemized_words = phonemized_words_csv.to_dict()
+        inventory = load_phoneme_inventory(workspace)
+        phonemized_words = dict(phonemized_words_csv.iter_forms(inventory))
         for corpus_id, tokenized_corpus_path in self.find_corpora(workspace.corpora):
             logger.info(f"Statistics for corpus {corpus_id}")
 
@@ -45,14 +47,16 @@ class CorporaNgramStatsTask(BaseTask, CorporaTaskMixin):
             corpus_phon_freqs = defaultdict(int)
             for word, freq in TokenizedWordsCSV(tokenized_corpus_path):
                 try:
-                    corpus_phon_freqs[tuple(phonemized_words[word])] += freq
+                    corpus_phon_freqs[phonemized_words[word]] += freq
                 except KeyError as err:
                     print(err)
 
-            ngram_computer = NGramComputer(corpus_phon_freqs)
-
+            # the corpus' ngram model is only retrained if the corpus has changed
             corpus_stats_folder = corpora_ngrams_folder / Path(f"corpus_{corpus_id}/")
             corpus_stats_folder.mkdir(parents=True, exist_ok=True)
+            ngram_model = PhonotacticModel.load_or_train(corpus_stats_folder / Path("model.bin"),
+                                                         corpus_phon_freqs, inventory)
+            ngram_computer = ngram_model.ngram_computer()
             ngrams = {
                 "unigram_bounded": ngram_computer.unigrams(bounded=True),
                 "unigram_unbounded": ngram_computer.unigrams(bounded=False),
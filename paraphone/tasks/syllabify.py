@@ -1,10 +1,11 @@
 from pathlib import Path
-from typing import Tuple, List, Iterable, Dict
+from typing import Tuple, List, Iterable, Dict, Union
 
 from tqdm import tqdm
 
 from .base import BaseTask
-from .phonemize import PhonemizedWordsCSV
+from .phonemize import PhonemizedWordsCSV, load_phoneme_inventory
+from ..phonetic import PhoneticForm, PhonemeInventory
 from ..syllable_seg.separator import Separator
 from ..syllable_seg.syllabification import Syllabifier, NoVowelError, NoOnsetError, UnknownSymbolError
 from ..utils import logger, Phoneme, Syllable, parse_syllabic
@@ -27,6 +28,12 @@ class SyllabifiedWordsCSV(WorkspaceCSV):
     def to_dict(self) -> Dict[str, Tuple[List[Phoneme], List[Syllable]]]:
         return {word: (pho, syll) for word, pho, syll in self}
 
+    def iter_forms(self, inventory: PhonemeInventory) -> Iterable[Tuple[str, PhoneticForm, str]]:
+        """Iterates over words, their encoded phonetic form and (raw) syllabic form"""
+        with self.dict_reader as dict_reader:
+            for row in dict_reader:
+                yield row["word"], inventory.parse(row["phonetic"]), row["syllabic"]
+
 
 class SyllabifyTask(BaseTask):
     requires = [
@@ -66,16 +73,24 @@ class SyllabifyTask(BaseTask):
                                                    NoOnsetError,
                                                    UnknownSymbolError]}
 
-        graphemic_forms, phonetic_forms = zip(*phonemized_words_csv)
-        phonetic_forms = [" ".join(form) for form in phonetic_forms]
+        inventory = load_phoneme_inventory(workspace)
+        graphemic_forms, phonetic_forms = zip(*phonemized_words_csv.iter_forms(inventory))
         logger.info("Syllabifying the phonemic forms")
+        # homophones share the same phonetic form, which is syllabified only once
+        syllabified: Dict[PhoneticForm, Union[str, RuntimeError]] = {}
         syllabic_forms = []
         for pho_form in tqdm(phonetic_forms):
-            try:
-                syll_form = syllabifier.syllabify(pho_form, strip=True)
-            except RuntimeError as err:
-                logger.debug(f"Couldn't syllabify {pho_form}: {err}")
-                self.stats[err.__class__.__name__] += 1
+            if pho_form not in syllabified:
+                pho_str = inventory.fmt(pho_form)
+                try:
+                    syllabified[pho_form] = syllabifier.syllabify(pho_str, strip=True)
+                except RuntimeError as err:
+                    logger.debug(f"Couldn't syllabify {pho_str}: {err}")
+                    syllabified[pho_form] = err
+
+            syll_form = syllabified[pho_form]
+            if isinstance(syll_form, RuntimeError):
+                self.stats[syll_form.__class__.__name__] += 1
                 syllabic_forms.append(None)
             else:
                 syllabic_forms.append(syll_form)
@@ -94,7 +109,7 @@ class SyllabifyTask(BaseTask):
                 syllabic = syllabic.replace("/", "-")
                 dict_writer.writerow({
                     "word": word,
-                    "phonetic": phonetic,
+                    "phonetic": inventory.fmt(phonetic),
                     "syllabic": syllabic
                 })
                 syllabified_count += 1
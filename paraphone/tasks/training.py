@@ -1,4 +1,29 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Iterable, Tuple
+
 from .base import BaseTask
+from .phonemize import load_phoneme_inventory
+from .syllabify import SyllabifiedWordsCSV
+from .tokenize import TokenizedWordsCSV
+from ..ngram_model import PhonotacticModel
+from ..ngrams_tools import NgramModelSpec
+from ..phonetic import PhoneticForm
+from ..utils import logger, Phoneme
+from ..workspace import Workspace, WorkspaceCSV
+
+
+class PhonemizedWordsFrequencyCSV(WorkspaceCSV):
+    header = ['word', 'phonetic', 'frequency']
+
+    def __init__(self, file_path: Path):
+        super().__init__(file_path, separator="\t", header=self.header)
+
+    def __iter__(self) -> Iterable[Tuple[List[Phoneme], int]]:
+        with self.dict_reader as dict_reader:
+            for row in dict_reader:
+                yield (row["word"],
+                       row["phonetic"].split(" "),
+                       int(row["frequency"]))
 
 
 class BaseTrainingTask(BaseTask):
@@ -14,4 +39,46 @@ class G2PSeq2SeqTrainTask(BaseTask):
 
 
 class NgramsTrainTask(BaseTask):
-    pass
+    """Trains the phonotactic ngram models (unigrams, bigrams and optional
+    smoothed models) on the frequencies of the syllabified words' phonetic
+    forms, and saves them to the workspace's ngram model file. The model
+    isn't retrained if it's already been trained on the same data."""
+    requires = [
+        "datasets/tokenized/all.csv",  # used for word frequency (not normalized)
+        "phonemized/syllabic.csv",
+    ]
+
+    creates = [
+        "models/ngrams.bin",
+        "models/phonemized_words_frequencies.csv",
+    ]
+
+    def __init__(self, models: Optional[List[NgramModelSpec]] = None):
+        super().__init__()
+        self.models_specs = models if models is not None else []
+
+    def run(self, workspace: Workspace):
+        workspace.models.mkdir(parents=True, exist_ok=True)
+        # firstly, generate the {phonemized word -> frequency} csv
+        # from the syllabic CSV (some useless words are filtered out)
+        syllabic_csv = SyllabifiedWordsCSV(workspace.phonemized / Path("syllabic.csv"))
+        frequency_csv = PhonemizedWordsFrequencyCSV(workspace.models
+                                                    / Path("phonemized_words_frequencies.csv"))
+        tokenized_csv = TokenizedWordsCSV(workspace.tokenized / Path("all.csv"))
+        words_freq = tokenized_csv.to_dict()
+        inventory = load_phoneme_inventory(workspace)
+        phonemes_freqs: Dict[PhoneticForm, int] = {}
+        with frequency_csv.dict_writer as freq_writer:
+            freq_writer.writeheader()
+            for word, phonetic, _ in syllabic_csv.iter_forms(inventory):
+                freq_writer.writerow({
+                    "word": word,
+                    "phonetic": inventory.fmt(phonetic),
+                    "frequency": words_freq[word]
+                })
+                phonemes_freqs[phonetic] = words_freq[word]
+
+        logger.info("Computing ngrams probabilities over the phonemized dataset")
+        PhonotacticModel.load_or_train(workspace.ngram_model, phonemes_freqs,
+                                       inventory, self.models_specs)
+        logger.info(f"Ngram model saved to {workspace.ngram_model}")
@@ -1,9 +1,18 @@
+import csv
+import hashlib
+import math
 import multiprocessing
 import random
 import re
+import shutil
+import statistics
+import time
+from collections import defaultdict
+from dataclasses import dataclass, asdict
+from itertools import chain
 from pathlib import Path
 from types import ModuleType
-from typing import Set, Iterable, Tuple, List, Optional
+from typing import Set, Iterable, Tuple, List, Optional, Dict
 
 import tqdm
 from tqdm import tqdm
@@ -12,10 +21,12 @@ from wuggy_ng import Generator
 from .base import BaseTask
 from .syllabify import SyllabifiedWordsCSV
 from .tokenize import TokenizedWordsCSV
-from ..utils import logger, Phoneme, Syllable, parse_syllabic
+from ..utils import logger, Phoneme, Syllable, parse_syllabic, hash_file
 from ..workspace import WorkspaceCSV, Workspace
 from ..wuggy_plugins import phonetic_fr_ipa, phonetic_en_ipa
 
+WUGGY_SEED = 4577
+
 
 # TODO: make it per subcorpus
 class WuggyLexiconCSV(WorkspaceCSV):
@@ -24,6 +35,25 @@ class WuggyLexiconCSV(WorkspaceCSV):
     def __init__(self, file_path: Path):
         super().__init__(file_path, separator="\t", header=self.header)
 
+    def __iter__(self) -> Iterable[Tuple[str, str, float]]:
+        # the wuggy lexicon has no header
+        with open(self.file_path) as csv_file:
+            for row in csv.DictReader(csv_file, fieldnames=self.header,
+                                      delimiter=self.separator):
+                yield row["word"], row["syllabic"], float(row["frequency"])
+
+    def to_lookup(self) -> Dict[str, str]:
+        """Same as wuggy's lookup lexicon: word -> wuggy syllabic form"""
+        return {word: syllabic for word, syllabic, _ in self}
+
+    @staticmethod
+    def syllables_count(wuggy_syllabic: str) -> int:
+        return wuggy_syllabic.count("-") + 1
+
+    @staticmethod
+    def bucket_path(buckets_folder: Path, syllables_count: int) -> Path:
+        return buckets_folder / Path(f"lexicon_{syllables_count}.csv")
+
 
 class FakeWordsCandidatesCSV(WorkspaceCSV):
     header = ["word", "phonetic", "syllabic", "fake-phonetic", "fake-syllabic"]
@@ -42,6 +72,101 @@ class FakeWordsCandidatesCSV(WorkspaceCSV):
                        row["fake-phonetic"].split(" "),
                        parse_syllabic(row["fake-syllabic"]))
 
+    def iter_pairs(self) -> Iterable[Tuple[str, str, str]]:
+        """Only yields the word and the phonetic forms of the word and the fake word,
+        without parsing them"""
+        with self.dict_reader as dict_reader:
+            for row in dict_reader:
+                yield row["word"], row["phonetic"], row["fake-phonetic"]
+
+
+@dataclass
+class WordGenerationStats:
+    word: str
+    seconds: float
+    rounds: int
+    candidates: int
+    timed_out: bool
+
+
+class WuggyWordsStatsCSV(WorkspaceCSV):
+    """Per-word instrumentation of the wuggy candidates generation"""
+    header = ["word", "seconds", "rounds", "candidates", "timed_out"]
+
+    def __init__(self, file_path: Path):
+        super().__init__(file_path, separator="\t", header=self.header)
+
+    def __iter__(self) -> Iterable[WordGenerationStats]:
+        with self.dict_reader as dict_reader:
+            for row in dict_reader:
+                yield WordGenerationStats(row["word"],
+                                          float(row["seconds"]),
+                                          int(row["rounds"]),
+                                          int(row["candidates"]),
+                                          row["timed_out"] == "True")
+
+
+class WuggyCandidatesCache(WorkspaceCSV):
+    """Content-addressed cache of wuggy candidates, shareable between workspaces.
+
+    The cache file's name is derived from a hash of the wuggy lexicon
+    and the generation parameters, and each of its rows maps
+    a reference syllabic form (in wuggy's format) to its generated candidates.
+    """
+    header = ["syllabic", "candidates"]
+    candidates_sep = ";"
+
+    def __init__(self, cache_folder: Path, lexicon_path: Path,
+                 num_candidates: int, seed: int, high_overlap: bool = False,
+                 stop_at_num_candidates: bool = False):
+        self.lexicon_hash = hash_file(lexicon_path)
+        overlap_suffix = "_high-overlap" if high_overlap else ""
+        stop_suffix = "_stop" if stop_at_num_candidates else ""
+        cache_name = (f"{self.lexicon_hash[:16]}_n{num_candidates}_s{seed}"
+                      f"{overlap_suffix}{stop_suffix}.csv")
+        super().__init__(cache_folder / Path(cache_name), separator="\t", header=self.header)
+        self.entries: Dict[str, Set[str]] = dict()
+        self._new_entries: Dict[str, Set[str]] = dict()
+
+    def __iter__(self) -> Iterable[Tuple[str, Set[str]]]:
+        with self.dict_reader as dict_reader:
+            for row in dict_reader:
+                candidates = row["candidates"]
+                yield (row["syllabic"],
+                       set(candidates.split(self.candidates_sep)) if candidates else set())
+
+    def load(self):
+        if self.file_path.exists():
+            self.entries = {syllabic: candidates for syllabic, candidates in self}
+
+    def get(self, syllabic: str) -> Optional[Set[str]]:
+        return self.entries.get(syllabic)
+
+    def add(self, syllabic: str, candidates: Set[str]):
+        self.entries[syllabic] = candidates
+        self._new_entries[syllabic] = candidates
+
+    def flush(self) -> int:
+        """Appends the entries added since the last flush to the cache file,
+        and returns their number"""
+        if not self._new_entries:
+            return 0
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        write_header = not self.file_path.exists()
+        with open(self.file_path, "a") as cache_file:
+            dict_writer = csv.DictWriter(cache_file, fieldnames=self.header,
+                                         delimiter=self.separator)
+            if write_header:
+                dict_writer.writeheader()
+            for syllabic, candidates in self._new_entries.items():
+                dict_writer.writerow({
+                    "syllabic": syllabic,
+                    "candidates": self.candidates_sep.join(sorted(candidates))
+                })
+        new_entries_count = len(self._new_entries)
+        self._new_entries = dict()
+        return new_entries_count
+
 
 class WuggyPrepareTask(BaseTask):
     """Prepares a lexicon file for wuggy, containing :
@@ -55,7 +180,8 @@ class WuggyPrepareTask(BaseTask):
 
     creates = [
         "wuggy/lexicon.csv",
-        "wuggy/words.txt"
+        "wuggy/words.txt",
+        "wuggy/buckets/*.csv"
     ]
 
     def run(self, workspace: Workspace):
@@ -69,6 +195,8 @@ class WuggyPrepareTask(BaseTask):
 
         wuggy_lexicon_csv = WuggyLexiconCSV(workspace.wuggy / Path("lexicon.csv"))
         wuggy_words_path = workspace.wuggy / Path("words.txt")
+        # lexicon rows, partitioned by syllables count
+        lexicon_buckets: Dict[int, List[Dict]] = defaultdict(list)
         with wuggy_lexicon_csv.dict_writer as lexicon_writer, \
                 open(wuggy_words_path, "w") as words_file:
             # NOTE: we're not writing the header on purpose!
@@ -82,34 +210,102 @@ class WuggyPrepareTask(BaseTask):
                     "".join([pho + ":" for pho in syll if pho]) for syll in syllabic
                 )
 
-                lexicon_writer.writerow({
+                lexicon_row = {
                     "word": word,
                     "syllabic": syllabic_wuggy_repr,
                     "frequency": word_frequency
-                })
+                }
+                lexicon_writer.writerow(lexicon_row)
                 words_file.write(word + "\n")
+                lexicon_buckets[len(syllabic)].append(lexicon_row)
+
+        # Wuggy always filters its bigram chain on the sequence length (the number
+        # of syllables) of the reference word: we store one lexicon per syllables
+        # count, so that the generator only loads (and scans) the relevant one.
+        buckets_folder = workspace.wuggy / Path("buckets")
+        shutil.rmtree(buckets_folder, ignore_errors=True)
+        buckets_folder.mkdir(parents=True)
+        logger.info(f"Writing {len(lexicon_buckets)} syllables count buckets to {buckets_folder}")
+        for syllables_count, bucket_rows in lexicon_buckets.items():
+            bucket_csv = WuggyLexiconCSV(WuggyLexiconCSV.bucket_path(buckets_folder,
+                                                                     syllables_count))
+            with bucket_csv.dict_writer as bucket_writer:
+                for lexicon_row in bucket_rows:
+                    bucket_writer.writerow(lexicon_row)
 
 
 class WuggyGenerator:
+    """Wraps wuggy's generator. If a buckets folder is given, one wuggy
+    generator is (lazily) loaded for each syllables count bucket of the
+    lexicon, instead of a single one for the full lexicon. Only the bigram
+    chain is built from the bucket: the word, neighbor and lookup lexicons
+    are always the full lexicon, so that the lexicality of a candidate is
+    checked against all real words, whatever their syllables count. These
+    lexicons are only loaded once, and shared by the buckets' generators."""
     pho_sub_re = re.compile(r":")
     dash_sub_re = re.compile(r"-")
 
     def __init__(self, lexicon_path: Path, wuggy_plugin: ModuleType,
-                 num_candidates: int):
-        self.set_wuggy_plugin_params(lexicon_path, wuggy_plugin)
-        self.gen = Generator()
-        self.gen.data_path = "."
-        self.gen.load(wuggy_plugin, open(lexicon_path))
-        self.gen.load_word_lexicon(open(lexicon_path))
-        self.gen.load_neighbor_lexicon(open(lexicon_path))
-        self.gen.load_lookup_lexicon(open(lexicon_path))
+                 num_candidates: int, max_seconds_per_word: Optional[float] = None,
+                 buckets_folder: Optional[Path] = None, high_overlap: bool = False,
+                 stop_at_num_candidates: bool = False):
+        self.wuggy_plugin = wuggy_plugin
+        self.high_overlap = high_overlap
+        self.stop_at_num_candidates = stop_at_num_candidates
+        self.buckets_folder = buckets_folder
+        # syllables count -> generator (the key is None for the full lexicon)
+        self.generators: Dict[Optional[int], Generator] = dict()
+        # generator attribute -> lexicon loaded from the full lexicon
+        self.lexicons: Optional[Dict[str, object]] = None
+        self.lexicon_path = lexicon_path
+        if buckets_folder is None:
+            self.generators[None] = self.load_generator(lexicon_path)
+            self.lookup_lexicon: Dict[str, str] = self.generators[None].lookup_lexicon
+        else:
+            self.lookup_lexicon: Dict[str, str] = WuggyLexiconCSV(lexicon_path).to_lookup()
         self.num_candidates = num_candidates
-
-    def set_wuggy_plugin_params(self, lexicon_path: Path, wuggy_plugin: ModuleType):
-        wuggy_plugin.default_data = str(lexicon_path)
-        wuggy_plugin.default_neighbor_lexicon = str(lexicon_path)
-        wuggy_plugin.default_word_lexicon = str(lexicon_path)
-        wuggy_plugin.default_lookup_lexicon = str(lexicon_path)
+        self.max_seconds_per_word = max_seconds_per_word
+
+    def load_generator(self, chain_lexicon_path: Path) -> Generator:
+        """Loads a generator whose bigram chain is built from the given
+        lexicon (the full lexicon, or one of its buckets). The lexicons are
+        only loaded by the first generator, the next ones share them."""
+        self.set_wuggy_plugin_params(chain_lexicon_path, self.wuggy_plugin)
+        gen = Generator()
+        gen.data_path = "."
+        gen.load(self.wuggy_plugin, open(chain_lexicon_path))
+        if self.lexicons is not None:
+            for attribute, lexicon in self.lexicons.items():
+                setattr(gen, attribute, lexicon)
+            return gen
+
+        # the lexicons are whatever attributes the loaders set on the generator
+        chain_attributes = dict(vars(gen))
+        gen.load_word_lexicon(open(self.lexicon_path))
+        gen.load_neighbor_lexicon(open(self.lexicon_path))
+        gen.load_lookup_lexicon(open(self.lexicon_path))
+        self.lexicons = {attribute: value for attribute, value in vars(gen).items()
+                         if chain_attributes.get(attribute) is not value}
+        return gen
+
+    def lookup(self, word: str) -> Optional[str]:
+        return self.lookup_lexicon.get(word)
+
+    def generator_for(self, wuggy_syllabic: str) -> Generator:
+        """Returns the generator whose lexicon is relevant for that syllabic form"""
+        if self.buckets_folder is None:
+            return self.generators[None]
+        syllables_count = WuggyLexiconCSV.syllables_count(wuggy_syllabic)
+        if syllables_count not in self.generators:
+            bucket_path = WuggyLexiconCSV.bucket_path(self.buckets_folder, syllables_count)
+            self.generators[syllables_count] = self.load_generator(bucket_path)
+        return self.generators[syllables_count]
+
+    def set_wuggy_plugin_params(self, chain_lexicon_path: Path, wuggy_plugin: ModuleType):
+        wuggy_plugin.default_data = str(chain_lexicon_path)
+        wuggy_plugin.default_neighbor_lexicon = str(self.lexicon_path)
+        wuggy_plugin.default_word_lexicon = str(self.lexicon_path)
+        wuggy_plugin.default_lookup_lexicon = str(self.lexicon_path)
 
     @classmethod
     def normalize_wuggy_syllabic(cls, wuggy_syllabic: str) -> str:
@@ -118,25 +314,45 @@ class WuggyGenerator:
         normalized = normalized.strip()
         return normalized
 
-    def generate_candidates(self, word: str) -> Optional[Set[str]]:
-        if word not in self.gen.lookup_lexicon:
-            return
-
+    @staticmethod
+    def time_budget_spent(word_stats: WordGenerationStats, deadline: Optional[float]) -> bool:
+        """Pathological words can spend a very long time in generation (e.g., if
+        all the generated sequences are real words): generation stops as soon
+        as their time budget is spent, which is checked for every sequence"""
+        if deadline is not None and time.perf_counter() > deadline:
+            word_stats.timed_out = True
+        return word_stats.timed_out
+
+    def wuggy_candidates(self, gen: Generator, word_stats: WordGenerationStats,
+                         deadline: Optional[float]) -> Set[str]:
+        """Uses wuggy's concentric search (frequency filter of increasing
+        width) to generate candidates for the reference sequence.
+
+        Each round stops once `num_candidates` candidates are found, but the
+        next rounds still add one candidate each (which is wuggy's original
+        output), unless `stop_at_num_candidates` is set."""
         nonword_candidates = set()
-        self.gen.set_reference_sequence(self.gen.lookup(word))
         for i in range(1, self.num_candidates):
-            self.gen.set_frequency_filter(2 ** i, 2 ** i)
-            self.gen.set_attribute_filter('sequence_length')
-            self.gen.set_attribute_filter('segment_length')
-            self.gen.set_statistic('overlap_ratio')
-            self.gen.set_statistic('lexicality')
-            self.gen.set_output_mode('syllabic')
+            if self.time_budget_spent(word_stats, deadline):
+                break
+            if (self.stop_at_num_candidates
+                    and len(nonword_candidates) >= self.num_candidates):
+                break
+            word_stats.rounds = i
+            gen.set_frequency_filter(2 ** i, 2 ** i)
+            gen.set_attribute_filter('sequence_length')
+            gen.set_attribute_filter('segment_length')
+            gen.set_statistic('overlap_ratio')
+            gen.set_statistic('lexicality')
+            gen.set_output_mode('syllabic')
 
             # it's important not to use the cache because we want wuggy to always
             # generate the best matching nonword. The use of the cache would prevent
             # to generate multiple times the same nonword and thus lower the quality
             # the pairs. (and would cause performance issues on big sets of words)
-            for sequence in self.gen.generate(clear_cache=True):
+            for sequence in gen.generate(clear_cache=True):
+                if self.time_budget_spent(word_stats, deadline):
+                    break
 
                 # TODO: maybe think about removing this block
                 try:
@@ -145,7 +361,7 @@ class WuggyGenerator:
                     print('the matching nonword is non-ascii (bad wuggy)')
                     continue
 
-                if self.gen.statistics['lexicality'] != "N":
+                if gen.statistics['lexicality'] != "N":
                     continue
                 if sequence in nonword_candidates:
                     continue
@@ -154,21 +370,116 @@ class WuggyGenerator:
                 if len(nonword_candidates) >= self.num_candidates:
                     break
 
-        return {self.normalize_wuggy_syllabic(word)
-                for word in nonword_candidates}
+        return nonword_candidates
+
+    def high_overlap_candidates(self, gen: Generator, word_stats: WordGenerationStats,
+                                deadline: Optional[float]) -> Set[str]:
+        """Generates candidates whose overlap ratio with the reference sequence
+        is (n-1)/n, i.e., that differ from it by exactly one sub-syllabic segment.
+
+        Instead of generating all of wuggy's sequences and discarding those with
+        a lower overlap, the substitutes for each segment are looked up directly
+        in the bigram chain. Each substitution is assigned to the first round
+        of the concentric search whose frequency filter would let its two
+        transitions through."""
+        chain = gen.bigramchain
+        reference = gen.reference_sequence
+        reference_frequencies = chain.get_frequencies(reference)
+
+        # frequency filter round -> candidate sequences
+        rounds_candidates: Dict[int, List[Tuple]] = defaultdict(list)
+        # the first and last segments are the word boundaries
+        for position in range(1, len(reference) - 1):
+            segment = reference[position]
+            # chain links are keyed by (position, segment)
+            previous_links = chain.get((position - 1, reference[position - 1]), {})
+            next_link = (position + 1, reference[position + 1])
+            for (_, substitute), frequency_in in previous_links.items():
+                # the segment_length attribute filter
+                if substitute == segment or substitute.segment_length != segment.segment_length:
+                    continue
+                frequency_out = chain.get((position, substitute), {}).get(next_link)
+                if frequency_out is None:
+                    continue
+                deviation = max(abs(frequency_in - reference_frequencies[position - 1]),
+                                abs(frequency_out - reference_frequencies[position]))
+                filter_round = max(1, math.ceil(math.log2(deviation))) if deviation > 0 else 1
+                if filter_round < self.num_candidates:
+                    rounds_candidates[filter_round].append(
+                        reference[:position] + (substitute,) + reference[position + 1:])
+
+        nonword_candidates = set()
+        for i in range(1, self.num_candidates):
+            if (len(nonword_candidates) >= self.num_candidates
+                    or self.time_budget_spent(word_stats, deadline)):
+                break
+            word_stats.rounds = i
+            round_candidates = rounds_candidates[i]
+            random.shuffle(round_candidates)
+            for sequence in round_candidates:
+                if self.time_budget_spent(word_stats, deadline):
+                    break
+                gen.current_sequence = sequence
+                if self.wuggy_plugin.statistic_lexicality(gen, sequence) != "N":
+                    continue
+                nonword_candidates.add(self.wuggy_plugin.output_syllabic(sequence))
+                if len(nonword_candidates) >= self.num_candidates:
+                    break
+        return nonword_candidates
+
+    def generate_candidates(self, word: str) -> Tuple[Optional[Set[str]], WordGenerationStats]:
+        """Generates at most `num_candidates` nonwords for the word. Also returns
+        some statistics on the generation (time spent, number of frequency filter
+        rounds used, and whether the time budget was exceeded)"""
+        start_time = time.perf_counter()
+        word_stats = WordGenerationStats(word, seconds=0., rounds=0,
+                                         candidates=0, timed_out=False)
+        if word not in self.lookup_lexicon:
+            return None, word_stats
+
+        deadline = None
+        if self.max_seconds_per_word is not None:
+            deadline = start_time + self.max_seconds_per_word
+
+        reference_syllabic = self.lookup(word)
+        gen = self.generator_for(reference_syllabic)
+        gen.set_reference_sequence(reference_syllabic)
+        if self.high_overlap:
+            nonword_candidates = self.high_overlap_candidates(gen, word_stats, deadline)
+        else:
+            nonword_candidates = self.wuggy_candidates(gen, word_stats, deadline)
+
+        word_stats.seconds = time.perf_counter() - start_time
+        word_stats.candidates = len(nonword_candidates)
+        return ({self.normalize_wuggy_syllabic(word) for word in nonword_candidates},
+                word_stats)
 
 
 def wuggygen_initializer(lexicon_path: Path,
                          wuggy_plugin: ModuleType,
-                         num_candidates: int):
+                         num_candidates: int,
+                         max_seconds_per_word: Optional[float],
+                         buckets_folder: Optional[Path],
+                         high_overlap: bool,
+                         stop_at_num_candidates: bool):
     logger.info(f"Initializing wuggy generator for process {multiprocessing.current_process().name}")
     global wuggy_generator
-    random.seed(4577)  # setting seed for deterministic output
-    wuggy_generator = WuggyGenerator(lexicon_path, wuggy_plugin, num_candidates)
+    wuggy_generator = WuggyGenerator(lexicon_path, wuggy_plugin, num_candidates,
+                                     max_seconds_per_word, buckets_folder, high_overlap,
+                                     stop_at_num_candidates)
 
 
-def wuggygen_runner(word: str) -> Tuple[str, Set[str]]:
-    return word, wuggy_generator.generate_candidates(word)
+def word_seed(word: str) -> int:
+    """Seed of a word's generation, which doesn't depend on the words
+    generated before it by the same worker (nor on the python hash seed)"""
+    word_hash = hashlib.sha256(word.encode("utf-8")).digest()
+    return WUGGY_SEED + int.from_bytes(word_hash[:8], "big")
+
+
+def wuggygen_runner(word: str) -> Tuple[str, Set[str], WordGenerationStats]:
+    random.seed(word_seed(word))  # setting seed for deterministic output
+    candidates, word_stats = wuggy_generator.generate_candidates(word)
+    return word, candidates, word_stats
 
 
 class WuggyGenerationTask(BaseTask):
@@ -177,15 +488,43 @@ class WuggyGenerationTask(BaseTask):
         "phonemized/syllabic.csv",
     ]
     creates = [
-        "wuggy/candidates.csv"
+        "wuggy/candidates.csv",
+        "stats/wuggy_words.csv"
     ]
+    stats_subpath = Path("wuggy.yml")
     wuggy_plugin: ModuleType
 
-    def __init__(self, num_candidates: int, high_overlap: bool, num_workers: int):
+    def __init__(self, num_candidates: int, high_overlap: bool, num_workers: int,
+                 cache_folder: Optional[Path] = None,
+                 max_seconds_per_word: Optional[float] = None,
+                 stop_at_num_candidates: bool = False):
         super().__init__()
         self.num_candidates = num_candidates
         self.high_overlap = high_overlap
         self.num_workers = num_workers
+        self.cache_folder = cache_folder
+        self.max_seconds_per_word = max_seconds_per_word
+        self.stop_at_num_candidates = stop_at_num_candidates
+
+    def build_stats(self, words_stats: List[WordGenerationStats], cached_count: int):
+        """Summarizes the per-word generation statistics"""
+        seconds = [word_stats.seconds for word_stats in words_stats] or [0.]
+        rounds = [word_stats.rounds for word_stats in words_stats] or [0]
+        self.stats = {
+            "generated_words": len(words_stats),
+            "cached_words": cached_count,
+            "total_seconds": float(sum(seconds)),
+            "mean_seconds": float(statistics.mean(seconds)),
+            "median_seconds": float(statistics.median(seconds)),
+            "max_seconds": float(max(seconds)),
+            "mean_rounds": float(statistics.mean(rounds)),
+            "words_with_all_rounds": sum(word_stats.rounds == self.num_candidates - 1
+                                         for word_stats in words_stats),
+            "words_under_num_candidates": sum(word_stats.candidates < self.num_candidates
+                                              for word_stats in words_stats),
+            "timed_out_words": sorted(word_stats.word for word_stats in words_stats
+                                      if word_stats.timed_out),
+        }
 
     def run(self, workspace: Workspace):
         # loading the syllabified lexicon as {word -> (pho, syll)} dict
@@ -194,33 +533,73 @@ class WuggyGenerationTask(BaseTask):
 
         # loading what's needed for wuggy, and instantiating wuggy generator
         lexicon_path = workspace.wuggy / Path("lexicon.csv")
+        buckets_folder: Optional[Path] = workspace.wuggy / Path("buckets")
+        if not buckets_folder.is_dir():
+            # workspaces prepared before the lexicon was bucketed
+            logger.warning(f"No syllables count buckets found in {buckets_folder}, the bigram "
+                           f"chain is built from the full lexicon (the wuggy lexicon preparation "
+                           f"writes the buckets).")
+            buckets_folder = None
         words_path = workspace.wuggy / Path("words.txt")
-        wuggy_gen = WuggyGenerator(lexicon_path, self.wuggy_plugin, self.num_candidates)
+        wuggy_gen = WuggyGenerator(lexicon_path, self.wuggy_plugin, self.num_candidates,
+                                   buckets_folder=buckets_folder)
 
         # Here are the set of all legal words
-        legal_words: Set[str] = set(wuggy_gen.gen.lookup_lexicon.keys())
+        legal_words: Set[str] = set(wuggy_gen.lookup_lexicon.keys())
         with open(words_path) as words_file:
             words = {word for word in words_file.read().split("\n") if word}
         logger.info(f"There are {len(legal_words)} legal words (out of {len(words)} words).")
 
+        # words whose reference syllabic form is found in the cache
+        # are not sent to the generator
+        cache: Optional[WuggyCandidatesCache] = None
+        cached_candidates: Dict[str, Set[str]] = dict()
+        if self.cache_folder is not None:
+            cache = WuggyCandidatesCache(self.cache_folder, lexicon_path,
+                                         self.num_candidates, WUGGY_SEED,
+                                         self.high_overlap, self.stop_at_num_candidates)
+            logger.info(f"Loading wuggy candidates cache from {cache.file_path}")
+            cache.load()
+            for word in legal_words:
+                word_candidates = cache.get(wuggy_gen.lookup(word))
+                if word_candidates is not None:
+                    cached_candidates[word] = word_candidates
+            hits_count = len(cached_candidates)
+            logger.info(f"Wuggy cache: {hits_count} hits for {len(legal_words)} words "
+                        f"({hits_count / max(len(legal_words), 1):.0%} hit rate)")
+        # sorting words by syllables count makes the pool's chunks mostly
+        # use the same lexicon bucket
+        words_to_generate = sorted(
+            (word for word in legal_words if word not in cached_candidates),
+            key=lambda w: WuggyLexiconCSV.syllables_count(wuggy_gen.lookup(w)))
+
         # creating the candidates CSV and running the generator
         candidates_csv = FakeWordsCandidatesCSV(workspace.wuggy / Path("candidates.csv"))
         pool = multiprocessing.Pool(processes=self.num_workers,
                                     initializer=wuggygen_initializer,
                                     initargs=(lexicon_path,
                                               self.wuggy_plugin,
-                                              self.num_candidates),
+                                              self.num_candidates,
+                                              self.max_seconds_per_word,
+                                              buckets_folder,
+                                              self.high_overlap,
+                                              self.stop_at_num_candidates),
                                     )
+        words_stats: List[WordGenerationStats] = []
         with candidates_csv.dict_writer as dict_writer, pool:
             dict_writer.writeheader()
-            # map_args = ((word, wuggy_gen) for word in legal_words)
-            pool_map = pool.imap_unordered(wuggygen_runner, legal_words,
+            pool_map = pool.imap_unordered(wuggygen_runner, words_to_generate,
                                            chunksize=2 ** 7)
-            for word, fake_words in tqdm(pool_map, total=len(legal_words)):
-                if fake_words is None:
-                    pass
+            results = chain(((word, fake_words, None)
+                             for word, fake_words in cached_candidates.items()),
+                            pool_map)
+            for word, fake_words, word_stats in tqdm(results, total=len(legal_words)):
                 word: str
                 fake_words: Set[str]
+                if word_stats is not None:
+                    words_stats.append(word_stats)
+                    if cache is not None and not word_stats.timed_out:
+                        cache.add(wuggy_gen.lookup(word), fake_words)
                 word_pho, word_syll = syllabified_lexicon[word]
                 word_pho = " ".join(word_pho)
                 word_syll = "-".join(" ".join(syll) for syll in word_syll)
@@ -234,6 +613,19 @@ class WuggyGenerationTask(BaseTask):
                         "fake-syllabic": fake_word_syll
                     })
 
+        if cache is not None:
+            new_entries_count = cache.flush()
+            logger.info(f"Stored {new_entries_count} new entries in the wuggy cache")
+
+        workspace.stats.mkdir(parents=True, exist_ok=True)
+        words_stats_csv = WuggyWordsStatsCSV(workspace.stats / Path("wuggy_words.csv"))
+        logger.info(f"Writing per-word generation statistics to {words_stats_csv.file_path}")
+        words_stats_csv.write([asdict(word_stats) for word_stats in words_stats])
+        self.build_stats(words_stats, cached_count=len(cached_candidates))
+        if self.stats["timed_out_words"]:
+            logger.warning(f"{len(self.stats['timed_out_words'])} words exceeded "
+                           f"their time budget of {self.max_seconds_per_word}s")
+
 
 class WuggyGenerationFrTask(WuggyGenerationTask):
     wuggy_plugin = phonetic_fr_ipa
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 from datetime import datetime
 from itertools import tee, zip_longest
@@ -64,6 +65,15 @@ def count_lines(filepath: Path) -> int:
         return sum(buffer.count(b'\n') for buffer in c_generator)
 
 
+def hash_file(file_path: Path) -> str:
+    """SHA-256 digest of a file's content"""
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(2 ** 20), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
 def null_logger():
     """Configures and returns a logger sending messages to nowhere
     This is used as default logger for some functions.
@@ -110,4 +110,12 @@ class Workspace:
 
     @property
     def stats(self) -> Path:
-        return self.root_path / Path("stats/")
\ No newline at end of file
+        return self.root_path / Path("stats/")
+
+    @property
+    def models(self) -> Path:
+        return self.root_path / Path("models/")
+
+    @property
+    def ngram_model(self) -> Path:
+        return self.models / Path("ngrams.bin")
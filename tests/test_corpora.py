@@ -0,0 +1,204 @@
+import random
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Set
+
+import pytest
+
+from paraphone.tasks import corpora
+from paraphone.tasks.corpora import BuildZeroSpeechTestSetsTask, CorporaCreationTask, LINK_MODES, \
+    FamiliesManifest
+from paraphone.tasks.tokenize import TokenizedWordsCSV
+from paraphone.workspace import Workspace
+
+TEXTS = [f"text_{i}" for i in range(8)]
+VOCABULARY = [f"word_{i}" for i in range(40)]
+
+
+def zr_task(tmp_path: Path, link_mode: str) -> BuildZeroSpeechTestSetsTask:
+    return BuildZeroSpeechTestSetsTask(tmp_path / "zr", "phonetic", link_mode=link_mode)
+
+
+@pytest.fixture
+def audio_folders(tmp_path):
+    synth_folder, audio_folder = tmp_path / "synth", tmp_path / "ogg"
+    synth_folder.mkdir()
+    audio_folder.mkdir()
+    return synth_folder, audio_folder
+
+
+@pytest.mark.parametrize("link_mode", LINK_MODES)
+def test_link_audio_files(tmp_path, audio_folders, link_mode):
+    synth_folder, audio_folder = audio_folders
+    audio_files = {}
+    for i in range(5):
+        source = synth_folder / f"form_{i}.ogg"
+        source.write_bytes(f"audio {i}".encode())
+        audio_files[audio_folder / f"form_{i}-voice.ogg"] = source
+    # already linked files are left untouched
+    (audio_folder / "form_0-voice.ogg").write_bytes(b"existing")
+
+    zr_task(tmp_path, link_mode).link_audio_files(audio_files, audio_folder)
+    assert (audio_folder / "form_0-voice.ogg").read_bytes() == b"existing"
+    for i in range(1, 5):
+        assert (audio_folder / f"form_{i}-voice.ogg").read_bytes() == f"audio {i}".encode()
+
+
+@pytest.mark.parametrize("link_mode", LINK_MODES)
+def test_link_missing_file(tmp_path, audio_folders, link_mode):
+    synth_folder, audio_folder = audio_folders
+    destination = audio_folder / "missing-voice.ogg"
+    with pytest.raises(FileNotFoundError):
+        zr_task(tmp_path, link_mode).link_file(synth_folder / "missing.ogg", destination)
+    assert not destination.exists() and not destination.is_symlink()
+
+
+def test_failed_reflink_fallback(tmp_path, audio_folders, monkeypatch):
+    synth_folder, audio_folder = audio_folders
+    source, destination = synth_folder / "form.ogg", audio_folder / "form-voice.ogg"
+    source.write_bytes(b"audio")
+
+    def unsupported_reflink(source: Path, destination: Path):
+        destination.write_bytes(b"")
+        raise OSError("reflinks unsupported")
+
+    def failed_copy(source: Path, destination: Path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(corpora, "reflink_file", unsupported_reflink)
+    monkeypatch.setattr(corpora, "copyfile", failed_copy)
+    with pytest.raises(OSError, match="disk full"):
+        zr_task(tmp_path, "reflink").link_file(source, destination)
+    assert not destination.exists()
+
+
+def write_group(workspace: Workspace, family_id: int, group_id: int, texts: List[str]):
+    group_path = workspace.datasets / f"families/family_{family_id}/group_{group_id}.txt"
+    group_path.parent.mkdir(parents=True, exist_ok=True)
+    group_path.write_text("\n".join(texts) + "\n")
+
+
+def write_text(workspace: Workspace, text: str, words: Dict[str, int]):
+    TokenizedWordsCSV(workspace.tokenized / f"per_text/{text}.csv").write(
+        [{"word": word, "count": count} for word, count in words.items()])
+
+
+@pytest.fixture
+def families_workspace(tmp_path: Path) -> Workspace:
+    workspace = Workspace(tmp_path)
+    (workspace.tokenized / "per_text").mkdir(parents=True)
+    rng = random.Random(4577)
+    for text in TEXTS:
+        write_text(workspace, text, {word: rng.randint(1, 9)
+                                     for word in rng.sample(VOCABULARY, 30)})
+    # each family splits the texts in family_id groups
+    for family_id in (1, 2, 4):
+        group_size = len(TEXTS) // family_id
+        for group_id in range(1, family_id + 1):
+            write_group(workspace, family_id, group_id,
+                        TEXTS[(group_id - 1) * group_size:group_id * group_size])
+    return workspace
+
+
+def expected_intersection(workspace: Workspace, family_id: int) -> Dict[str, int]:
+    """Words found in all the family's groups, and their counts"""
+    groups_words = []
+    for group_path in (workspace.datasets / f"families/family_{family_id}").iterdir():
+        group_words = Counter()
+        for text in group_path.read_text().split():
+            group_words.update(TokenizedWordsCSV(workspace.tokenized / f"per_text/{text}.csv").to_dict())
+        groups_words.append(group_words)
+    intersection = set.intersection(*(set(group_words) for group_words in groups_words))
+    return {word: sum(group_words[word] for group_words in groups_words) for word in intersection}
+
+
+def expected_corpora(workspace: Workspace) -> Dict[int, Dict[str, int]]:
+    """Corpus of each family: its intersection, minus the words of the finer families"""
+    corpora_words: Dict[int, Dict[str, int]] = {}
+    previous_words: Set[str] = set()
+    for family_id in (4, 2, 1):
+        intersection = expected_intersection(workspace, family_id)
+        corpora_words[family_id] = {word: count for word, count in intersection.items()
+                                    if word not in previous_words}
+        previous_words.update(intersection)
+    return corpora_words
+
+
+def corpora_words(workspace: Workspace) -> Dict[int, Dict[str, int]]:
+    return {family_id: TokenizedWordsCSV(workspace.corpora / f"tokenized/corpus_{family_id}.csv").to_dict()
+            for family_id in (4, 2, 1)}
+
+
+@pytest.fixture
+def computed_families(monkeypatch) -> List[Set[int]]:
+    """Records the families whose intersection is computed, for each run"""
+    computed = []
+    compute_intersections = CorporaCreationTask.compute_intersections
+
+    def recording_compute_intersections(self, families, families_ids, vocabulary, workspace):
+        computed.append(set(families_ids))
+        return compute_intersections(self, families, families_ids, vocabulary, workspace)
+
+    monkeypatch.setattr(CorporaCreationTask, "compute_intersections", recording_compute_intersections)
+    return computed
+
+
+def test_corpora_creation(families_workspace: Workspace):
+    CorporaCreationTask().run(families_workspace)
+    corpora_words_counts = corpora_words(families_workspace)
+    assert corpora_words_counts == expected_corpora(families_workspace)
+    assert all(corpora_words_counts.values())
+    manifest = FamiliesManifest.load(families_workspace.corpora / "families")
+    assert list(manifest.families) == [4, 2, 1]
+
+
+def test_cached_intersections(families_workspace: Workspace, computed_families: List[Set[int]]):
+    CorporaCreationTask().run(families_workspace)
+    corpora_folder = families_workspace.corpora / "tokenized"
+    mtimes = {path.name: path.stat().st_mtime_ns for path in corpora_folder.iterdir()}
+
+    # unchanged families aren't recomputed, and their corpora aren't rewritten
+    CorporaCreationTask().run(families_workspace)
+    assert computed_families == [{1, 2, 4}]
+    assert {path.name: path.stat().st_mtime_ns for path in corpora_folder.iterdir()} == mtimes
+
+    # moving texts between family 2's groups only changes family 2's
+    # intersection, and the corpora of family 2 and of the coarser family 1
+    write_group(families_workspace, 2, 1, TEXTS[:3])
+    write_group(families_workspace, 2, 2, TEXTS[3:])
+    CorporaCreationTask().run(families_workspace)
+    assert computed_families[-1] == {2}
+    assert (corpora_folder / "corpus_4.csv").stat().st_mtime_ns == mtimes["corpus_4.csv"]
+    assert corpora_words(families_workspace) == expected_corpora(families_workspace)
+
+    # a changed text changes all the families
+    write_text(families_workspace, TEXTS[0], {word: 1 for word in VOCABULARY})
+    CorporaCreationTask(num_workers=2).run(families_workspace)
+    assert computed_families[-1] == {1, 2, 4}
+    assert corpora_words(families_workspace) == expected_corpora(families_workspace)
+
+
+def test_single_family(families_workspace: Workspace, computed_families: List[Set[int]]):
+    CorporaCreationTask().run(families_workspace)
+    write_group(families_workspace, 2, 1, TEXTS[:3])
+    write_group(families_workspace, 2, 2, TEXTS[3:])
+    write_group(families_workspace, 4, 1, TEXTS[:1])
+    write_group(families_workspace, 4, 2, TEXTS[1:4])
+
+    # only the given family is recomputed, even though family 4 changed too
+    corpus_4_path = families_workspace.corpora / "tokenized/corpus_4.csv"
+    corpus_4_mtime = corpus_4_path.stat().st_mtime_ns
+    CorporaCreationTask(family=2).run(families_workspace)
+    assert computed_families[-1] == {2}
+    manifest = FamiliesManifest.load(families_workspace.corpora / "families")
+    assert TokenizedWordsCSV(manifest.intersection_path(2)).to_dict() == \
+           expected_intersection(families_workspace, 2)
+    assert corpus_4_path.stat().st_mtime_ns == corpus_4_mtime
+
+    # family 4 is then recomputed by a run on all families
+    CorporaCreationTask().run(families_workspace)
+    assert computed_families[-1] == {4}
+    assert corpora_words(families_workspace) == expected_corpora(families_workspace)
+
+    with pytest.raises(ValueError):
+        CorporaCreationTask(family=3).run(families_workspace)
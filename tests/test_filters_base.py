@@ -0,0 +1,152 @@
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+from paraphone.tasks.filters.base import FilteringTaskMixin, StepsManifest, StepRecord, \
+    CandidatesPairCSV, WordPair
+from paraphone.workspace import Workspace
+
+PAIRS = [("avec", "a v ɛ k", "a v ɛ t"),
+         ("bal", "b a l", "b a l"),
+         ("table", "t a b l", "t o b l"),
+         ("pour", "p u ʁ", "p i ʁ")]
+
+
+class MaxLengthFilterTask(FilteringTaskMixin):
+    """Keeps pairs whose fake word is short enough, counting its calls"""
+    requires = [
+        "candidates_filtering/steps/*",
+        "dictionaries/resource.txt",
+    ]
+    step_name = "max-length"
+
+    def __init__(self, max_length: int):
+        super().__init__()
+        self.max_length = max_length
+        self.applied = 0
+
+    @property
+    def step_params(self) -> Dict[str, Any]:
+        return {"max_length": self.max_length}
+
+    def apply(self, workspace: Workspace) -> int:
+        self.applied += 1
+        return super().apply(workspace)
+
+    def keep_pair(self, word_pair: WordPair) -> bool:
+        return len(word_pair.fake_word_pho.split(" ")) <= self.max_length
+
+
+class DifferentFilterTask(MaxLengthFilterTask):
+    step_name = "different"
+
+    def __init__(self):
+        super().__init__(max_length=0)
+
+    @property
+    def step_params(self) -> Dict[str, Any]:
+        return {}
+
+    def keep_pair(self, word_pair: WordPair) -> bool:
+        return word_pair.word_pho != word_pair.fake_word_pho
+
+
+@pytest.fixture
+def workspace(tmp_path: Path) -> Workspace:
+    workspace = Workspace(tmp_path)
+    (workspace.dictionaries / "resource.txt").parent.mkdir(parents=True)
+    (workspace.dictionaries / "resource.txt").write_text("v1")
+    init_run(workspace)
+    return workspace
+
+
+def init_run(workspace: Workspace):
+    """Starts a run of the filtering pipeline on unchanged candidates (as
+    the init step does)"""
+    steps_folder = workspace.candidates_filtering / "steps"
+    manifest = StepsManifest.load(steps_folder)
+    if not manifest.steps:
+        steps_folder.mkdir(parents=True)
+        CandidatesPairCSV(steps_folder / "step_1_init.csv").write(
+            [{"word": word, "word_pho": word_pho, "fake_word_pho": fake_word_pho}
+             for word, word_pho, fake_word_pho in PAIRS])
+        manifest.append(StepRecord(id=1, name="init", file="step_1_init.csv", params={},
+                                   rows=len(PAIRS), input_hash="candidates", duration=0.))
+    manifest.cursor = 1
+    manifest.save()
+
+
+def run_pipeline(workspace: Workspace, filters: List[FilteringTaskMixin]) -> StepsManifest:
+    init_run(workspace)
+    for filter_task in filters:
+        filter_task.run(workspace)
+    return StepsManifest.from_workspace(workspace)
+
+
+def step_pairs(manifest: StepsManifest) -> List[tuple]:
+    return list(CandidatesPairCSV(manifest.step_path(manifest.current_step)))
+
+
+def test_steps_recorded(workspace: Workspace):
+    manifest = run_pipeline(workspace, [DifferentFilterTask(), MaxLengthFilterTask(3)])
+    assert [(step.id, step.name, step.rows) for step in manifest.steps] == \
+           [(1, "init", 4), (2, "different", 3), (3, "max-length", 1)]
+    assert manifest.cursor == 3
+    assert step_pairs(manifest) == [("pour", "p u ʁ", "p i ʁ")]
+
+
+def test_unchanged_steps_reused(workspace: Workspace):
+    first_manifest = run_pipeline(workspace, [DifferentFilterTask(), MaxLengthFilterTask(3)])
+    filters = [DifferentFilterTask(), MaxLengthFilterTask(3)]
+    manifest = run_pipeline(workspace, filters)
+    assert [filter_task.applied for filter_task in filters] == [0, 0]
+    assert manifest.steps == first_manifest.steps
+    assert manifest.cursor == 3
+
+
+def test_changed_params_truncate_steps(workspace: Workspace):
+    run_pipeline(workspace, [MaxLengthFilterTask(4), DifferentFilterTask()])
+    steps_folder = workspace.candidates_filtering / "steps"
+    assert (steps_folder / "step_3_different.csv").exists()
+
+    # the first filter's output changes: its next steps are outdated
+    init_run(workspace)
+    max_length_filter = MaxLengthFilterTask(3)
+    max_length_filter.run(workspace)
+    manifest = StepsManifest.from_workspace(workspace)
+    assert max_length_filter.applied == 1
+    assert [step.name for step in manifest.steps] == ["init", "max-length"]
+    assert not (steps_folder / "step_3_different.csv").exists()
+
+    different_filter = DifferentFilterTask()
+    different_filter.run(workspace)
+    manifest = StepsManifest.from_workspace(workspace)
+    assert different_filter.applied == 1
+    assert step_pairs(manifest) == [("pour", "p u ʁ", "p i ʁ")]
+
+
+def test_changed_resources_not_reused(workspace: Workspace):
+    run_pipeline(workspace, [DifferentFilterTask(), MaxLengthFilterTask(3)])
+    (workspace.dictionaries / "resource.txt").write_text("v2")
+    filters = [DifferentFilterTask(), MaxLengthFilterTask(3)]
+    run_pipeline(workspace, filters)
+    # both filters depend on the resource
+    assert [filter_task.applied for filter_task in filters] == [1, 1]
+
+
+def test_manifest_recovered_from_step_files(workspace: Workspace):
+    run_pipeline(workspace, [DifferentFilterTask()])
+    steps_folder = workspace.candidates_filtering / "steps"
+    (steps_folder / "manifest.yml").unlink()
+
+    manifest = StepsManifest.load(steps_folder)
+    assert [(step.id, step.name, step.rows) for step in manifest.steps] == \
+           [(1, "init", 4), (2, "different", 3)]
+    assert manifest.cursor == 2
+    # steps of unknown inputs are never reused
+    manifest.cursor = 1
+    manifest.save()
+    filter_task = DifferentFilterTask()
+    filter_task.run(workspace)
+    assert filter_task.applied == 1
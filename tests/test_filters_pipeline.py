@@ -0,0 +1,101 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+
+pytest.importorskip("wuggy_ng")
+
+from paraphone.tasks.filters.base import FilteringTaskMixin, StepsManifest, CandidatesPairCSV
+from paraphone.tasks.filters.pipeline import FusedFilteringTask
+from paraphone.tasks.filters.simple import InitFilteringTask, EqualsFilterTask, \
+    MostFrequentHomophoneFilterTask, RandomPairFilterTask, RandomFilterTask
+from paraphone.tasks.tokenize import TokenizedWordsCSV
+from paraphone.tasks.wuggy_gen import FakeWordsCandidatesCSV
+from paraphone.workspace import Workspace
+
+# (word, phonetic form, frequency)
+WORDS = [("vert", "v ɛ ʁ", 30), ("verre", "v ɛ ʁ", 12), ("vers", "v ɛ ʁ", 50),
+         ("avec", "a v ɛ k", 100), ("table", "t a b l", 20), ("pour", "p u ʁ", 80),
+         ("mer", "m ɛ ʁ", 15), ("mère", "m ɛ ʁ", 25), ("bal", "b a l", 5)]
+FAKE_VOWELS = ["a", "o", "i", "u", "ɛ"]
+
+
+def make_workspace(root: Path) -> Workspace:
+    workspace = Workspace(root)
+    workspace.wuggy.mkdir(parents=True)
+    workspace.tokenized.mkdir(parents=True)
+    TokenizedWordsCSV(workspace.tokenized / "all.csv").write(
+        [{"word": word, "count": count} for word, _, count in WORDS])
+    rows = []
+    for word, phonetic, _ in WORDS:
+        phonemes = phonetic.split(" ")
+        for i, vowel in enumerate(FAKE_VOWELS):
+            # one of the fake words is equal to its word
+            fake_phonemes = [vowel if phoneme in FAKE_VOWELS else phoneme for phoneme in phonemes]
+            if i > 0:
+                fake_phonemes[-1] = fake_phonemes[-1] + "ʁ" if i % 2 else "l"
+            rows.append({"word": word, "phonetic": phonetic, "syllabic": phonetic,
+                         "fake-phonetic": " ".join(fake_phonemes),
+                         "fake-syllabic": " ".join(fake_phonemes)})
+    FakeWordsCandidatesCSV(workspace.wuggy / "candidates.csv").write(rows)
+    return workspace
+
+
+def make_filters() -> List[FilteringTaskMixin]:
+    return [EqualsFilterTask(), MostFrequentHomophoneFilterTask(),
+            RandomPairFilterTask(), RandomFilterTask(0.7)]
+
+
+def last_step(workspace: Workspace):
+    manifest = StepsManifest.from_workspace(workspace)
+    steps = [(step.id, step.name, step.params, step.rows, step.input_hash)
+             for step in manifest.steps[:manifest.cursor]]
+    step_path = manifest.step_path(manifest.current_step)
+    return steps, step_path.name, list(CandidatesPairCSV(step_path))
+
+
+@pytest.mark.parametrize("write_steps", [False, True])
+def test_fused_filters_match_sequential_filters(tmp_path: Path, write_steps: bool):
+    sequential_workspace = make_workspace(tmp_path / "sequential")
+    InitFilteringTask().run(sequential_workspace)
+    for filter_task in make_filters():
+        filter_task.run(sequential_workspace)
+
+    fused_workspace = make_workspace(tmp_path / "fused")
+    FusedFilteringTask(make_filters(), write_steps=write_steps).run(fused_workspace)
+
+    sequential_steps, sequential_file, sequential_pairs = last_step(sequential_workspace)
+    fused_steps, fused_file, fused_pairs = last_step(fused_workspace)
+    assert 0 < len(fused_pairs) < len(WORDS)
+    assert fused_pairs == sequential_pairs
+    assert fused_file == sequential_file
+    assert fused_steps == sequential_steps
+
+
+def test_nondeterministic_filter_before_stateful_filter():
+    # the random filter would draw different pairs in the stateful filter's
+    # observation pass and in the filtering pass
+    with pytest.raises(ValueError):
+        FusedFilteringTask([EqualsFilterTask(), RandomFilterTask(0.7), RandomPairFilterTask()])
+    FusedFilteringTask([RandomPairFilterTask(), RandomFilterTask(0.7), EqualsFilterTask()])
+
+
+def test_fused_filters_reused(tmp_path: Path):
+    workspace = make_workspace(tmp_path)
+    fused_task = FusedFilteringTask(make_filters(), write_steps=True)
+    fused_task.run(workspace)
+    steps_folder = workspace.candidates_filtering / "steps"
+    mtimes = {path.name: path.stat().st_mtime_ns for path in steps_folder.glob("*.csv")}
+    assert len(mtimes) == len(make_filters()) + 1
+
+    # an unchanged fused pass, or the same filters run one after the other,
+    # reuse the written steps
+    reused_task = FusedFilteringTask(make_filters(), write_steps=True)
+    reused_task.run(workspace)
+    assert reused_task.stats == fused_task.stats
+    assert len(fused_task.stats["steps"]) == len(make_filters())
+    InitFilteringTask().run(workspace)
+    for filter_task in make_filters():
+        filter_task.run(workspace)
+    assert {path.name: path.stat().st_mtime_ns for path in steps_folder.glob("*.csv")} == mtimes
+    assert StepsManifest.from_workspace(workspace).cursor == len(make_filters()) + 1
@@ -0,0 +1,159 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from paraphone.ngrams_tools import rank, word_category, FakeWordsBalancer, NGramComputer, \
+    BincountNGramComputer, BatchNgramScorer, SmoothedNgramModel, NgramModelSpec
+from paraphone.ngram_model import PhonotacticModel
+from paraphone.phonetic import PhonemeInventory
+from paraphone.utils import consecutive_pairs
+
+# phonetic forms, as tuples of phonemes, and their frequencies
+PHONEMIC_FREQ = {("a", "v", "ɛ", "k"): 100, ("b", "a", "l"): 5, ("t", "a", "b", "l"): 20,
+                 ("p", "u", "ʁ"): 80, ("v", "ɛ", "ʁ"): 42, ("a",): 3, ("l", "a", "l", "a"): 0}
+PHONEMES = sorted({phoneme for form in PHONEMIC_FREQ for phoneme in form})
+
+
+def encode(form) -> bytes:
+    # 0 is the boundary code
+    return bytes(PHONEMES.index(phoneme) + 1 for phoneme in form)
+
+
+ENCODED_FREQ = {encode(form): freq for form, freq in PHONEMIC_FREQ.items()}
+
+
+@pytest.mark.parametrize("frequency, expected", [
+    (0, "FREQRANK[0]"),
+    (1, "FREQRANK[0 - 10]"),
+    (10, "FREQRANK[0 - 10]"),
+    (11, "FREQRANK[10 - 20]"),
+    (20, "FREQRANK[10 - 20]"),
+    (35, "FREQRANK[20 - 50]"),
+    (100, "FREQRANK[50 - 100]"),
+    (101, "FREQRANK[100 - inf]"),
+    (10 ** 6, "FREQRANK[100 - inf]"),
+])
+def test_rank(frequency, expected):
+    assert rank(frequency) == expected
+
+
+def test_word_category():
+    assert word_category(("b", "a"), 5) == (2, "FREQRANK[0 - 10]")
+    assert word_category(("b", "a", "l"), 0) == (3, "FREQRANK[0]")
+    # words of the same length and frequency rank share their category
+    assert word_category(("b", "a"), 3) == word_category(("t", "o"), 8)
+    assert word_category(("b", "a"), 3) != word_category(("t", "o"), 12)
+    assert word_category(("b", "a"), 3) != word_category(("t", "o", "t"), 3)
+
+
+def test_balancer_categories():
+    scores = np.random.default_rng(1234).normal(size=(12, 2))
+    forms_freqs = {0: (("b", "a"), 3), 1: (("t", "o"), 8), 2: (("t", "o"), 12),
+                   3: (("b", "a", "l"), 3), 4: (("b", "a", "l"), 150), 5: (("p", "a", "l"), 400)}
+    categories = {word_id: word_category(form, freq) for word_id, (form, freq) in forms_freqs.items()}
+    pairs = {word_id: [6 + word_id] for word_id in forms_freqs}
+    balancer = FakeWordsBalancer(scores, categories, pairs)
+    assert balancer.categories == {
+        (2, "FREQRANK[0 - 10]"),
+        (2, "FREQRANK[10 - 20]"),
+        (3, "FREQRANK[0 - 10]"),
+        (3, "FREQRANK[100 - inf]"),
+    }
+    assert len(balancer.categories_stats) == 4
+
+
+@pytest.mark.parametrize("encoded", [False, True])
+def test_bincount_ngram_computer(encoded: bool):
+    phonemic_freq, boundary = (ENCODED_FREQ, 0) if encoded else (PHONEMIC_FREQ, "_")
+    reference = NGramComputer(phonemic_freq, boundary)
+    computer = BincountNGramComputer(phonemic_freq, boundary)
+    for bounded in (True, False):
+        for ngrams, reference_ngrams in [(computer.unigrams(bounded), reference.unigrams(bounded)),
+                                         (computer.bigrams(bounded), reference.bigrams(bounded))]:
+            # same ngrams, in the same order
+            assert list(ngrams) == list(reference_ngrams)
+            assert list(ngrams.values()) == pytest.approx(list(reference_ngrams.values()))
+
+
+@pytest.mark.parametrize("encoded", [False, True])
+def test_bincount_ngram_computer_empty(encoded: bool):
+    boundary = 0 if encoded else "_"
+    computer = BincountNGramComputer({}, boundary)
+    symbols, counts = computer.compute_counts()
+    assert symbols == [boundary]
+    assert all(len(array) == 0 for array in counts.values())
+    reference = NGramComputer({}, boundary)
+    for bounded in (True, False):
+        assert computer.unigrams(bounded) == reference.unigrams(bounded) == {}
+        assert computer.bigrams(bounded) == reference.bigrams(bounded) == {}
+
+
+def test_phonotactic_model_empty(tmp_path):
+    model = PhonotacticModel.train({}, PhonemeInventory())
+    model.save(tmp_path / "ngrams.bin")
+    loaded_model = PhonotacticModel.load(tmp_path / "ngrams.bin")
+    assert loaded_model.forms_frequencies() == {}
+    scores = loaded_model.scorer().score_forms([b"\x01\x02"])
+    assert all(np.isneginf(score[0]) for score in scores.values())
+
+
+def test_bincount_ngram_computer_from_counts():
+    computer = BincountNGramComputer(ENCODED_FREQ, 0)
+    symbols, counts = computer.compute_counts()
+    loaded_computer = BincountNGramComputer.from_counts(symbols, counts, 0)
+    assert loaded_computer.compute_tables() == computer.compute_tables()
+
+
+@pytest.mark.filterwarnings("ignore:divide by zero")
+def test_batch_ngram_scorer():
+    reference = NGramComputer(ENCODED_FREQ, boundary=0)
+    scorer = BatchNgramScorer.from_computer(BincountNGramComputer(ENCODED_FREQ, 0))
+    # forms of several lengths, some with unseen ngrams
+    forms = list(ENCODED_FREQ) + [encode(("l", "a", "v")), encode(("ʁ", "ʁ")), encode(("k",))]
+    scores = scorer.score_forms(forms)
+
+    zero_prob_counts = {name: 0 for name in scores}
+    for i, form in enumerate(forms):
+        bounded_form = [0] + list(form) + [0]
+        expected = {
+            "unigram_bounded": reference.to_ngram_logprob(bounded_form, reference.unigrams(True)),
+            "unigram_unbounded": reference.to_ngram_logprob(list(form), reference.unigrams(False)),
+            "bigram_bounded": reference.to_ngram_logprob(list(consecutive_pairs(bounded_form)),
+                                                         reference.bigrams(True)),
+            "bigram_unbounded": reference.to_ngram_logprob(list(consecutive_pairs(form)),
+                                                           reference.bigrams(False)),
+        }
+        for name, expected_score in expected.items():
+            assert scores[name][i] == pytest.approx(expected_score), (name, form)
+            zero_prob_counts[name] += int(np.isneginf(expected_score))
+    assert scorer.zero_prob_counts == zero_prob_counts
+    assert zero_prob_counts["bigram_bounded"] > 0
+
+
+@pytest.mark.parametrize("spec", ["1:add-k", "2:add-k:0.5", "3:add-k",
+                                  "1:kneser-ney", "2:kneser-ney", "3:kneser-ney:0.5"])
+def test_smoothed_probabilities_sum_to_one(spec: str):
+    model = SmoothedNgramModel(ENCODED_FREQ, NgramModelSpec.parse(spec))
+    symbols_count = model.symbols_count
+    predicted = np.unique(model.ngram_ids[model.order] % symbols_count)
+    assert len(predicted) == model.vocab_size
+
+    # all seen contexts, and some unseen contexts
+    codes = [0] + [code for code in range(1, len(PHONEMES) + 1)]
+    contexts = set(model.context_ids[model.order].tolist())
+    contexts.update(itertools.islice(
+        (sum(code * symbols_count ** i for i, code in enumerate(context))
+         for context in itertools.product(codes, repeat=model.order - 1)), 20))
+    for context in sorted(contexts):
+        probs = model.probabilities(context * symbols_count + predicted, model.order)
+        assert (probs > 0).all()
+        assert probs.sum() == pytest.approx(1.0), context
+
+
+def test_smoothed_model_from_arrays():
+    spec = NgramModelSpec.parse("3:kneser-ney")
+    model = SmoothedNgramModel(ENCODED_FREQ, spec)
+    loaded_model = SmoothedNgramModel.from_arrays(spec, model.arrays(), model.vocab_size)
+    forms = list(ENCODED_FREQ) + [encode(("ʁ", "ʁ"))]
+    np.testing.assert_array_equal(loaded_model.score_forms(forms), model.score_forms(forms))
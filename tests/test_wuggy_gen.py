@@ -0,0 +1,297 @@
+import random
+import time
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+import pytest
+
+pytest.importorskip("wuggy_ng")
+
+from paraphone.tasks import wuggy_gen
+from paraphone.tasks.wuggy_gen import WuggyGenerator, WordGenerationStats, WuggyLexiconCSV, \
+    WuggyCandidatesCache
+from paraphone.wuggy_plugins import phonetic_fr_ipa
+
+
+class LexicalSequencesGenerator:
+    """Stands in for wuggy's generator, but only generates real words"""
+
+    def __init__(self, sequences_per_round: int, delay: float):
+        self.sequences_per_round = sequences_per_round
+        self.delay = delay
+        self.generated = 0
+        self.statistics = {"lexicality": "W"}
+
+    def set_frequency_filter(self, lower: int, upper: int):
+        pass
+
+    def set_attribute_filter(self, name: str):
+        pass
+
+    def set_statistic(self, name: str):
+        pass
+
+    def set_output_mode(self, mode: str):
+        pass
+
+    def generate(self, clear_cache: bool = False):
+        for i in range(self.sequences_per_round):
+            time.sleep(self.delay)
+            self.generated += 1
+            yield f"a:-v:ɛ:k:{i}"
+
+
+@pytest.fixture
+def wuggy_generator(tmp_path: Path) -> WuggyGenerator:
+    lexicon_path = tmp_path / "lexicon.csv"
+    lexicon_path.write_text("avec\ta:-v:ɛ:k:\t10.0\n")
+    buckets_folder = tmp_path / "buckets"
+    buckets_folder.mkdir()
+    WuggyLexiconCSV.bucket_path(buckets_folder, 2).write_text("avec\ta:-v:ɛ:k:\t10.0\n")
+    return WuggyGenerator(lexicon_path, phonetic_fr_ipa, num_candidates=10,
+                          max_seconds_per_word=0.05, buckets_folder=tmp_path / "buckets")
+
+
+def test_lexical_sequences_time_out(wuggy_generator: WuggyGenerator):
+    gen = LexicalSequencesGenerator(sequences_per_round=100, delay=0.002)
+    word_stats = WordGenerationStats("avec", seconds=0., rounds=0, candidates=0, timed_out=False)
+    candidates = wuggy_generator.wuggy_candidates(gen, word_stats, deadline=time.perf_counter() + 0.05)
+
+    assert candidates == set()
+    assert word_stats.timed_out
+    # the budget is spent during the first round, which isn't finished
+    assert word_stats.rounds == 1
+    assert gen.generated < gen.sequences_per_round
+
+
+def test_lexical_sequences_without_deadline(wuggy_generator: WuggyGenerator):
+    gen = LexicalSequencesGenerator(sequences_per_round=10, delay=0.)
+    word_stats = WordGenerationStats("avec", seconds=0., rounds=0, candidates=0, timed_out=False)
+    candidates = wuggy_generator.wuggy_candidates(gen, word_stats, deadline=None)
+
+    assert candidates == set()
+    assert not word_stats.timed_out
+    assert word_stats.rounds == wuggy_generator.num_candidates - 1
+    assert gen.generated == gen.sequences_per_round * (wuggy_generator.num_candidates - 1)
+
+
+class NonwordSequencesGenerator(LexicalSequencesGenerator):
+    """Stands in for wuggy's generator, but only generates new nonwords"""
+
+    def __init__(self, sequences_per_round: int):
+        super().__init__(sequences_per_round, delay=0.)
+        self.statistics = {"lexicality": "N"}
+
+    def generate(self, clear_cache: bool = False):
+        for _ in range(self.sequences_per_round):
+            self.generated += 1
+            yield f"a:-v:ɛ:k:{self.generated}"
+
+
+@pytest.mark.parametrize("stop_at_num_candidates", [False, True])
+def test_wuggy_candidates_count(wuggy_generator: WuggyGenerator, stop_at_num_candidates: bool):
+    wuggy_generator.stop_at_num_candidates = stop_at_num_candidates
+    gen = NonwordSequencesGenerator(sequences_per_round=100)
+    word_stats = WordGenerationStats("avec", seconds=0., rounds=0, candidates=0, timed_out=False)
+    candidates = wuggy_generator.wuggy_candidates(gen, word_stats, deadline=None)
+
+    num_candidates = wuggy_generator.num_candidates
+    if stop_at_num_candidates:
+        assert len(candidates) == num_candidates
+        assert word_stats.rounds == 1
+    else:
+        # as in wuggy's original output, each of the next rounds adds a candidate
+        assert len(candidates) == num_candidates + num_candidates - 2
+        assert word_stats.rounds == num_candidates - 1
+
+
+class RandomCandidatesGenerator:
+    """Stands in for the worker's wuggy generator, with random candidates"""
+
+    def generate_candidates(self, word: str):
+        word_stats = WordGenerationStats(word, seconds=0., rounds=1, candidates=3, timed_out=False)
+        return {f"{word}{random.randrange(1000)}" for _ in range(3)}, word_stats
+
+
+def test_runner_output_independent_of_words_order(monkeypatch):
+    monkeypatch.setattr(wuggy_gen, "wuggy_generator", RandomCandidatesGenerator(), raising=False)
+    words = ["avec", "bal", "table", "pour"]
+    candidates = {word: wuggy_gen.wuggygen_runner(word)[1] for word in words}
+    # a worker's words (and their order) depend on the pool's scheduling
+    for word in reversed(words):
+        assert wuggy_gen.wuggygen_runner(word)[1] == candidates[word]
+    assert wuggy_gen.word_seed("avec") == wuggy_gen.word_seed("avec") != wuggy_gen.word_seed("bal")
+
+
+class Segment(NamedTuple):
+    letters: str
+    segment_length: int
+
+
+BOUNDARY = Segment("#", 1)
+
+
+class StubBigramChain(dict):
+    """Stands in for wuggy's bigram chain: (position, segment) -> next links
+    and their frequencies"""
+
+    def __init__(self, transitions: List[Tuple[int, str, str, int]]):
+        super().__init__()
+        for position, segment, next_segment, frequency in transitions:
+            self.setdefault((position, self.segment(segment)), {})[
+                (position + 1, self.segment(next_segment))] = frequency
+
+    @staticmethod
+    def segment(letters: str) -> Segment:
+        return BOUNDARY if letters == "#" else Segment(letters, len(letters))
+
+    def get_frequencies(self, sequence: Tuple[Segment, ...]) -> List[int]:
+        return [self[(position, segment)][(position + 1, sequence[position + 1])]
+                for position, segment in enumerate(sequence[:-1])]
+
+
+class StubChainGenerator:
+    """Stands in for wuggy's generator, set on the reference sequence "a v" """
+
+    def __init__(self):
+        # the substitutes' frequency deviation sets their frequency filter round
+        self.bigramchain = StubBigramChain([
+            (0, "#", "a", 10), (1, "a", "v", 10), (2, "v", "#", 10),
+            (0, "#", "o", 10), (1, "o", "v", 10),  # round 1
+            (0, "#", "i", 13), (1, "i", "v", 10),  # round 2
+            (0, "#", "u", 110), (1, "u", "v", 10),  # round 7
+            (0, "#", "ai", 10), (1, "ai", "v", 10),  # longer segment
+            (1, "a", "k", 10), (2, "k", "#", 10),  # round 1
+            (1, "a", "t", 14), (2, "t", "#", 10),  # round 2
+            (1, "a", "z", 10), (2, "z", "#", 10),  # round 1, real word
+            (1, "a", "s", 10),  # no link to the word boundary
+        ])
+        self.reference_sequence = (BOUNDARY, Segment("a", 1), Segment("v", 1), BOUNDARY)
+        self.current_sequence = None
+
+
+class StubPlugin:
+    real_words = {"a z"}
+
+    @staticmethod
+    def output_syllabic(sequence: Tuple[Segment, ...]) -> str:
+        return " ".join(segment.letters for segment in sequence[1:-1])
+
+    @classmethod
+    def statistic_lexicality(cls, generator: StubChainGenerator, sequence: Tuple[Segment, ...]):
+        return "W" if cls.output_syllabic(sequence) in cls.real_words else "N"
+
+
+def test_high_overlap_candidates(wuggy_generator: WuggyGenerator, monkeypatch):
+    monkeypatch.setattr(wuggy_generator, "wuggy_plugin", StubPlugin)
+    wuggy_generator.num_candidates = 5
+    word_stats = WordGenerationStats("avec", seconds=0., rounds=0, candidates=0, timed_out=False)
+    candidates = wuggy_generator.high_overlap_candidates(StubChainGenerator(), word_stats,
+                                                         deadline=None)
+    # substitutes needing a round beyond num_candidates - 1 are left out
+    assert candidates == {"o v", "i v", "a k", "a t"}
+    assert word_stats.rounds == 4
+    assert not word_stats.timed_out
+
+
+def test_high_overlap_candidates_early_exit(wuggy_generator: WuggyGenerator, monkeypatch):
+    monkeypatch.setattr(wuggy_generator, "wuggy_plugin", StubPlugin)
+    wuggy_generator.num_candidates = 2
+    word_stats = WordGenerationStats("avec", seconds=0., rounds=0, candidates=0, timed_out=False)
+    candidates = wuggy_generator.high_overlap_candidates(StubChainGenerator(), word_stats,
+                                                         deadline=None)
+    # the first round's candidates are enough
+    assert candidates == {"o v", "a k"}
+    assert word_stats.rounds == 1
+
+
+class RecordingGenerator:
+    """Stands in for wuggy's generator, recording the files it's loaded from"""
+
+    def __init__(self):
+        self.loaded = {}
+
+    def load(self, plugin, data_file):
+        self.loaded["chain"] = data_file.name
+
+    def load_word_lexicon(self, lexicon_file):
+        self.loaded["word"] = lexicon_file.name
+        self.word_lexicon = {"avec": 10.0}
+
+    def load_neighbor_lexicon(self, lexicon_file):
+        self.loaded["neighbor"] = lexicon_file.name
+        self.neighbor_lexicon = ["avec"]
+
+    def load_lookup_lexicon(self, lexicon_file):
+        self.loaded["lookup"] = lexicon_file.name
+        self.lookup_lexicon = {"avec": "a:-v:ɛ:k:"}
+
+
+def test_bucket_generator_uses_full_lexicon(wuggy_generator: WuggyGenerator, monkeypatch):
+    monkeypatch.setattr(wuggy_gen, "Generator", RecordingGenerator)
+    gen = wuggy_generator.generator_for("a:-v:ɛ:k:")
+
+    bucket_path = WuggyLexiconCSV.bucket_path(wuggy_generator.buckets_folder, 2)
+    # only the bigram chain is built from the syllables count bucket, real
+    # words of any syllables count are known to the lexicality check
+    assert gen.loaded == {"chain": str(bucket_path),
+                          "word": str(wuggy_generator.lexicon_path),
+                          "neighbor": str(wuggy_generator.lexicon_path),
+                          "lookup": str(wuggy_generator.lexicon_path)}
+    assert wuggy_generator.generator_for("v:ɛ:-k:a:") is gen
+
+    # another bucket's generator only loads its bigram chain, and shares the lexicons
+    WuggyLexiconCSV.bucket_path(wuggy_generator.buckets_folder, 1).write_text("bal\tb:a:l:\t5.0\n")
+    other_gen = wuggy_generator.generator_for("b:a:l:")
+    assert other_gen.loaded == {"chain": str(WuggyLexiconCSV.bucket_path(
+        wuggy_generator.buckets_folder, 1))}
+    for lexicon in ("word_lexicon", "neighbor_lexicon", "lookup_lexicon"):
+        assert getattr(other_gen, lexicon) is getattr(gen, lexicon)
+
+
+@pytest.fixture
+def cache_lexicon(tmp_path: Path) -> Path:
+    lexicon_path = tmp_path / "lexicon.csv"
+    lexicon_path.write_text("avec\ta:-v:ɛ:k:\t10.0\nbal\tb:a:l:\t5.0\n")
+    return lexicon_path
+
+
+def test_candidates_cache_hits(tmp_path: Path, cache_lexicon: Path):
+    cache_folder = tmp_path / "cache"
+    cache = WuggyCandidatesCache(cache_folder, cache_lexicon, num_candidates=10, seed=42)
+    cache.load()
+    assert cache.get("a:-v:ɛ:k:") is None
+    cache.add("a:-v:ɛ:k:", {"a:-v:ɛ:t:", "o:-v:ɛ:k:"})
+    assert cache.flush() == 1
+    cache.add("b:a:l:", set())
+    assert cache.flush() == 1
+    assert cache.flush() == 0
+
+    # another workspace with the same lexicon and parameters reuses the entries
+    cache = WuggyCandidatesCache(cache_folder, cache_lexicon, num_candidates=10, seed=42)
+    cache.load()
+    assert cache.get("a:-v:ɛ:k:") == {"a:-v:ɛ:t:", "o:-v:ɛ:k:"}
+    assert cache.get("b:a:l:") == set()
+    assert cache.get("p:a:l:") is None
+    # entries are appended to the cache file, under a single header
+    assert cache.file_path.read_text().count("syllabic\tcandidates") == 1
+
+
+@pytest.mark.parametrize("change", ["lexicon", "seed", "num_candidates", "high_overlap",
+                                    "stop_at_num_candidates"])
+def test_candidates_cache_invalidation(tmp_path: Path, cache_lexicon: Path, change: str):
+    cache_folder = tmp_path / "cache"
+    cache = WuggyCandidatesCache(cache_folder, cache_lexicon, num_candidates=10, seed=42)
+    cache.add("a:-v:ɛ:k:", {"a:-v:ɛ:t:"})
+    cache.flush()
+
+    params = dict(num_candidates=10, seed=42, high_overlap=False, stop_at_num_candidates=False)
+    if change == "lexicon":
+        cache_lexicon.write_text("avec\ta:-v:ɛ:k:\t12.0\nbal\tb:a:l:\t5.0\n")
+    elif change in ("high_overlap", "stop_at_num_candidates"):
+        params[change] = True
+    else:
+        params[change] += 1
+    cache = WuggyCandidatesCache(cache_folder, cache_lexicon, **params)
+    cache.load()
+    assert cache.get("a:-v:ɛ:k:") is None